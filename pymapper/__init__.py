@@ -1,3 +1,55 @@
-from .transformation import ImageTransformation
-from .map import Map
-from .layer import LayerType, GeoPandasLayer
+"""
+PyMapper, a map rendering library for python using pycairo.
+
+The public classes are imported when they are first used, so ``import pymapper``
+doesn't import geopandas, pandas or pyproj until a map or layer needs them.
+"""
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+
+_EXPORTS = {
+    "ImageTransformation": ".transformation",
+    "Map": ".map",
+    "LayerType": ".layer",
+    "GeoPandasLayer": ".layer",
+    "FileLayer": ".layer",
+    "WMSLayer": ".layer",
+    "WMTSLayer": ".layer",
+    "RasterLayer": ".layer",
+    "SnapshotLayer": ".layer",
+    "Style": ".style",
+    "CategorizedStyle": ".style",
+    "ClassifiedStyle": ".style",
+    "LabelStyle": ".label",
+    "RenderCache": ".cache",
+}
+"""The module every public name is imported from."""
+
+__all__ = list(_EXPORTS)
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .transformation import ImageTransformation
+    from .map import Map
+    from .layer import (
+        LayerType, GeoPandasLayer, FileLayer, WMSLayer, WMTSLayer, RasterLayer,
+        SnapshotLayer
+    )
+    from .style import Style, CategorizedStyle, ClassifiedStyle
+    from .label import LabelStyle
+    from .cache import RenderCache
+
+
+def __getattr__(name):
+    """Import a public name on first access."""
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    """List the module attributes, including the names not imported yet."""
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,267 @@
+"""
+Benchmarks for the transformation, reprojection and rendering hot paths.
+
+Run the suite with::
+
+    python -m pymapper.benchmark --sizes 1000 100000 --output results.json
+
+and compare the results of two versions with::
+
+    python -m pymapper.benchmark --compare old.json new.json
+
+Every benchmark runs on synthetic points, lines and polygons for every size, and
+the results are written as JSON with the minimum and median time of the repeats.
+"""
+import argparse
+import gc
+import io
+import json
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from importlib.metadata import PackageNotFoundError, version
+import numpy as np
+import shapely
+from geopandas import GeoDataFrame
+from pyproj.crs.crs import CRS
+from .layer import GeoPandasLayer
+from .map import Map
+from .render import transform_coords
+from .transformation import ImageTransformation
+
+
+SIZES = (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7)
+"""Default numbers of features."""
+
+GEOMETRY_TYPES = ("points", "lines", "polygons")
+
+BBOX = (-170.0, -80.0, 170.0, 80.0)
+"""The bbox in EPSG:4326 the synthetic features are generated in."""
+
+VERTICES = 8
+"""The number of vertices of the synthetic lines and polygons."""
+
+
+def make_data(geometry_type: str, size: int, seed: int = 0) -> GeoDataFrame:
+    """Generate a GeoDataFrame with random features in EPSG:4326.
+
+    Args:
+        geometry_type (str): One of "points", "lines" or "polygons".
+        size (int): The number of features.
+        seed (int): The random seed.
+
+    Returns:
+        geopandas.GeoDataFrame: The features.
+    """
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = BBOX
+    centers = rng.uniform((minx, miny), (maxx, maxy), (size, 2))
+    if geometry_type == "points":
+        geometries = shapely.points(centers)
+    else:
+        angles = np.linspace(0, 2 * np.pi, VERTICES, endpoint=False)
+        radius = rng.uniform(0.01, 0.5, (size, 1))
+        coords = np.stack([
+            centers[:, :1] + radius * np.cos(angles),
+            centers[:, 1:] + radius * np.sin(angles),
+        ], axis=-1)
+        indices = np.repeat(np.arange(size), VERTICES)
+        if geometry_type == "lines":
+            geometries = shapely.linestrings(coords.reshape(-1, 2), indices=indices)
+        else:
+            geometries = shapely.polygons(
+                shapely.linearrings(coords.reshape(-1, 2), indices=indices)
+            )
+    return GeoDataFrame(geometry=geometries, crs="EPSG:4326")
+
+
+def _time(func, repeat: int):
+    """Time a function, with the garbage collector disabled."""
+    times = []
+    for _ in range(repeat):
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return times
+
+
+def bench_transformation(data, repeat):
+    """Construct an ImageTransformation for the data bounds."""
+    bbox = tuple(data.total_bounds)
+    return _time(lambda: ImageTransformation(bbox, 1024, 768), repeat)
+
+
+def bench_matrix(data, repeat):
+    """Apply the transformation matrix to all coordinates of the data."""
+    coords = shapely.get_coordinates(data.geometry.values)
+    matrix = ImageTransformation(tuple(data.total_bounds), 1024, 768)
+    matrix = matrix.get_shapely_matrix()
+    return _time(lambda: transform_coords(coords, matrix), repeat)
+
+
+def bench_set_crs(data, repeat):
+    """Set a new crs on a layer and reproject all geometries."""
+    crs = CRS.from_epsg(3857)
+
+    def _run():
+        layer = GeoPandasLayer("bench", data)
+        layer.set_crs(crs)
+        layer.get_geometries()
+    return _time(_run, repeat)
+
+
+def bench_add_layer(data, repeat):
+    """Add a layer to a map, including the bbox merge."""
+    layer = GeoPandasLayer("bench", data)
+
+    def _run():
+        _map = Map(1024, 768, crs="EPSG:4326", bbox=(0, 0, 1, 1))
+        _map.add_layer(layer)
+        return _map.transformation
+    return _time(_run, repeat)
+
+
+def bench_render(data, repeat):
+    """Render a map with the layer to PNG, end to end."""
+    _map = Map(1024, 768, crs="EPSG:3857")
+    _map.add_layer(GeoPandasLayer("bench", data))
+    return _time(lambda: _map.render(io.BytesIO()), repeat)
+
+
+def bench_hit_test(data, repeat):
+    """Find the features under 1000 pixels of a prepared layer."""
+    _map = Map(1024, 768, crs="EPSG:3857")
+    _map.add_layer(GeoPandasLayer("bench", data))
+    _map.prepare()
+    px, py = np.random.default_rng(0).uniform((0, 0), (1024, 768), (1000, 2)).T
+    return _time(lambda: _map.hit_test(px, py), repeat)
+
+
+BENCHMARKS = {
+    "transformation": bench_transformation,
+    "matrix": bench_matrix,
+    "set_crs": bench_set_crs,
+    "add_layer": bench_add_layer,
+    "render": bench_render,
+    "hit_test": bench_hit_test,
+}
+"""The benchmarks by name."""
+
+
+def run(sizes=SIZES, geometry_types=GEOMETRY_TYPES, names=None, repeat=3,
+        log=None):
+    """Run the benchmarks.
+
+    Args:
+        sizes (iterable): The numbers of features.
+        geometry_types (iterable): The geometry types, see :func:`make_data`.
+        names (iterable): The names of the benchmarks to run, defaults to all
+            :data:`BENCHMARKS`.
+        repeat (int): The number of times every benchmark is timed.
+        log (callable): Called with a message after every benchmark.
+
+    Returns:
+        dict: The results, with the environment and a list of results with the
+        ``name``, ``geometry_type``, ``size``, ``times``, ``min`` and ``median`` of
+        every benchmark.
+    """
+    names = list(BENCHMARKS) if names is None else list(names)
+    results = []
+    for geometry_type in geometry_types:
+        for size in sizes:
+            data = make_data(geometry_type, size)
+            for name in names:
+                times = BENCHMARKS[name](data, repeat)
+                result = {
+                    "name": name,
+                    "geometry_type": geometry_type,
+                    "size": size,
+                    "times": times,
+                    "min": min(times),
+                    "median": statistics.median(times),
+                }
+                results.append(result)
+                if log is not None:
+                    log(f"{name:16}{geometry_type:10}{size:>10}  "
+                        f"{result['min']:.6f}s")
+    return {
+        "pymapper": _version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "results": results,
+    }
+
+
+def _version():
+    """Get the installed pymapper version."""
+    try:
+        return version("pymapper")
+    except PackageNotFoundError:
+        return None
+
+
+def compare(old, new):
+    """Compare two result sets.
+
+    Args:
+        old (dict): Results of :func:`run`.
+        new (dict): Results of :func:`run`.
+
+    Returns:
+        list: (name, geometry_type, size, old min, new min, new/old ratio) for every
+        benchmark in both result sets.
+    """
+    def _key(result):
+        return (result["name"], result["geometry_type"], result["size"])
+
+    old_results = {_key(result): result for result in old["results"]}
+    rows = []
+    for result in new["results"]:
+        previous = old_results.get(_key(result))
+        if previous is not None:
+            rows.append(_key(result) + (
+                previous["min"], result["min"], result["min"] / previous["min"]
+            ))
+    return rows
+
+
+def main(argv=None):
+    """Run the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--geometry-types", nargs="+", default=GEOMETRY_TYPES,
+                        choices=GEOMETRY_TYPES)
+    parser.add_argument("--benchmarks", nargs="+", default=list(BENCHMARKS),
+                        choices=list(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="File to write the JSON results to.")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="Compare two JSON result files instead of running.")
+    args = parser.parse_args(argv)
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as file:
+            old = json.load(file)
+        with open(args.compare[1], encoding="utf-8") as file:
+            new = json.load(file)
+        for name, geometry_type, size, before, after, ratio in compare(old, new):
+            print(f"{name:16}{geometry_type:10}{size:>10}  "
+                  f"{before:.6f}s -> {after:.6f}s  x{ratio:.2f}")
+        return
+    results = run(args.sizes, args.geometry_types, args.benchmarks, args.repeat,
+                  log=lambda message: print(message, file=sys.stderr))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Define the caches used to keep prepared data and rendered images between renders.
+"""
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+from threading import RLock
+
+
+class LRUCache:  # pylint: disable=R0902
+    """Mapping that evicts the least recently used items beyond ``maxsize`` items.
+
+    The cache can also be bounded by the total size of the items, for instance the
+    number of bytes of encoded images. The cache is safe to use from multiple
+    threads.
+
+    Args:
+        maxsize (int): The maximum number of items to keep.
+        maxbytes (int): The maximum total size of the items, or None for no limit.
+        sizeof (callable): Function returning the size of an item (default
+            :func:`len`). Only used when ``maxbytes`` is set.
+        on_evict (callable): Called as ``on_evict(key, value)`` for every item that
+            is evicted.
+
+    Attributes:
+        maxsize (int): The maximum number of items to keep.
+        maxbytes (int): The maximum total size of the items.
+        currbytes (int): The current total size of the items.
+        hits (int): The number of successful lookups.
+        misses (int): The number of failed lookups.
+    """
+
+    def __init__(  # pylint: disable=R0913
+        self, maxsize: int = 128, maxbytes: int = None, sizeof=len, on_evict=None
+    ):
+        """Initialize the class."""
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.currbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._sizeof = sizeof
+        self._on_evict = on_evict
+        self._items = OrderedDict()
+        self._lock = RLock()
+
+    def _size(self, value):
+        """Get the size of an item, or 0 when the cache isn't bounded by size."""
+        return 0 if self.maxbytes is None else self._sizeof(value)
+
+    def get(self, key, default=None):
+        """Get an item and mark it as most recently used.
+
+        Args:
+            key: The key of the item.
+            default: The value to return if the key is not in the cache.
+
+        Returns:
+            The cached item or ``default``.
+        """
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Add an item, evicting the least recently used items if the cache is full.
+
+        Args:
+            key: The key of the item.
+            value: The item to cache.
+        """
+        with self._lock:
+            if key in self._items:
+                self.currbytes -= self._size(self._items[key])
+            self._items[key] = value
+            self._items.move_to_end(key)
+            self.currbytes += self._size(value)
+            while len(self._items) > self.maxsize or (
+                self.maxbytes is not None and self.currbytes > self.maxbytes
+                and len(self._items) > 1
+            ):
+                old_key, old_value = self._items.popitem(last=False)
+                self.currbytes -= self._size(old_value)
+                if self._on_evict is not None:
+                    self._on_evict(old_key, old_value)
+
+    def clear(self):
+        """Remove all items."""
+        with self._lock:
+            self._items.clear()
+            self.currbytes = 0
+
+    def __getstate__(self):
+        """Get the state for pickling, without the lock."""
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        """Restore the state after unpickling."""
+        self.__dict__.update(state)
+        self._lock = RLock()
+
+    def __contains__(self, key):
+        """Test whether key is cached, without marking it as used."""
+        with self._lock:
+            return key in self._items
+
+    def values(self):
+        """Get a list of the cached items, without marking them as used."""
+        with self._lock:
+            return list(self._items.values())
+
+    def __len__(self):
+        """Get the number of cached items."""
+        with self._lock:
+            return len(self._items)
+
+
+def make_key(*parts) -> str:
+    """Make a content hash key from hashable parts.
+
+    Args:
+        *parts: Values with a stable ``repr``, like tuples of numbers and strings.
+
+    Returns:
+        str: Hexadecimal sha256 digest of the parts.
+    """
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+class RenderCache:
+    """Cache for encoded images, with LRU eviction and an optional disk store.
+
+    Images are kept in memory up to ``maxbytes`` bytes. When a ``directory`` is
+    given, images evicted from memory are written to that directory and read back
+    from it on a later lookup.
+
+    Args:
+        maxbytes (int): The maximum number of bytes to keep in memory.
+        maxsize (int): The maximum number of images to keep in memory.
+        directory (str): Directory to spill evicted images to, or None to drop
+            them.
+
+    Attributes:
+        memory (LRUCache): The in-memory cache.
+        directory (str): The directory with spilled images.
+        disk_hits (int): The number of lookups served from the disk store.
+    """
+
+    def __init__(self, maxbytes: int = 256 * 2 ** 20, maxsize: int = 100000,
+                 directory: str = None):
+        """Initialize the class."""
+        self.directory = directory
+        self.disk_hits = 0
+        self.memory = LRUCache(
+            maxsize, maxbytes, on_evict=self._spill if directory else None
+        )
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        """Get the path of an image in the disk store."""
+        return os.path.join(self.directory, key[:2], key)
+
+    def _spill(self, key: str, data: bytes):
+        """Write an evicted image to the disk store."""
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path), delete=False
+        ) as file:
+            file.write(data)
+        os.replace(file.name, path)
+
+    def get(self, key: str):
+        """Get an image from memory or from the disk store.
+
+        Args:
+            key (str): The image key, see :func:`make_key`.
+
+        Returns:
+            bytes: The encoded image or None if it isn't cached.
+        """
+        data = self.memory.get(key)
+        if data is None and self.directory is not None:
+            try:
+                with open(self._path(key), "rb") as file:
+                    data = file.read()
+            except FileNotFoundError:
+                return None
+            self.disk_hits += 1
+            self.memory.put(key, data)
+        return data
+
+    def put(self, key: str, data: bytes):
+        """Cache an encoded image.
+
+        Args:
+            key (str): The image key, see :func:`make_key`.
+            data (bytes): The encoded image.
+        """
+        self.memory.put(key, data)
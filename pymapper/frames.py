@@ -0,0 +1,154 @@
+"""
+Render sequences of frames of a map, for pan/zoom and time-series animations.
+
+Every frame is an :class:`ImageTransformation`, a ``(start, end)`` time slice, or a
+:class:`Frame` combining both. The map is prepared once, see
+:meth:`pymapper.Map.prepare`, so frames only swap the transformation or the time
+filter of the layers and reuse the reprojected geometries and spatial indexes.
+"""
+import io
+import os
+from .layer.geopandas import GeoPandasLayer
+from .tiles import map_batched
+from .transformation import ImageTransformation
+
+
+class Frame:  # pylint: disable=R0903
+    """A frame of an animation.
+
+    Args:
+        transformation (ImageTransformation): The transformation to render with,
+            or None for the map transformation.
+        time (tuple): (start, end) to only draw features with ``start <= time <
+            end``, or None to draw all features.
+
+    Attributes:
+        transformation (ImageTransformation): The transformation to render with.
+        time (tuple): The time slice.
+    """
+
+    def __init__(self, transformation: ImageTransformation = None, time=None):
+        """Initialize the class."""
+        self.transformation = transformation
+        self.time = time
+
+
+def as_frame(frame) -> Frame:
+    """Get a :class:`Frame` for a transformation, time slice or frame."""
+    if isinstance(frame, Frame):
+        return frame
+    if isinstance(frame, ImageTransformation):
+        return Frame(transformation=frame)
+    return Frame(time=tuple(frame))
+
+
+def directory_sink(path: str):
+    """Get a sink that writes frames as numbered PNG files.
+
+    Args:
+        path (str): The directory to write ``{index:06d}.png`` files to.
+
+    Returns:
+        callable: ``sink(index, data)``
+    """
+    os.makedirs(path, exist_ok=True)
+
+    def _sink(index, data):
+        with open(os.path.join(path, f"{index:06d}.png"), "wb") as file:
+            file.write(data)
+    return _sink
+
+
+def set_time_range(_map, time_column, time):
+    """Set the time slice on the layers of a map that have the time column.
+
+    Args:
+        _map (Map): The map.
+        time_column (str): The name of the time column.
+        time (tuple): (start, end) of the time slice, or None to draw all features.
+    """
+    for layer in _map.layers:
+        if isinstance(layer, GeoPandasLayer) and time_column in layer.data.columns:
+            if time is None:
+                layer.set_time_range(None)
+            else:
+                layer.set_time_range(time_column, *time)
+
+
+def render_frame(_map, frame, time_column: str = None) -> bytes:
+    """Render a single frame of a map to PNG.
+
+    Args:
+        _map (Map): The map to render.
+        frame: An :class:`ImageTransformation`, (start, end) time slice or
+            :class:`Frame`.
+        time_column (str): The column of the time slices.
+
+    Returns:
+        bytes: The PNG image.
+    """
+    frame = as_frame(frame)
+    # Frames without a time slice draw all features, whatever the frame before.
+    set_time_range(_map, time_column, frame.time)
+    buffer = io.BytesIO()
+    _map.render(buffer, transformation=frame.transformation)
+    return buffer.getvalue()
+
+
+_WORKER_MAP = None
+
+
+def _init_worker(_map):
+    """Keep the map in the worker process, so it is only sent once per worker."""
+    global _WORKER_MAP  # pylint: disable=W0603
+    _WORKER_MAP = _map
+
+
+def _render_worker_frame(item, time_column):
+    """Render an (index, frame) item with the map of the worker process."""
+    index, frame = item
+    return index, render_frame(_WORKER_MAP, frame, time_column)
+
+
+def render_frames(  # pylint: disable=R0913
+    _map, frames, sink, time_column: str = None, workers: int = None,
+    chunksize: int = 1
+):
+    """Render frames of a map, spread over a pool of worker processes.
+
+    The map, including its prepared layers, is sent to every worker process once
+    when the worker starts. Only the frames and the resulting images are sent per
+    frame. The frames are submitted in bounded batches, see
+    :func:`pymapper.tiles.map_batched`, so long or lazy sequences of frames aren't
+    queued all at once. The images are passed to the sink in frame order.
+
+    Args:
+        _map (Map): The map to render.
+        frames (iterable): :class:`ImageTransformation`, (start, end) time slices
+            or :class:`Frame` instances.
+        sink (callable): Called as ``sink(index, data)`` with the PNG data of every
+            frame, in the parent process.
+        time_column (str): The column of the time slices.
+        workers (int): The number of worker processes, defaults to the number of
+            cpus. With 1 worker the frames are rendered in the current process.
+        chunksize (int): The number of frames sent to a worker at once.
+
+    Returns:
+        int: The number of rendered frames.
+    """
+    rendered = 0
+    if workers == 1:
+        try:
+            for index, frame in enumerate(frames):
+                sink(index, render_frame(_map, frame, time_column))
+                rendered += 1
+        finally:
+            set_time_range(_map, time_column, None)
+        return rendered
+    for index, data in map_batched(
+        _render_worker_frame, enumerate(frames), time_column, workers=workers,
+        chunksize=chunksize, initializer=_init_worker, initargs=(_map,)
+    ):
+        sink(index, data)
+        rendered += 1
+    return rendered
@@ -0,0 +1,235 @@
+"""
+Timings and counts per layer and per stage of :meth:`pymapper.Map.render`.
+
+A :class:`Instrumentation` sends :class:`Event` instances to its sinks, which are
+callables like a user function or a :class:`MetricsCollector`. While a map renders,
+its instrumentation is the current instrumentation, so layers and the drawing
+functions can report to it with::
+
+    instrumentation = get_instrumentation()
+    with instrumentation.stage("reproject"):
+        ...
+    instrumentation.count("features_drawn", len(geometries))
+
+The stages reported by pymapper are ``render`` for every layer as a whole,
+``reproject``, ``cull``, ``classify``, ``simplify``, ``label``, ``read``, ``fetch``,
+``clip``, ``path``, ``draw`` and ``encode``. The counts are ``features_considered``,
+``features_drawn``, ``features_encoded``, ``features_reprojected``, ``vertices``,
+``cache_hits`` and ``cache_misses``.
+"""
+import time
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from threading import Lock
+
+
+Event = namedtuple("Event", ["kind", "layer", "name", "value"])
+Event.__doc__ = """An instrumentation event.
+
+Attributes:
+    kind (str): "timing" for stage timings in seconds, or "count".
+    layer (str): The name of the layer, or None for map level events.
+    name (str): The name of the stage or count.
+    value (float): The number of seconds or the count.
+"""
+
+_CURRENT = ContextVar("pymapper_instrumentation", default=None)
+_LAYER = ContextVar("pymapper_layer", default=None)
+
+
+class Instrumentation:
+    """Sends timing and count events to sinks.
+
+    Without sinks, timing and counting do nothing, so instrumented code costs
+    next to nothing when no one listens.
+
+    Args:
+        *sinks (callable): Called with every :class:`Event`.
+
+    Attributes:
+        sinks (list): The sinks.
+    """
+
+    def __init__(self, *sinks):
+        """Initialize the class."""
+        self.sinks = list(sinks)
+
+    def add_sink(self, sink):
+        """Add a sink.
+
+        Args:
+            sink (callable): Called with every :class:`Event`.
+        """
+        self.sinks.append(sink)
+
+    @property
+    def enabled(self) -> bool:
+        """Whether there are any sinks."""
+        return bool(self.sinks)
+
+    def emit(self, event: Event):
+        """Send an event to all sinks."""
+        for sink in self.sinks:
+            sink(event)
+
+    @contextmanager
+    def activate(self):
+        """Make this the current instrumentation within the context."""
+        token = _CURRENT.set(self)
+        try:
+            yield self
+        finally:
+            _CURRENT.reset(token)
+
+    @staticmethod
+    @contextmanager
+    def layer(name):
+        """Attribute events within the context to a layer.
+
+        Args:
+            name (str): The name of the layer.
+        """
+        token = _LAYER.set(name)
+        try:
+            yield
+        finally:
+            _LAYER.reset(token)
+
+    def stage(self, name: str):
+        """Time a stage.
+
+        Args:
+            name (str): The name of the stage.
+
+        Returns:
+            A context manager that emits a "timing" event when it exits.
+        """
+        if not self.sinks:
+            return nullcontext()
+        return self._time(name)
+
+    @contextmanager
+    def _time(self, name):
+        """Time the context and emit a timing event."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.emit(Event("timing", _LAYER.get(), name,
+                            time.perf_counter() - start))
+
+    def count(self, name: str, value: int = 1):
+        """Emit a count.
+
+        Args:
+            name (str): The name of the count.
+            value (int): The count.
+        """
+        if self.sinks:
+            self.emit(Event("count", _LAYER.get(), name, value))
+
+
+NULL_INSTRUMENTATION = Instrumentation()
+"""Instrumentation without sinks, used when no instrumentation is active."""
+
+
+def get_instrumentation() -> Instrumentation:
+    """Get the current instrumentation.
+
+    Returns:
+        Instrumentation: The instrumentation of the map that is rendering, or
+        :data:`NULL_INSTRUMENTATION`.
+    """
+    instrumentation = _CURRENT.get()
+    return NULL_INSTRUMENTATION if instrumentation is None else instrumentation
+
+
+class MetricsCollector:
+    """Sink that aggregates events into totals per layer and name.
+
+    Attributes:
+        seconds (dict): Total seconds per (layer, stage).
+        calls (dict): Number of timings per (layer, stage).
+        counts (dict): Total count per (layer, name).
+    """
+
+    def __init__(self):
+        """Initialize the class."""
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counts = defaultdict(int)
+        self._lock = Lock()
+
+    def __getstate__(self):
+        """Get the state for pickling, without the lock."""
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        """Restore the state after unpickling."""
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    def __call__(self, event: Event):
+        """Add an event to the totals."""
+        key = (event.layer, event.name)
+        with self._lock:
+            if event.kind == "timing":
+                self.seconds[key] += event.value
+                self.calls[key] += 1
+            else:
+                self.counts[key] += event.value
+
+    def reset(self):
+        """Reset all totals."""
+        with self._lock:
+            self.seconds.clear()
+            self.calls.clear()
+            self.counts.clear()
+
+    def to_prometheus(self, prefix: str = "pymapper") -> str:
+        """Format the totals in the Prometheus text exposition format.
+
+        Args:
+            prefix (str): The prefix of the metric names.
+
+        Returns:
+            str: ``{prefix}_stage_seconds_total``, ``{prefix}_stage_calls_total``
+            and ``{prefix}_{name}_total`` metrics with ``layer`` and ``stage``
+            labels.
+        """
+        lines = []
+        with self._lock:
+            for metric, values, label in (
+                ("stage_seconds_total", self.seconds, "stage"),
+                ("stage_calls_total", self.calls, "stage"),
+            ):
+                lines.append(f"# TYPE {prefix}_{metric} counter")
+                for (layer, name), value in sorted(values.items(), key=_sort_key):
+                    lines.append(f'{prefix}_{metric}{{layer="{_escape(layer)}",'
+                                 f'{label}="{name}"}} {value}')
+            for name in sorted({name for _, name in self.counts}):
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                for (layer, count_name), value in sorted(
+                    self.counts.items(), key=_sort_key
+                ):
+                    if count_name == name:
+                        lines.append(
+                            f'{prefix}_{name}_total{{layer="{_escape(layer)}"}} {value}'
+                        )
+        return "\n".join(lines) + "\n"
+
+
+def _sort_key(item):
+    """Sort (layer, name) keys with None layers first."""
+    (layer, name), _ = item
+    return (layer or "", name)
+
+
+def _escape(value):
+    """Escape a Prometheus label value."""
+    if value is None:
+        return ""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,286 @@
+"""
+Place and draw text labels for the features of a vector layer.
+
+Labels are placed in pixel space in order of priority. Every placed label is
+inserted in a :class:`CollisionGrid`, a uniform grid of cells that only compares
+a new label with the labels in the cells it overlaps. Placing ``n`` labels costs
+a sort and ``n`` grid lookups, instead of comparing every pair of labels.
+"""
+from collections import defaultdict
+from typing import Union
+import cairo
+import numpy as np
+import shapely
+from .render import transform_coords
+from .style import Color
+
+
+CELL_SIZE = 32
+"""Default size in pixels of the cells of the collision grid."""
+
+
+class LabelStyle:  # pylint: disable=R0902,R0903
+    """Style and placement rules for the labels of a vector layer.
+
+    Points are labeled to the right of the point, or to the left, above or below
+    it when that position is taken. Lines are labeled at their midpoint and
+    polygons at a point on their surface.
+
+    Args:
+        column (str): The column with the label text.
+        priority (str): A numerical column, features with higher values are
+            labeled first. Without a priority column, features are labeled in row
+            order.
+        font_family (str): The font family.
+        font_size (float): The font size in pixels.
+        bold (bool): Whether to use a bold font.
+        color (tuple): The text color.
+        offset (float): The distance in pixels between a point and its label.
+        padding (float): The minimum distance in pixels between labels.
+
+    Attributes:
+        column (str): The column with the label text.
+        priority (str): The priority column.
+        font_family (str): The font family.
+        font_size (float): The font size in pixels.
+        bold (bool): Whether to use a bold font.
+        color (tuple): The text color.
+        offset (float): The distance in pixels between a point and its label.
+        padding (float): The minimum distance in pixels between labels.
+    """
+
+    KEYS = ("column", "priority", "font_family", "font_size", "bold", "color",
+            "offset", "padding")
+
+    def __init__(  # pylint: disable=R0913
+        self,
+        column: str,
+        priority: Union[str, None] = None,
+        font_family: str = "sans-serif",
+        font_size: float = 10.0,
+        bold: bool = False,
+        color: Color = (0.0, 0.0, 0.0, 1.0),
+        offset: float = 4.0,
+        padding: float = 2.0,
+    ):
+        """Initialize the class."""
+        self.column = column
+        self.priority = priority
+        self.font_family = font_family
+        self.font_size = font_size
+        self.bold = bold
+        self.color = color
+        self.offset = offset
+        self.padding = padding
+
+    def key(self):
+        """Get a hashable key identifying the label style.
+
+        Returns:
+            tuple: The class name and the style values.
+        """
+        return (self.__class__.__name__,) + tuple(
+            getattr(self, key) for key in self.KEYS
+        )
+
+    def set_font(self, context):
+        """Select the font on a context."""
+        weight = cairo.FONT_WEIGHT_BOLD if self.bold else cairo.FONT_WEIGHT_NORMAL
+        context.select_font_face(self.font_family, cairo.FONT_SLANT_NORMAL, weight)
+        context.set_font_size(self.font_size)
+
+
+class CollisionGrid:
+    """Uniform grid of boxes in pixel space for fast overlap tests.
+
+    Args:
+        cell_size (float): The width and height of a cell in pixels.
+
+    Attributes:
+        cell_size (float): The width and height of a cell in pixels.
+    """
+
+    def __init__(self, cell_size: float = CELL_SIZE):
+        """Initialize the class."""
+        self.cell_size = cell_size
+        self._cells = defaultdict(list)
+
+    def _cells_for(self, box):
+        """Get the keys of the cells a box overlaps."""
+        minx, miny, maxx, maxy = (int(value // self.cell_size) for value in box)
+        return [(x, y) for x in range(minx, maxx + 1) for y in range(miny, maxy + 1)]
+
+    def collides(self, box) -> bool:
+        """Test whether a box overlaps any box in the grid.
+
+        Args:
+            box (tuple): (minx, miny, maxx, maxy) in pixels.
+
+        Returns:
+            bool: True if the box overlaps a box in the grid.
+        """
+        minx, miny, maxx, maxy = box
+        for cell in self._cells_for(box):
+            for ominx, ominy, omaxx, omaxy in self._cells.get(cell, ()):
+                if minx < omaxx and ominx < maxx and miny < omaxy and ominy < maxy:
+                    return True
+        return False
+
+    def insert(self, box):
+        """Insert a box.
+
+        Args:
+            box (tuple): (minx, miny, maxx, maxy) in pixels.
+        """
+        for cell in self._cells_for(box):
+            self._cells[cell].append(box)
+
+
+def get_anchors(geometries) -> np.ndarray:
+    """Get the point to label every geometry at.
+
+    Args:
+        geometries (numpy.ndarray): Array of shapely geometries.
+
+    Returns:
+        numpy.ndarray: (n, 2) array with the midpoint of lines, a point on the
+        surface of polygons and the first point of (multi)points.
+    """
+    type_ids = shapely.get_type_id(geometries)
+    anchors = shapely.point_on_surface(geometries)
+    lines = np.isin(type_ids, (shapely.GeometryType.LINESTRING,
+                               shapely.GeometryType.MULTILINESTRING))
+    anchors[lines] = shapely.line_interpolate_point(
+        geometries[lines], 0.5, normalized=True
+    )
+    return shapely.get_coordinates(anchors)
+
+
+def place_labels(  # pylint: disable=R0913,R0914
+    anchors, sizes, is_point, width: int, height: int, offset: float = 4.0,
+    padding: float = 2.0, cell_size: float = CELL_SIZE
+):
+    """Place labels without overlaps, in the given order.
+
+    Args:
+        anchors (numpy.ndarray): (n, 2) label anchors in pixels, in order of
+            priority.
+        sizes (numpy.ndarray): (n, 2) width and height of the labels in pixels.
+        is_point (numpy.ndarray): Boolean array, True for labels of points, which
+            are placed next to their anchor instead of centered on it.
+        width (int): The image width in pixels.
+        height (int): The image height in pixels.
+        offset (float): The distance in pixels between a point and its label.
+        padding (float): The minimum distance in pixels between labels.
+        cell_size (float): The cell size of the :class:`CollisionGrid`.
+
+    Returns:
+        tuple: The indices of the placed labels and (k, 2) array with their top
+        left corners in pixels.
+    """
+    grid = CollisionGrid(cell_size)
+    placed, corners = [], []
+    for i, ((x, y), (w, h), point) in enumerate(  # pylint: disable=C0103
+        zip(anchors.tolist(), sizes.tolist(), is_point.tolist())
+    ):
+        if point:
+            candidates = ((x + offset, y - h / 2), (x - offset - w, y - h / 2),
+                          (x - w / 2, y - offset - h), (x - w / 2, y + offset))
+        else:
+            candidates = ((x - w / 2, y - h / 2),)
+        for left, top in candidates:
+            if left < 0 or top < 0 or left + w > width or top + h > height:
+                continue
+            box = (left - padding, top - padding, left + w + padding,
+                   top + h + padding)
+            if not grid.collides(box):
+                grid.insert(box)
+                placed.append(i)
+                corners.append((left, top))
+                break
+    return np.array(placed, dtype=np.intp), np.array(corners).reshape(-1, 2)
+
+
+def layout_labels(context, texts, geometries, transformation, style: LabelStyle):
+    """Measure and place the labels of geometries.
+
+    Args:
+        context (cairo.Context): The context used to measure the text.
+        texts (list): The label texts, in order of priority.
+        geometries (numpy.ndarray): The geometries, in the same order. Missing and
+            empty geometries are not labeled.
+        transformation (ImageTransformation): The transformation to pixel space.
+        style (LabelStyle): The label style.
+
+    Returns:
+        tuple: The placed texts and (k, 2) array with their top left corners.
+    """
+    valid = ~(shapely.is_missing(geometries) | shapely.is_empty(geometries))
+    texts = [text for text, keep in zip(texts, valid.tolist()) if keep]
+    geometries = geometries[valid]
+    if not texts:
+        return [], np.empty((0, 2))
+    anchors = transform_coords(
+        get_anchors(geometries), transformation.get_shapely_matrix()
+    )
+    inside = ((anchors[:, 0] >= 0) & (anchors[:, 0] <= transformation.width)
+              & (anchors[:, 1] >= 0) & (anchors[:, 1] <= transformation.height))
+    texts = [text for text, keep in zip(texts, inside.tolist()) if keep]
+    if not texts:
+        return [], np.empty((0, 2))
+    geometries, anchors = geometries[inside], anchors[inside]
+    sizes = measure_labels(context, texts, style)
+    is_point = np.isin(shapely.get_type_id(geometries), (
+        shapely.GeometryType.POINT, shapely.GeometryType.MULTIPOINT
+    ))
+    placed, corners = place_labels(
+        anchors, sizes, is_point, transformation.width, transformation.height,
+        style.offset, style.padding, max(CELL_SIZE, 2 * sizes[0, 1])
+    )
+    return [texts[i] for i in placed.tolist()], corners
+
+
+def measure_labels(context, texts, style: LabelStyle) -> np.ndarray:
+    """Measure the size of labels, measuring every distinct text once.
+
+    Args:
+        context (cairo.Context): The context used to measure the text.
+        texts (list): The label texts.
+        style (LabelStyle): The label style.
+
+    Returns:
+        numpy.ndarray: (n, 2) array with the width and height of the labels in
+        pixels. The height is that of the font, so all labels line up.
+    """
+    context.save()
+    style.set_font(context)
+    ascent, descent = context.font_extents()[:2]
+    widths = {}
+    for text in texts:
+        if text not in widths:
+            widths[text] = context.text_extents(text)[4]
+    context.restore()
+    sizes = np.empty((len(texts), 2))
+    sizes[:, 0] = [widths[text] for text in texts]
+    sizes[:, 1] = ascent + descent
+    return sizes
+
+
+def draw_labels(context, texts, corners, style: LabelStyle):
+    """Draw placed labels.
+
+    Args:
+        context (cairo.Context): The context to draw on.
+        texts (list): The label texts.
+        corners (numpy.ndarray): (n, 2) array with the top left corners of the
+            labels in pixels.
+        style (LabelStyle): The label style.
+    """
+    context.save()
+    style.set_font(context)
+    context.set_source_rgba(*style.color)
+    ascent = context.font_extents()[0]
+    for text, (left, top) in zip(texts, corners.tolist()):
+        context.move_to(left, top + ascent)
+        context.show_text(text)
+    context.restore()
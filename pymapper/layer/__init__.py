@@ -1,7 +1,96 @@
+"""
+The layer types of pymapper.
+
+Layer classes are registered by name with the module that defines them, and the
+module is only imported when the layer type is first used. Register a layer type
+of another package with::
+
+    register_layer_type("MyLayer", "mypackage.layers:MyLayer")
+"""
 from enum import Enum
-from .geopandas import GeoPandasLayer
+from importlib import import_module
+from typing import TYPE_CHECKING, Dict, Union
+
+
+_LAYER_TYPES: Dict[str, Union[str, type]] = {
+    "GeoPandasLayer": "pymapper.layer.geopandas:GeoPandasLayer",
+    "FileLayer": "pymapper.layer.file:FileLayer",
+    "WMSLayer": "pymapper.layer.wms:WMSLayer",
+    "WMTSLayer": "pymapper.layer.wms:WMTSLayer",
+    "RasterLayer": "pymapper.layer.raster:RasterLayer",
+    "SnapshotLayer": "pymapper.layer.snapshot:SnapshotLayer",
+}
+
+LayerType: Enum
+"""Enum of the registered layer types, with the layer classes as values."""
+
+__all__ = ["LayerType", "get_layer_type", "register_layer_type", "layer_types"]
+__all__ += [name for name in _LAYER_TYPES if name not in __all__]
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .geopandas import GeoPandasLayer
+    from .file import FileLayer
+    from .wms import WMSLayer, WMTSLayer
+    from .raster import RasterLayer
+    from .snapshot import SnapshotLayer
+
+
+def register_layer_type(layer_type: str, layer_class: Union[str, type]):
+    """Register a layer type.
+
+    Args:
+        layer_type (str): The name of the layer type, the ``LAYER_TYPE`` of the
+            class.
+        layer_class (str or type): The layer class, or ``"module:Class"`` to
+            import the class when the layer type is first used.
+    """
+    _LAYER_TYPES[layer_type] = layer_class
+    globals().pop("LayerType", None)
+
+
+def get_layer_type(layer_type: str) -> type:
+    """Get the class of a layer type, importing its module on first use.
+
+    Args:
+        layer_type (str): The name of the layer type.
+
+    Returns:
+        type: The layer class.
+
+    Raises:
+        KeyError: If the layer type is not registered.
+    """
+    layer_class = _LAYER_TYPES[layer_type]
+    if isinstance(layer_class, str):
+        module, _, name = layer_class.partition(":")
+        layer_class = getattr(import_module(module), name)
+        _LAYER_TYPES[layer_type] = layer_class
+    return layer_class
+
+
+def layer_types() -> list:
+    """Get the names of the registered layer types, without importing them."""
+    return list(_LAYER_TYPES)
+
+
+def __getattr__(name):
+    """Import layer classes and build the :class:`LayerType` enum on first access.
+
+    ``LayerType`` maps every registered layer type to its class, so accessing it
+    imports all layer modules.
+    """
+    if name == "LayerType":
+        value = Enum("LayerType", {
+            layer_type: get_layer_type(layer_type) for layer_type in _LAYER_TYPES
+        })
+    elif name in _LAYER_TYPES:
+        value = get_layer_type(name)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
 
 
-LayerType = Enum(
-        "LayerType",
-        {GeoPandasLayer.LAYER_TYPE: GeoPandasLayer})
+def __dir__():
+    """List the module attributes, including the names not imported yet."""
+    return sorted(set(globals()) | set(__all__))
@@ -3,13 +3,45 @@ from typing import Union, Tuple
 from pyproj.crs.crs import CRS
 
 
+def bbox_contains(outer, inner):
+    """Test whether the ``outer`` bounding box fully contains ``inner``.
+
+    Args:
+        outer (tuple): (minx, miny, maxx, maxy) bounding box.
+        inner (tuple): (minx, miny, maxx, maxy) bounding box.
+
+    Returns:
+        bool: True if ``inner`` lies within ``outer``.
+    """
+    return (outer[0] <= inner[0] and outer[1] <= inner[1]
+            and outer[2] >= inner[2] and outer[3] >= inner[3])
+
+
+def buffer_bbox(bbox, distance: float):
+    """Grow a bounding box by a distance on every side.
+
+    Args:
+        bbox (tuple): (minx, miny, maxx, maxy) bounding box.
+        distance (float): The distance to add.
+
+    Returns:
+        tuple: The (minx, miny, maxx, maxy) of the grown bounding box.
+    """
+    minx, miny, maxx, maxy = bbox
+    return (minx - distance, miny - distance, maxx + distance, maxy + distance)
+
+
 class BaseLayer:  # pylint: disable=R0903
     """Base layer.
 
     Attributes:
         name (str): The layer name
         crs (pyproj.crs.crs.CRS): The layer coordinate reference system.
-        bbox (Type[float, float, float, float]: (minx, miny, maxx, maxy) bounding box
+        bbox (Type[float, float, float, float]: (minx, miny, maxx, maxy) bounding
+            box. Layers that pass None compute it on first use with
+            :meth:`compute_bbox`, and set it back to None when it changes.
+        version (int): The data version, incremented by :meth:`invalidate` whenever
+            the layer data changes.
     """
     LAYER_TYPE: Union[str, None] = None
 
@@ -18,12 +50,78 @@ class BaseLayer:  # pylint: disable=R0903
         """Initialize the class."""
         self.name = name
         self.crs = crs
-        self.bbox = bbox
+        self._bbox = bbox
+        self.version = 0
 
         if self.__class__.LAYER_TYPE is None:
             raise NotImplementedError("Please subclass BaseLayer")
 
+    @property
+    def bbox(self):
+        """The bounding box of the layer in its crs."""
+        if self._bbox is None:
+            self._bbox = self.compute_bbox()
+        return self._bbox
+
+    @bbox.setter
+    def bbox(self, bbox):
+        self._bbox = bbox
+
+    def compute_bbox(self):
+        """Compute the bounding box on first use, for layers that reset it to
+        None."""
+        return self._bbox
+
     def set_crs(self, crs: CRS):
         """Set the layer crs."""
         self.crs = crs
         raise NotImplementedError(f"Please implement {self.__class__}.set_crs")
+
+    def prepare(self):
+        """Prepare the layer to render many frames with the current crs.
+
+        Layers can compute everything that doesn't depend on the transformation
+        here. The default does nothing.
+        """
+
+    def invalidate(self):
+        """Mark the layer data as changed, so cached results are not reused."""
+        self.version += 1
+
+    def get_changes(self, since: int):
+        """Get the areas that changed since a data version.
+
+        Layers that can track partial updates return the bounding boxes of the
+        changed features, so a map can redraw only those areas. The default only
+        reports that nothing changed when the version is the same.
+
+        Args:
+            since (int): The data version of the previous render.
+
+        Returns:
+            list: (minx, miny, maxx, maxy) bounding boxes in the layer crs, empty
+            when nothing changed, or None when the whole layer must be redrawn.
+        """
+        return [] if since == self.version else None
+
+    def cache_key(self):
+        """Get a hashable key identifying the rendered output of the layer.
+
+        Layers that render the same key must produce the same image for the same
+        transformation. The default key is only unique within a process.
+
+        Returns:
+            tuple: The layer type, name, id, data version and crs.
+        """
+        crs = self.crs.to_wkt() if isinstance(self.crs, CRS) else self.crs
+        return (self.LAYER_TYPE, self.name, id(self), self.version, crs)
+
+    def render(self, context, transformation):
+        """Render the layer.
+
+        Args:
+            context (cairo.Context): The context to draw on.
+            transformation (ImageTransformation): The transformation from the layer
+                crs to pixel space.
+        """
+        raise NotImplementedError(f"Please implement {self.__class__}.render")
@@ -0,0 +1,249 @@
+"""
+Define the FileLayer, a vector layer that streams its features from a file.
+"""
+import json
+import os
+import numpy as np
+import pyogrio
+import shapely
+from geopandas import GeoDataFrame
+from pyproj.crs.crs import CRS
+from ..instrumentation import get_instrumentation
+from ..projection import transform_bounds, transform_geometries
+from ..render import render_geometries
+from ..style import Style, get_symbol_extent
+from .base import BaseLayer, bbox_contains, buffer_bbox
+
+
+CHUNK_SIZE = 50000
+"""Default number of features read from the file at once."""
+
+PARQUET_EXTENSIONS = (".parquet", ".geoparquet")
+
+
+class FileLayer(BaseLayer):  # pylint: disable=R0902
+    """Vector layer that reads its features from a file in chunks while rendering.
+
+    Only one chunk of at most ``chunk_size`` features is kept in memory at a time,
+    so the memory use doesn't depend on the size of the file. The bbox and crs are
+    taken from the file metadata.
+
+    GeoPackage, shapefile and the other formats supported by GDAL are streamed as
+    Arrow record batches from a single reader with :func:`pyogrio.raw.open_arrow`,
+    filtered by bbox by the driver. GeoParquet files are read per record batch
+    with :mod:`pyarrow.dataset`, skipping the row groups outside the bbox when the
+    file has a bbox covering column. Both need :mod:`pyarrow`, which is installed
+    with the ``file`` extra.
+
+    Args:
+        name (str): The layer name.
+        path (str): The path of the file.
+        layer (str or int): The layer in the file, for formats with multiple
+            layers.
+        style (Style): The style to draw the features with (default ``Style()``).
+        chunk_size (int): The number of features to read at once.
+        simplify_tolerance (float): Simplify geometries to this tolerance in pixels
+            before drawing, or 0 to draw the full geometries.
+
+    Attributes:
+        name (str): The layer name.
+        path (str): The path of the file.
+        layer (str or int): The layer in the file.
+        source_crs (pyproj.crs.crs.CRS): The crs of the file.
+        source_bbox (tuple): (minx, miny, maxx, maxy) bounds of the file in
+            ``source_crs``.
+        crs (pyproj.crs.crs.CRS): The crs the layer is rendered in.
+        bbox (tuple): (minx, miny, maxx, maxy) bounding box in ``crs``.
+        style (Style): The style to draw the features with.
+        chunk_size (int): The number of features to read at once.
+        simplify_tolerance (float): The simplification tolerance in pixels.
+    """
+
+    LAYER_TYPE = "FileLayer"
+
+    def __init__(  # pylint: disable=R0913
+        self, name: str, path: str, layer=None, style: Style = None,
+        chunk_size: int = CHUNK_SIZE, simplify_tolerance: float = 0.5
+    ):
+        """Initialize the class."""
+        self.path = path
+        self.layer = layer
+        self.style: Style = style if style is not None else Style()
+        self.chunk_size = chunk_size
+        self.simplify_tolerance = simplify_tolerance
+        self.is_parquet = path.lower().endswith(PARQUET_EXTENSIONS)
+        if self.is_parquet:
+            self.source_crs, self.source_bbox = self._read_parquet_info()
+        else:
+            self.source_crs, self.source_bbox = self._read_info()
+        super().__init__(name, crs=self.source_crs, bbox=self.source_bbox)
+
+    def _read_info(self):
+        """Read the crs and bounds from the metadata of a GDAL supported file."""
+        info = pyogrio.read_info(self.path, layer=self.layer)
+        if info.get("total_bounds") is None:
+            info = pyogrio.read_info(
+                self.path, layer=self.layer, force_total_bounds=True
+            )
+        crs = CRS.from_user_input(info["crs"]) if info["crs"] else None
+        return crs, tuple(info["total_bounds"])
+
+    def _read_geo_metadata(self):
+        """Read the GeoParquet metadata."""
+        import pyarrow.parquet  # pylint: disable=C0415
+        parquet = pyarrow.parquet.ParquetFile(self.path)
+        return parquet, json.loads(parquet.schema_arrow.metadata[b"geo"])
+
+    def _read_parquet_info(self):
+        """Read the crs and bounds from the GeoParquet metadata."""
+        _, metadata = self._read_geo_metadata()
+        column = metadata["columns"][metadata["primary_column"]]
+        # GeoParquet defines a missing crs as OGC:CRS84, and null as undefined.
+        crs = column.get("crs", "OGC:CRS84")
+        crs = CRS.from_user_input(crs) if crs is not None else None
+        bbox = column.get("bbox")
+        if bbox is None:
+            bbox = self._scan_bounds()
+        # A 3D bbox is (minx, miny, minz, maxx, maxy, maxz).
+        half = len(bbox) // 2
+        return crs, tuple(bbox[:2] + bbox[half:half + 2])
+
+    def _scan_bounds(self):
+        """Compute the bounds by streaming over all chunks."""
+        bounds = [shapely.total_bounds(chunk.geometry.values)
+                  for chunk in self.iter_chunks()]
+        bounds = np.array(bounds).reshape(-1, 4)
+        return [*np.nanmin(bounds[:, :2], axis=0), *np.nanmax(bounds[:, 2:], axis=0)]
+
+    def iter_chunks(self, bbox=None):
+        """Read the features intersecting a bounding box in chunks.
+
+        Args:
+            bbox (tuple): (minx, miny, maxx, maxy) in the source crs, or None to read
+                all features.
+
+        Yields:
+            geopandas.GeoDataFrame: Chunks of at most ``chunk_size`` features in the
+            source crs.
+        """
+        if self.is_parquet:
+            yield from self._iter_parquet_chunks(bbox)
+            return
+        # One reader for all chunks, skipping features would read the file from
+        # the start for every chunk with drivers without random access.
+        from pyogrio.raw import open_arrow  # pylint: disable=C0415
+        kwargs = {} if bbox is None else {"bbox": tuple(bbox)}
+        with open_arrow(
+            self.path, layer=self.layer, columns=[], batch_size=self.chunk_size,
+            use_pyarrow=True, **kwargs
+        ) as (metadata, reader):
+            column = metadata["geometry_name"] or "wkb_geometry"
+            for batch in reader:
+                geometries = shapely.from_wkb(batch.column(column).to_numpy(False))
+                if len(geometries):
+                    yield GeoDataFrame(geometry=geometries, crs=self.source_crs)
+
+    def _iter_parquet_chunks(self, bbox):
+        """Read a GeoParquet file in record batches.
+
+        With a bbox covering column, as defined by GeoParquet 1.1, the bbox filter
+        is pushed down to the row group statistics of that column, so row groups
+        outside the bbox are skipped and only the rows in the bbox are decoded.
+        Without one, every batch is decoded and filtered by the geometry bounds.
+        """
+        import pyarrow.dataset  # pylint: disable=C0415
+        _, metadata = self._read_geo_metadata()
+        column = metadata["primary_column"]
+        covering = metadata["columns"][column].get("covering", {}).get("bbox")
+        expression = None
+        if bbox is not None and covering is not None:
+            fields = {key: pyarrow.dataset.field(*path)
+                      for key, path in covering.items()}
+            expression = ((fields["xmin"] <= bbox[2]) & (fields["xmax"] >= bbox[0])
+                          & (fields["ymin"] <= bbox[3]) & (fields["ymax"] >= bbox[1]))
+        dataset = pyarrow.dataset.dataset(self.path, format="parquet")
+        for batch in dataset.to_batches(
+            columns=[column], filter=expression, batch_size=self.chunk_size
+        ):
+            geometries = shapely.from_wkb(batch.column(0).to_numpy(False))
+            if bbox is not None and expression is None:
+                minx, miny, maxx, maxy = shapely.bounds(geometries).T
+                geometries = geometries[
+                    (minx <= bbox[2]) & (maxx >= bbox[0])
+                    & (miny <= bbox[3]) & (maxy >= bbox[1])
+                ]
+            if len(geometries):
+                yield GeoDataFrame(geometry=geometries, crs=self.source_crs)
+
+    def set_crs(self, crs: CRS):
+        """Set the crs to render the layer in.
+
+        Only the bbox is transformed, the features are reprojected per chunk while
+        rendering.
+        """
+        if crs is not None:
+            crs = CRS.from_user_input(crs)
+        if crs != self.source_crs and self.source_crs is None:
+            raise ValueError("Can't reproject data without a crs.")
+        self.crs = crs
+        self.bbox = self.source_bbox
+        if crs != self.source_crs:
+            self.bbox = transform_bounds(self.source_bbox, self.source_crs, crs)
+
+    def cache_key(self):
+        """Get a hashable key identifying the rendered output of the layer.
+
+        Returns:
+            tuple: The layer type, path, file size and modification time, crs and
+            style key.
+        """
+        stat = os.stat(self.path)
+        crs = self.crs.to_wkt() if self.crs is not None else None
+        return (self.LAYER_TYPE, os.path.abspath(self.path), self.layer,
+                stat.st_size, stat.st_mtime_ns, crs, self.style.key(),
+                self.simplify_tolerance)
+
+    def render(self, context, transformation):
+        """Render the layer chunk by chunk.
+
+        Every chunk is reprojected, simplified and drawn, and then dropped before the
+        next chunk is read. Reading is reported as the ``read`` stage of the
+        current instrumentation, see :mod:`pymapper.instrumentation`.
+
+        Args:
+            context (cairo.Context): The context to draw on.
+            transformation (ImageTransformation): The transformation from the layer
+                crs to pixel space.
+        """
+        bbox = buffer_bbox(
+            transformation.bbox,
+            get_symbol_extent(self.style) * transformation.get_resolution()
+        )
+        if bbox_contains(bbox, self.bbox):
+            bbox = None
+        elif self.crs != self.source_crs:
+            bbox = transform_bounds(bbox, self.crs, self.source_crs)
+            if not np.isfinite(bbox).all():
+                bbox = None
+        tolerance = transformation.get_resolution() * self.simplify_tolerance
+        instrumentation = get_instrumentation()
+        chunks = self.iter_chunks(bbox)
+        while True:
+            with instrumentation.stage("read"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            geometries = np.asarray(chunk.geometry.values)
+            del chunk
+            instrumentation.count("features_considered", len(geometries))
+            instrumentation.count("features_drawn", len(geometries))
+            if self.crs != self.source_crs:
+                instrumentation.count("features_reprojected", len(geometries))
+                with instrumentation.stage("reproject"):
+                    geometries = transform_geometries(
+                        geometries, self.source_crs, self.crs
+                    )
+            if tolerance:
+                with instrumentation.stage("simplify"):
+                    geometries = shapely.simplify(geometries, tolerance)
+            render_geometries(context, geometries, transformation, self.style)
@@ -1,38 +1,794 @@
 """
 Define the GeoPandasLayer.
 """
+import hashlib
+import math
+import numpy as np
+import pandas as pd
+import shapely
 from geopandas import GeoDataFrame
+from pandas.util import hash_array  # pylint: disable=E0611
 from pyproj.crs.crs import CRS
-from .base import BaseLayer
+from shapely.geometry import box
+from ..cache import LRUCache
+from ..instrumentation import get_instrumentation
+from ..label import LabelStyle, draw_labels, layout_labels
+from ..projection import transform_bounds, transform_geometries
+from ..render import get_offsets, render_geometries
+from ..style import ClassifiedStyle, Style, get_symbol_extent
+from .base import BaseLayer, bbox_contains, buffer_bbox
 
 
-class GeoPandasLayer(BaseLayer):  # pylint: disable=R0903
+PROJECTION_CACHE_SIZE = 4
+"""Default number of target crs to keep reprojected geometries for per layer."""
+
+SIMPLIFY_CACHE_SIZE = 8
+"""Default number of zoom bands to keep simplified geometries for per layer."""
+
+STYLE_CACHE_SIZE = 4
+"""Default number of style rules to keep the classes of the features for."""
+
+LABEL_CACHE_SIZE = 16
+"""Default number of viewports to keep the label layout for per layer."""
+
+CHANGE_LOG_SIZE = 64
+"""Number of updates to keep the changed bounding boxes for."""
+
+POINT_TYPES = (shapely.GeometryType.POINT, shapely.GeometryType.MULTIPOINT)
+
+
+class _LazyGeometries:  # pylint: disable=R0903
+    """Geometries that are computed on demand and kept per feature position.
+
+    ``done`` marks the positions in ``geometries`` that have been computed so far.
+    """
+
+    def __init__(self, size: int):
+        """Initialize the class."""
+        self.geometries = np.empty(size, dtype=object)
+        self.done = np.zeros(size, dtype=bool)
+
+    def get(self, positions, compute):
+        """Get the geometries at positions, computing the missing ones with
+        ``compute(missing_positions)``."""
+        missing = positions[~self.done[positions]]
+        if len(missing):
+            self.geometries[missing] = compute(missing)
+            self.done[missing] = True
+        return self.geometries[positions]
+
+
+class _Projection(_LazyGeometries):  # pylint: disable=R0903
+    """Lazily reprojected geometries of a layer for a single target crs.
+
+    ``bbox`` is the bbox of the layer in the target crs, or None until it is
+    first used.
+    """
+
+    def __init__(self, crs: CRS, size: int):
+        """Initialize the class."""
+        super().__init__(size)
+        self.crs = crs
+        self.bbox = None
+
+
+def get_zoom_band(resolution: float) -> int:
+    """Get the zoom band for a resolution.
+
+    Zoom bands are powers of two, band ``b`` covers resolutions from ``2**b`` up to
+    ``2**(b + 1)`` map units per pixel.
+
+    Args:
+        resolution (float): The size of a pixel in map units.
+
+    Returns:
+        int: The zoom band.
+    """
+    return math.floor(math.log2(resolution))
+
+
+class GeoPandasLayer(BaseLayer):  # pylint: disable=R0902,R0903,R0904
     """Vector layer based on :class:`geopandas.GeoDataFrame`.
 
+    The data itself is never modified. Setting a new crs doesn't transform
+    anything; the geometries are reprojected at render time, only for the features
+    that are drawn, and kept for the ``projection_cache_size`` most recently used
+    crs. The bounding boxes are computed on first use too, and kept until the
+    data changes, see :meth:`get_bounds`.
+
     Args:
         name (str): "The layer name."
         data (:class:`geopandas.GeoDataFrame`): The data to use.
+        style (Style): The style to draw the features with (default ``Style()``),
+            or a style rule like :class:`pymapper.style.ClassifiedStyle` to style
+            every feature based on a column.
+        projection_cache_size (int): The number of crs to keep reprojected
+            geometries for.
+        simplify_tolerance (float): Simplify geometries to this tolerance in pixels
+            before drawing, or 0 to draw the full geometries.
+        min_feature_size (float): Skip lines and polygons whose bbox is smaller
+            than this number of pixels in both directions, or 0 to draw all.
+        labels (LabelStyle): Label the features with the text of a column, or None
+            for no labels.
 
     Attributes:
         name (str): "The layer name."
-        data (:class:`geopandas.GeoDataFrame`): The data for the layer. The data
-            may be modified in-place, so pass a copy if you don't want that.
+        data (:class:`geopandas.GeoDataFrame`): The data for the layer, in its
+            original crs. Assigning new data invalidates all cached results; call
+            :meth:`invalidate` after modifying the data in place.
+        source_crs (pyproj.crs.crs.CRS): The crs of ``data``.
+        source_bbox (tuple): (minx, miny, maxx, maxy) bounding box of ``data`` in
+            ``source_crs``, computed on first use.
+        crs (pyproj.crs.crs.CRS): The crs the layer is rendered in.
+        bbox (tuple): (minx, miny, maxx, maxy) bounding box in ``crs``.
+        style (Style): The style or style rule to draw the features with.
+        simplify_tolerance (float): The simplification tolerance in pixels.
+        min_feature_size (float): The minimum feature size in pixels.
+        labels (LabelStyle): The label style.
+        time_range (tuple): (column, start, end) of the time filter set with
+            :meth:`set_time_range`, or None.
     """
 
     LAYER_TYPE = "GeoPandasLayer"
 
-    def __init__(self, name: str, data: GeoDataFrame):
+    def __init__(  # pylint: disable=R0913
+        self, name: str, data: GeoDataFrame, style: Style = None,
+        projection_cache_size: int = PROJECTION_CACHE_SIZE,
+        simplify_tolerance: float = 0.5, min_feature_size: float = 1.0,
+        labels: LabelStyle = None
+    ):
         """Initilize the class."""
-        self.data: GeoDataFrame = data
-        minx, miny, maxx, maxy = data.total_bounds
-        super().__init__(name, crs=data.crs, bbox=(minx, miny, maxx, maxy))
+        self._data: GeoDataFrame = data
+        self.style: Style = style if style is not None else Style()
+        self.simplify_tolerance = simplify_tolerance
+        self.min_feature_size = min_feature_size
+        self.labels = labels
+        self._projections = LRUCache(projection_cache_size)
+        self._simplified = LRUCache(SIMPLIFY_CACHE_SIZE)
+        self._classes = LRUCache(STYLE_CACHE_SIZE)
+        self._classified_columns = set()
+        self._label_layouts = LRUCache(LABEL_CACHE_SIZE)
+        self._changes = []
+        self._changes_base = 0
+        self._time_indexes = {}
+        self.time_range = None
+        self._selected = None
+        self._projection = None
+        self._data_hash = None
+        self._bounds = None
+        self._source_bbox = None
+        self.source_crs = data.crs
+        super().__init__(name, crs=data.crs, bbox=None)
+
+    @property
+    def data(self) -> GeoDataFrame:
+        """The data for the layer."""
+        return self._data
+
+    @data.setter
+    def data(self, data: GeoDataFrame):
+        """Replace the data for the layer."""
+        self._data = data
+        self.invalidate()
+
+    def get_bounds(self) -> np.ndarray:
+        """Get the bounding boxes of the features in the source crs.
+
+        The bounds are computed with a single pass over the geometries once per
+        data version, and :meth:`update` only replaces the bounds of the updated
+        rows.
+
+        Returns:
+            numpy.ndarray: (n, 4) array with the (minx, miny, maxx, maxy) of every
+            feature, NaN for missing and empty geometries.
+        """
+        if self._bounds is None:
+            self._bounds = shapely.bounds(np.asarray(self._data.geometry.values))
+        return self._bounds
+
+    @property
+    def source_bbox(self):
+        """The bounding box of the data in the source crs, computed from
+        :meth:`get_bounds` on first use."""
+        if self._source_bbox is None:
+            bounds = self.get_bounds()
+            bounds = bounds[np.isfinite(bounds).all(axis=1)]
+            if bounds.size:
+                self._source_bbox = (*bounds[:, :2].min(axis=0).tolist(),
+                                     *bounds[:, 2:].max(axis=0).tolist())
+            else:
+                self._source_bbox = (np.nan,) * 4
+        return self._source_bbox
+
+    def compute_bbox(self):
+        """Compute the bbox in the layer crs.
+
+        In another crs than the source crs, the source bbox is transformed with
+        densified edges, see :func:`pymapper.projection.transform_bounds`, and
+        kept per crs.
+        """
+        projection = self._projection
+        if projection is None:
+            return self.source_bbox
+        if projection.bbox is None:
+            projection.bbox = transform_bounds(
+                self.source_bbox, self.source_crs, projection.crs
+            )
+        return projection.bbox
+
+    def _update_source_bbox(self, old, new):
+        """Update the source bbox for rows whose bounds changed from ``old`` to
+        ``new``, and get whether it changed.
+
+        The bbox only grows when none of the old bounds touched its edges,
+        otherwise it is computed again on next use.
+        """
+        if self._source_bbox is None or not np.isfinite(self._source_bbox).all():
+            self._source_bbox = None
+            return True
+        minx, miny, maxx, maxy = self._source_bbox
+        old = old[np.isfinite(old).all(axis=1)]
+        new = new[np.isfinite(new).all(axis=1)]
+        if not ((old[:, 0] > minx) & (old[:, 1] > miny) & (old[:, 2] < maxx)
+                & (old[:, 3] < maxy)).all():
+            self._source_bbox = None
+            return True
+        if not new.size:
+            return False
+        bbox = (min(minx, new[:, 0].min()), min(miny, new[:, 1].min()),
+                max(maxx, new[:, 2].max()), max(maxy, new[:, 3].max()))
+        changed = bbox != self._source_bbox
+        self._source_bbox = tuple(float(value) for value in bbox)
+        return changed
+
+    def invalidate(self):
+        """Mark the data as changed.
+
+        Increments the version and drops the reprojected geometries, the feature
+        classes, the label layouts, the bounding boxes and the data hash. Call this
+        after modifying ``data`` in place.
+        """
+        super().invalidate()
+        self._changes = []
+        self._changes_base = self.version
+        self._projections.clear()
+        self._simplified.clear()
+        self._classes.clear()
+        self._classified_columns.clear()
+        self._label_layouts.clear()
+        self._time_indexes.clear()
+        self._data_hash = None
+        self._bounds = None
+        self._source_bbox = None
+        self.source_crs = self._data.crs
+        self._select_time_range()
+        self.set_crs(self.crs)
+
+    def update(self, rows: GeoDataFrame):
+        """Replace rows of the data in place and record the change.
+
+        Only the cached results for the updated rows are dropped, and the bounding
+        boxes of the old and new geometries are kept for :meth:`get_changes`, so a
+        map can redraw just the changed areas.
+
+        Args:
+            rows (geopandas.GeoDataFrame): The new rows, with index labels that are
+                in ``data`` and a subset of its columns.
+
+        Raises:
+            KeyError: If an index label of ``rows`` is not in ``data``.
+        """
+        positions = self._data.index.get_indexer(rows.index)
+        if (positions < 0).any():
+            raise KeyError(f"{list(rows.index[positions < 0])} not in the data.")
+        if rows.crs is not None and rows.crs != self.source_crs:
+            rows = rows.to_crs(self.source_crs)
+        geometry = self._data.geometry.name
+        old = shapely.bounds(np.asarray(self._data.geometry.values)[positions])
+        for column in rows.columns:
+            values = rows[column].values
+            if column == rows.geometry.name:
+                column = geometry
+            self._data.iloc[positions, self._data.columns.get_loc(column)] = values
+        new = shapely.bounds(np.asarray(self._data.geometry.values)[positions])
+        if self._bounds is not None:
+            self._bounds[positions] = new
+        bbox_changed = self._update_source_bbox(old, new)
+        bounds = np.vstack([old, new])
+        self.version += 1
+        self._changes.append((self.version, bounds[np.isfinite(bounds).all(axis=1)]))
+        if len(self._changes) > CHANGE_LOG_SIZE:
+            self._changes.pop(0)
+            self._changes_base = self._changes[0][0] - 1
+        for lazy in self._projections.values() + self._simplified.values():
+            lazy.done[positions] = False
+        # Only recompute classes and label layouts when their columns changed.
+        columns = set(rows.columns)
+        if columns & self._classified_columns:
+            self._classes.clear()
+            self._classified_columns.clear()
+        if self.labels is None or columns & {
+            rows.geometry.name, *self._get_drawn_columns()
+        }:
+            self._label_layouts.clear()
+        self._data_hash = None
+        if self.time_range is not None and self.time_range[0] in rows.columns:
+            self._time_indexes.pop(self.time_range[0], None)
+            self._select_time_range()
+            self._changes_base = self.version
+        if bbox_changed:
+            for projection in self._projections.values():
+                projection.bbox = None
+        self.set_crs(self.crs)
+
+    def _get_time_index(self, column):
+        """Get the sorted values and the order of a column, computed once per data
+        version."""
+        index = self._time_indexes.get(column)
+        if index is None:
+            values = self._data[column]
+            order = np.argsort(values.to_numpy(), kind="stable")
+            index = (values.iloc[order], order)
+            self._time_indexes[column] = index
+        return index
+
+    def _select_time_range(self):
+        """Mark the features within the time range."""
+        if self.time_range is None:
+            self._selected = None
+            return
+        column, start, end = self.time_range
+        times, order = self._get_time_index(column)
+        first = 0 if start is None else times.searchsorted(start, side="left")
+        last = len(times) if end is None else times.searchsorted(end, side="left")
+        self._selected = np.zeros(len(self._data), dtype=bool)
+        self._selected[order[first:last]] = True
+
+    def set_time_range(self, column, start=None, end=None):
+        """Only draw the features with ``start <= data[column] < end``.
+
+        The column is sorted once per data version, so every following time range
+        is selected with a binary search. The reprojected geometries and other
+        cached results are kept.
+
+        Args:
+            column (str): The time column, or None to draw all features again.
+            start: The start of the range, or None for no lower bound.
+            end: The end of the range, or None for no upper bound.
+        """
+        self.time_range = (column, start, end) if column is not None else None
+        self._select_time_range()
+        self.version += 1
+        self._changes = []
+        self._changes_base = self.version
+
+    def prepare(self):
+        """Prepare the layer to render many frames.
+
+        Builds the spatial index, reprojects all geometries to the layer crs and
+        classifies the features, so frames don't have to.
+        """
+        self.data.sindex  # pylint: disable=W0104
+        self.get_geometries()
+        if not isinstance(self.style, Style):
+            self.get_classes()
+
+    def write_snapshot(self, path: str) -> str:
+        """Write a snapshot of the layer in its current crs.
+
+        Render workers can open the snapshot as a
+        :class:`pymapper.layer.SnapshotLayer` with memory mapping, instead of
+        loading and reprojecting the data, see :mod:`pymapper.layer.snapshot`.
+
+        Args:
+            path (str): The directory to write the snapshot to.
+
+        Returns:
+            str: ``path``
+        """
+        from .snapshot import write_snapshot  # pylint: disable=C0415
+        return write_snapshot(self, path)
+
+    def get_changes(self, since: int):
+        """Get the bounding boxes of the rows updated since a data version.
+
+        Args:
+            since (int): The data version of the previous render.
+
+        Returns:
+            list: (minx, miny, maxx, maxy) bounding boxes of the old and new
+            geometries in the layer crs, or None when the whole layer must be
+            redrawn. That is the case after :meth:`invalidate`, when ``since`` is
+            older than the kept updates, or when the layer has labels or a
+            classification scheme, which may change anywhere.
+        """
+        if since == self.version:
+            return []
+        if since < self._changes_base or self.labels is not None or (
+            isinstance(self.style, ClassifiedStyle) and self.style.scheme is not None
+        ):
+            return None
+        bboxes = [bbox for version, bounds in self._changes if version > since
+                  for bbox in bounds.tolist()]
+        if self._projection is not None:
+            bboxes = [transform_bounds(bbox, self.source_crs, self.crs)
+                      for bbox in bboxes]
+        return bboxes
+
+    def _get_drawn_columns(self):
+        """Get the names of the columns that change what is drawn: the style rule
+        column, the label text and priority columns and the time column."""
+        columns = [getattr(self.style, "column", None)]
+        if self.labels is not None:
+            columns += [self.labels.column, self.labels.priority]
+        if self.time_range is not None:
+            columns.append(self.time_range[0])
+        return tuple(dict.fromkeys(
+            column for column in columns if column is not None
+        ))
+
+    def get_data_hash(self) -> str:
+        """Get a content hash of the data geometries, crs and the columns that
+        change what is drawn.
+
+        The hash is computed once per data version and set of columns.
+
+        Returns:
+            str: Hexadecimal sha1 digest.
+        """
+        columns = self._get_drawn_columns()
+        if self._data_hash is None or self._data_hash[0] != columns:
+            digest = hashlib.sha1()
+            crs = self.source_crs
+            digest.update((crs.to_wkt() if crs is not None else "").encode())
+            wkb = shapely.to_wkb(np.asarray(self._data.geometry.values))
+            digest.update(hash_array(wkb).tobytes())
+            for column in columns:
+                digest.update(column.encode())
+                digest.update(pd.util.hash_pandas_object(
+                    self._data[column], index=False
+                ).to_numpy().tobytes())
+            self._data_hash = (columns, digest.hexdigest())
+        return self._data_hash[1]
+
+    def cache_key(self):
+        """Get a hashable key identifying the rendered output of the layer.
+
+        Returns:
+            tuple: The layer type, content hash of the data, crs, style key, level
+            of detail settings, label style key and time range.
+        """
+        crs = self.crs.to_wkt() if self.crs is not None else None
+        labels = self.labels.key() if self.labels is not None else None
+        return (self.LAYER_TYPE, self.get_data_hash(), crs, self.style.key(),
+                self.simplify_tolerance, self.min_feature_size, labels,
+                self.time_range)
+
+    def _get_projection(self, crs: CRS):
+        """Get the, possibly cached, projection state for a crs."""
+        key = crs.to_wkt()
+        projection = self._projections.get(key)
+        if projection is None:
+            if self.source_crs is None:
+                raise ValueError("Can't reproject data without a crs.")
+            projection = _Projection(crs, len(self.data))
+            self._projections.put(key, projection)
+        return projection
 
     def set_crs(self, crs: CRS):
-        """Reproject the dataframe to a new CRS."""
+        """Set the crs to render the layer in.
+
+        The bbox is transformed from the bounds of the source data on first use,
+        see :meth:`compute_bbox`. The geometries are reprojected lazily by
+        :meth:`get_geometries`.
+
+        Raises:
+            ValueError: If the data has no crs and ``crs`` is a different crs.
+        """
+        if crs is not None:
+            crs = CRS.from_user_input(crs)
         self.crs = crs
-        self.data.to_crs(crs, inplace=True)
-        minx, miny, maxx, maxy = self.data.total_bounds
-        self.bbox = (minx, miny, maxx, maxy)
+        self._projection = None
+        if crs != self.source_crs:
+            self._projection = self._get_projection(crs)
+        self._bbox = None
+
+    def get_geometries(self, positions=None):
+        """Get geometries in the layer crs.
+
+        Geometries that were not reprojected to the layer crs before are reprojected
+        and cached.
+
+        Args:
+            positions (numpy.ndarray): Integer positions of the features to get, or
+                None for all features.
+
+        Returns:
+            numpy.ndarray: Array of shapely geometries.
+        """
+        source = np.asarray(self.data.geometry.values)
+        if positions is None:
+            positions = np.arange(len(source))
+        projection = self._projection
+        if projection is None:
+            return source[positions]
+        instrumentation = get_instrumentation()
+
+        def _reproject(missing):
+            instrumentation.count("features_reprojected", len(missing))
+            with instrumentation.stage("reproject"):
+                return transform_geometries(
+                    source[missing], self.source_crs, projection.crs
+                )
+        return projection.get(positions, _reproject)
+
+    def get_simplified(self, positions, resolution: float):
+        """Get geometries in the layer crs, simplified for a resolution.
+
+        Geometries are simplified with a tolerance of ``simplify_tolerance`` pixels
+        at the lowest resolution of the zoom band of ``resolution``, see
+        :func:`get_zoom_band`. The simplified geometries are cached per crs and zoom
+        band, so repeated renders at similar scales reuse them.
+
+        Args:
+            positions (numpy.ndarray): Integer positions of the features to get.
+            resolution (float): The size of a pixel in map units.
+
+        Returns:
+            numpy.ndarray: Array of shapely geometries.
+        """
+        band = get_zoom_band(resolution)
+        key = (self.crs.to_wkt() if self.crs is not None else None, band)
+        simplified = self._simplified.get(key)
+        if simplified is None:
+            simplified = _LazyGeometries(len(self.data))
+            self._simplified.put(key, simplified)
+        tolerance = 2.0 ** band * self.simplify_tolerance
+        instrumentation = get_instrumentation()
+
+        def _simplify(missing):
+            geometries = self.get_geometries(missing)
+            with instrumentation.stage("simplify"):
+                return shapely.simplify(geometries, tolerance)
+        return simplified.get(positions, _simplify)
+
+    def get_classes(self):
+        """Get the class of every feature for the style rule.
+
+        The classes, including the class breaks of a
+        :class:`pymapper.style.ClassifiedStyle`, are computed once per rule and
+        data version, so rendering the same classification again reuses them.
+
+        Returns:
+            tuple: An integer array with the class of every feature, -1 for
+            features that are not drawn, and the list of styles per class.
+        """
+        key = self.style.key()
+        classes = self._classes.get(key)
+        if classes is None:
+            with get_instrumentation().stage("classify"):
+                classes = self.style.classify(self.data[self.style.column])
+            self._classes.put(key, classes)
+            self._classified_columns.add(self.style.column)
+        return classes
+
+    def get_label_layout(self, context, positions, transformation):
+        """Get the placed labels for a viewport.
+
+        Labels are placed in order of the priority column, see
+        :func:`pymapper.label.place_labels`. The layout is cached per crs,
+        transformation, time range and the settings that select the drawn
+        features, so rendering the same viewport, tile or time slice again doesn't
+        place the labels again.
+
+        Args:
+            context (cairo.Context): The context used to measure the text.
+            positions (numpy.ndarray): Integer positions of the features to label.
+            transformation (ImageTransformation): The transformation to pixel space.
+
+        Returns:
+            tuple: The placed texts and (k, 2) array with their top left corners in
+            pixels.
+        """
+        key = (self.crs.to_wkt() if self.crs is not None else None,
+               transformation.key(), self.labels.key(), self.time_range,
+               self.style.key(), self.min_feature_size)
+        layout = self._label_layouts.get(key)
+        if layout is None:
+            with get_instrumentation().stage("label"):
+                texts = self.data[self.labels.column].to_numpy()[positions]
+                keep = ~pd.isna(texts)
+                positions, texts = positions[keep], texts[keep]
+                if self.labels.priority is not None:
+                    priority = self.data[self.labels.priority].to_numpy(
+                        dtype=float, na_value=-np.inf
+                    )
+                    order = np.argsort(-priority[positions], kind="stable")
+                    positions, texts = positions[order], texts[order]
+                layout = layout_labels(
+                    context, [str(text) for text in texts],
+                    self.get_geometries(positions), transformation, self.labels
+                )
+            self._label_layouts.put(key, layout)
+        return layout
+
+    def filter_small(self, positions, geometries, resolution: float):
+        """Drop lines and polygons smaller than ``min_feature_size`` pixels.
+
+        Args:
+            positions (numpy.ndarray): Integer positions of the features.
+            geometries (numpy.ndarray): The geometries at those positions, in the
+                layer crs.
+            resolution (float): The size of a pixel in map units.
+
+        Returns:
+            numpy.ndarray: The positions of the features that are large enough or
+            are points.
+        """
+        minx, miny, maxx, maxy = shapely.bounds(geometries).T
+        size = np.fmax(maxx - minx, maxy - miny)
+        keep = ~(size < self.min_feature_size * resolution)
+        keep |= np.isin(shapely.get_type_id(geometries), POINT_TYPES)
+        return positions[keep]
+
+    def query_bbox(self, bbox):
+        """Get the positions of the features that intersect a bounding box.
+
+        When ``bbox`` does not cover the whole layer, it is transformed to the
+        source crs and the spatial index of the data is queried. The index is built
+        on first use and reused for every following query.
+
+        Args:
+            bbox (tuple): (minx, miny, maxx, maxy) in the layer crs.
+
+        Returns:
+            numpy.ndarray: Sorted integer positions of the features in ``data``
+            whose bounding box intersects ``bbox``.
+        """
+        if bbox_contains(bbox, self.bbox):
+            return np.arange(len(self.data))
+        if self._projection is not None:
+            bbox = transform_bounds(bbox, self.crs, self.source_crs)
+            if not np.isfinite(bbox).all():
+                return np.arange(len(self.data))
+        return np.sort(self.data.sindex.query(box(*bbox)))
+
+    def hit_test(self, transformation, px, py, tolerance: float = 3.0):
+        """Find the features under pixels.
+
+        The pixels are transformed to boxes of ``tolerance`` pixels around them in
+        the source crs, which are looked up in the spatial index of the data all
+        at once. The candidates are then tested against the geometries in the
+        layer crs. Features outside the time range, or without a class of the
+        style rule, are not drawn and never hit.
+
+        Args:
+            transformation (ImageTransformation): The transformation of the image
+                the pixels are in.
+            px (numpy.ndarray): The x pixel coordinates.
+            py (numpy.ndarray): The y pixel coordinates.
+            tolerance (float): The distance in pixels within which a feature is
+                hit.
+
+        Returns:
+            tuple: An array with the index of the pixel of every hit and an array
+            with the integer position of the feature in ``data``, ordered by pixel
+            and position.
+        """
+        xs, ys = transformation.to_world(np.atleast_1d(px), np.atleast_1d(py))
+        radius = tolerance * transformation.get_resolution()
+        boxes = shapely.box(xs - radius, ys - radius, xs + radius, ys + radius)
+        if self._projection is not None:
+            boxes = transform_geometries(boxes, self.crs, self.source_crs)
+        pixels, positions = self.data.sindex.query(boxes)
+        # The spatial index returns the hits in tree order.
+        order = np.lexsort((positions, pixels))
+        pixels, positions = pixels[order], positions[order]
+        keep = np.ones(len(positions), dtype=bool)
+        if self._selected is not None:
+            keep &= self._selected[positions]
+        if not isinstance(self.style, Style):
+            keep &= self.get_classes()[0][positions] >= 0
+        pixels, positions = pixels[keep], positions[keep]
+        keep = shapely.dwithin(
+            self.get_geometries(positions), shapely.points(xs[pixels], ys[pixels]),
+            radius
+        )
+        return pixels[keep], positions[keep]
+
+    def _cull(self, bbox):
+        """Get the positions of the features in a bbox that pass the time filter."""
+        instrumentation = get_instrumentation()
+        with instrumentation.stage("cull"):
+            positions = self.query_bbox(bbox)
+        if self._selected is not None:
+            positions = positions[self._selected[positions]]
+        instrumentation.count("features_considered", len(positions))
+        return positions
+
+    def _get_drawn(self, positions, resolution):
+        """Drop small features and get the (simplified) geometries of the rest."""
+        instrumentation = get_instrumentation()
+        if self.min_feature_size:
+            geometries = self.get_geometries(positions)
+            with instrumentation.stage("cull"):
+                positions = self.filter_small(positions, geometries, resolution)
+        instrumentation.count("features_drawn", len(positions))
+        if self.simplify_tolerance:
+            geometries = self.get_simplified(positions, resolution)
+        else:
+            geometries = self.get_geometries(positions)
+        return positions, geometries
+
+    def select_features(self, bbox, resolution: float):
+        """Get the features that :meth:`render` would draw, without drawing them.
+
+        The features intersecting ``bbox`` are culled with the spatial index and
+        filtered by the time range, and features smaller than
+        ``min_feature_size`` pixels are dropped. The geometries are simplified to
+        ``simplify_tolerance`` pixels, reusing the cached simplified geometries.
+
+        Args:
+            bbox (tuple): (minx, miny, maxx, maxy) in the layer crs.
+            resolution (float): The size of a pixel in map units.
+
+        Returns:
+            tuple: The integer positions of the features in ``data`` and an array
+            with their geometries in the layer crs.
+        """
+        return self._get_drawn(self._cull(bbox), resolution)
+
+    @staticmethod
+    def _render_classes(  # pylint: disable=R0913
+        context, geometries, transformation, codes, styles
+    ):
+        """Draw geometries grouped by class, each class with its own style."""
+        order = np.argsort(codes, kind="stable")
+        geometries = geometries[order]
+        offsets = get_offsets(codes[order], len(styles))
+        for code, style in enumerate(styles):
+            start, end = offsets[code], offsets[code + 1]
+            if end > start:
+                render_geometries(
+                    context, geometries[start:end], transformation, style
+                )
+
+    def render(self, context, transformation):
+        """Render the layer.
+
+        Only the features intersecting the transformation bbox, grown by the
+        largest point radius and line width of the style, are reprojected.
+        Features smaller than ``min_feature_size`` pixels are skipped and the rest
+        is simplified to ``simplify_tolerance`` pixels, before they are all drawn in
+        bulk, see :func:`pymapper.render.render_geometries`. With a style rule, the
+        features are grouped by class and every class is drawn in bulk with its
+        own style, from the first to the last class. The drawn features are
+        labeled on top, see :meth:`get_label_layout`.
+
+        The ``cull``, ``reproject`` and ``simplify`` stages and the number of
+        features considered, reprojected and drawn are reported to the current
+        instrumentation, see :mod:`pymapper.instrumentation`.
 
-    def render(self):
-        """Render the layer."""
+        Args:
+            context (cairo.Context): The context to draw on.
+            transformation (ImageTransformation): The transformation from the layer
+                crs to pixel space.
+        """
+        resolution = transformation.get_resolution()
+        positions = self._cull(buffer_bbox(
+            transformation.bbox, get_symbol_extent(self.style) * resolution
+        ))
+        codes = styles = None
+        if not isinstance(self.style, Style):
+            codes, styles = self.get_classes()
+            positions = positions[codes[positions] >= 0]
+        positions, geometries = self._get_drawn(positions, resolution)
+        if codes is None:
+            render_geometries(context, geometries, transformation, self.style)
+        else:
+            self._render_classes(
+                context, geometries, transformation, codes[positions], styles
+            )
+        if self.labels is not None:
+            texts, corners = self.get_label_layout(context, positions, transformation)
+            draw_labels(context, texts, corners, self.labels)
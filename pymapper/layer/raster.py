@@ -0,0 +1,296 @@
+"""
+Define the RasterLayer, a layer that draws GeoTIFF and other GDAL raster files.
+
+Rasters are read with :mod:`rasterio`, which is installed with the ``raster``
+extra. Every render only reads the window of the raster that the transformation
+bbox covers, from the overview whose resolution best matches the output pixel
+size, and resamples it straight to the output size. Rendering a small area or
+the whole raster at a low zoom level reads about as many pixels as the image has,
+whatever the size of the raster.
+"""
+from typing import Sequence, Union
+import numpy as np
+from pyproj.crs.crs import CRS
+from ..instrumentation import get_instrumentation
+from ..output import array_to_surface
+from ..projection import transform_bounds
+from ..render import paint_surface
+from .base import BaseLayer
+
+
+GDAL_OPTIONS = {"GTIFF_VIRTUAL_MEM_IO": "IF_ENOUGH_RAM"}
+"""Default GDAL configuration options, to memory map uncompressed GeoTIFF files."""
+
+RANGE_SAMPLE_SIZE = 1024
+"""The maximum width and height of the sample the default value range is read
+from."""
+
+
+def select_overview(overviews: Sequence[int], resolution: float,
+                    target_resolution: float) -> Union[int, None]:
+    """Select the overview to read for a target resolution.
+
+    Args:
+        overviews (list): The decimation factors of the overviews, in increasing
+            order, like ``dataset.overviews(1)``.
+        resolution (float): The size of a pixel of the full resolution raster.
+        target_resolution (float): The size of an output pixel, in the same units.
+
+    Returns:
+        int: The index of the coarsest overview that is still at least as detailed
+        as the output, or None to read the full resolution raster.
+    """
+    level = None
+    for index, factor in enumerate(overviews):
+        if resolution * factor <= target_resolution * (1 + 1e-9):
+            level = index
+    return level
+
+
+def scale_bands(data: np.ndarray, mask: np.ndarray, vmin: float,
+                vmax: float) -> np.ndarray:
+    """Scale raster bands to RGBA pixels.
+
+    One band is drawn in grey, two bands as grey and alpha, three bands as RGB and
+    four bands as RGBA.
+
+    Args:
+        data (numpy.ndarray): (bands, height, width) array with the band values.
+        mask (numpy.ndarray): (height, width) boolean array, True for nodata
+            pixels, which are transparent.
+        vmin (float): The value drawn as 0.
+        vmax (float): The value drawn as 255.
+
+    Returns:
+        numpy.ndarray: (height, width, 4) uint8 array with RGBA pixels.
+
+    Raises:
+        ValueError: If there are more than four bands.
+    """
+    count = data.shape[0]
+    if count > 4:
+        raise ValueError(f"Can't draw {count} bands, select at most 4 bands.")
+    scale = 255 / (vmax - vmin) if vmax > vmin else 0.0
+    values = np.clip(np.rint((data - vmin) * scale), 0, 255).astype(np.uint8)
+    rgba = np.empty(data.shape[1:] + (4,), dtype=np.uint8)
+    if count <= 2:
+        rgba[..., :3] = values[0][..., np.newaxis]
+    else:
+        rgba[..., :3] = np.moveaxis(values[:3], 0, -1)
+    rgba[..., 3] = values[-1] if count in (2, 4) else 255
+    rgba[mask, 3] = 0
+    return rgba
+
+
+class RasterLayer(BaseLayer):  # pylint: disable=R0902
+    """Raster layer that reads windows of a GeoTIFF or other GDAL raster file.
+
+    Rasters in another crs than the map are warped on the fly with a
+    :class:`rasterio.vrt.WarpedVRT`. Cloud optimized GeoTIFFs and other files with
+    internal or external overviews only need the pixels of one overview level per
+    render.
+
+    Args:
+        name (str): The layer name.
+        path (str): The path or URL of the raster.
+        bands (list): The band indexes to draw, starting at 1 (default all bands
+            up to 4).
+        vmin (float): The band value drawn as 0, defaults to the minimum of the
+            smallest overview, decimated to at most ``RANGE_SAMPLE_SIZE`` pixels
+            wide and high, or 0 for 8 bit rasters.
+        vmax (float): The band value drawn as 255, defaults to the maximum of that
+            sample, or 255 for 8 bit rasters.
+        resampling (str): The name of the :class:`rasterio.enums.Resampling`
+            method (default "bilinear").
+        opacity (float): The opacity of the layer.
+        gdal_options (dict): GDAL configuration options used while reading.
+
+    Attributes:
+        name (str): The layer name.
+        path (str): The path or URL of the raster.
+        bands (list): The band indexes to draw.
+        vmin (float): The band value drawn as 0.
+        vmax (float): The band value drawn as 255.
+        resampling (str): The resampling method.
+        opacity (float): The opacity of the layer.
+        gdal_options (dict): GDAL configuration options.
+        source_crs (pyproj.crs.crs.CRS): The crs of the raster.
+        source_bbox (tuple): (minx, miny, maxx, maxy) bounds of the raster in
+            ``source_crs``.
+        resolution (float): The pixel size of the raster in ``source_crs``.
+        overviews (list): The decimation factors of the overviews.
+    """
+
+    LAYER_TYPE = "RasterLayer"
+
+    def __init__(  # pylint: disable=R0913
+        self, name: str, path: str, bands: Sequence[int] = None, vmin: float = None,
+        vmax: float = None, resampling: str = "bilinear", opacity: float = 1.0,
+        gdal_options: dict = None
+    ):
+        """Initialize the class."""
+        self.path = path
+        self.resampling = resampling
+        self.opacity = opacity
+        self.gdal_options = dict(GDAL_OPTIONS if gdal_options is None
+                                 else gdal_options)
+        self._datasets = {}
+        with self._env():
+            dataset = self._open(None)
+            self.source_crs = CRS.from_user_input(dataset.crs)
+            self.source_bbox = tuple(dataset.bounds)
+            self.resolution = min(abs(value) for value in dataset.res)
+            self.overviews = list(dataset.overviews(1))
+            self.bands = list(bands) if bands is not None else list(
+                range(1, min(dataset.count, 4) + 1)
+            )
+            if vmin is None or vmax is None:
+                low, high = self._get_range(dataset)
+                vmin = low if vmin is None else vmin
+                vmax = high if vmax is None else vmax
+        self.vmin = vmin
+        self.vmax = vmax
+        super().__init__(name, crs=self.source_crs, bbox=self.source_bbox)
+
+    def __getstate__(self):
+        """Get the state for pickling, without the open datasets."""
+        state = self.__dict__.copy()
+        state["_datasets"] = {}
+        return state
+
+    def _env(self):
+        """Get the rasterio environment with the GDAL options."""
+        import rasterio  # pylint: disable=C0415,E0401
+        return rasterio.Env(**self.gdal_options)
+
+    def _open(self, level):
+        """Open the raster at an overview level, reusing open datasets."""
+        dataset = self._datasets.get(level)
+        if dataset is None:
+            import rasterio  # pylint: disable=C0415,E0401
+            kwargs = {} if level is None else {"overview_level": level}
+            dataset = rasterio.open(self.path, **kwargs)
+            self._datasets[level] = dataset
+        return dataset
+
+    def _get_range(self, dataset):
+        """Get the value range of the bands from a decimated read of the smallest
+        overview, so rasters without overviews aren't read in full. Falls back to
+        (0, 255) when the sample only has nodata."""
+        if all(dtype == "uint8" for dtype in dataset.dtypes):
+            return 0, 255
+        source = dataset
+        if self.overviews:
+            source = self._open(len(self.overviews) - 1)
+        scale = min(1.0, RANGE_SAMPLE_SIZE / max(source.width, source.height))
+        shape = (len(self.bands), max(1, round(source.height * scale)),
+                 max(1, round(source.width * scale)))
+        data = source.read(self.bands, out_shape=shape, masked=True)
+        if not data.count():
+            return 0.0, 255.0
+        return float(data.min()), float(data.max())
+
+    def set_crs(self, crs: CRS):
+        """Set the crs to draw the raster in."""
+        crs = CRS.from_user_input(crs)
+        self.crs = crs
+        self.bbox = transform_bounds(self.source_bbox, self.source_crs, crs)
+
+    def close(self):
+        """Close the open datasets."""
+        for dataset in self._datasets.values():
+            dataset.close()
+        self._datasets = {}
+
+    def cache_key(self):
+        """Get a hashable key identifying the rendered output of the layer."""
+        return (self.LAYER_TYPE, self.path, tuple(self.bands), self.vmin, self.vmax,
+                self.resampling, self.opacity, self.crs.to_wkt(), self.version)
+
+    def get_overview(self, transformation) -> Union[int, None]:
+        """Get the overview level to read for a transformation.
+
+        Args:
+            transformation (ImageTransformation): The transformation to render.
+
+        Returns:
+            int: The overview level, or None for the full resolution raster.
+        """
+        minx, miny, maxx, maxy = self.source_bbox
+        lminx, lminy, lmaxx, lmaxy = self.bbox
+        # Output pixel size in source units, approximated over the whole raster.
+        scale = max((maxx - minx) / (lmaxx - lminx), (maxy - miny) / (lmaxy - lminy))
+        return select_overview(
+            self.overviews, self.resolution,
+            transformation.get_resolution() * scale
+        )
+
+    def get_window(self, transformation):
+        """Get the part of the layer bbox that a transformation covers.
+
+        Args:
+            transformation (ImageTransformation): The transformation to render.
+
+        Returns:
+            tuple: The (minx, miny, maxx, maxy) bbox in the layer crs, and its width
+            and height in output pixels.
+        """
+        minx, miny, maxx, maxy = transformation.bbox
+        lminx, lminy, lmaxx, lmaxy = self.bbox
+        bbox = (max(minx, lminx), max(miny, lminy), min(maxx, lmaxx),
+                min(maxy, lmaxy))
+        width = round((bbox[2] - bbox[0]) * abs(transformation.xx))
+        height = round((bbox[3] - bbox[1]) * abs(transformation.yy))
+        return bbox, width, height
+
+    def read(self, bbox, width: int, height: int, level=None):
+        """Read a window of the raster, resampled to a size.
+
+        Args:
+            bbox (tuple): (minx, miny, maxx, maxy) of the window in the layer crs.
+            width (int): The width in pixels to resample to.
+            height (int): The height in pixels to resample to.
+            level (int): The overview level to read, see :meth:`get_overview`.
+
+        Returns:
+            numpy.ma.MaskedArray: (bands, height, width) array with nodata masked.
+        """
+        from rasterio.enums import Resampling  # pylint: disable=C0415,E0401
+        from rasterio.vrt import WarpedVRT  # pylint: disable=C0415,E0401
+        from rasterio.windows import from_bounds  # pylint: disable=C0415,E0401
+        resampling = Resampling[self.resampling]
+        source = dataset = self._open(level)
+        if self.crs != self.source_crs:
+            dataset = WarpedVRT(source, crs=self.crs.to_wkt(), resampling=resampling)
+        try:
+            window = from_bounds(*bbox, transform=dataset.transform)
+            return dataset.read(
+                self.bands, window=window, out_shape=(len(self.bands), height, width),
+                resampling=resampling, masked=True,
+                # Warped datasets can't read outside their bounds.
+                boundless=dataset is source
+            )
+        finally:
+            if dataset is not source:
+                dataset.close()
+
+    def render(self, context, transformation):
+        """Read the window covering the transformation bbox and paint it.
+
+        Args:
+            context (cairo.Context): The context to draw on.
+            transformation (ImageTransformation): The transformation from the layer
+                crs to pixel space.
+        """
+        bbox, width, height = self.get_window(transformation)
+        if width < 1 or height < 1:
+            return
+        instrumentation = get_instrumentation()
+        with instrumentation.stage("read"), self._env():
+            data = self.read(bbox, width, height, self.get_overview(transformation))
+        with instrumentation.stage("draw"):
+            mask = np.ma.getmaskarray(data).any(axis=0)
+            image = array_to_surface(
+                scale_bands(np.ma.getdata(data), mask, self.vmin, self.vmax)
+            )
+            paint_surface(context, image, bbox, transformation, self.opacity)
@@ -0,0 +1,511 @@
+"""
+Define the SnapshotLayer, a vector layer drawn from a precompiled layer snapshot.
+
+A snapshot is a directory with the geometries of a prepared
+:class:`pymapper.layer.GeoPandasLayer`, already reprojected to the layer crs, as
+flat NumPy arrays in ``.npy`` files, and a ``snapshot.json`` file with the
+metadata and styles:
+
+- ``coords``: (n, 2) float64 coordinates of all parts.
+- ``part_offsets``: The start of every part in ``coords``, with the end of the
+  last part at the end.
+- ``part_types``: The :data:`POINT`, :data:`LINE`, :data:`SHELL` or :data:`HOLE`
+  type of every part. The holes of a polygon follow its shell.
+- ``feature_offsets``: The first part of every feature, the parts are ordered by
+  feature.
+- ``bounds``: (features, 4) bounding boxes of the features, NaN when empty.
+- ``types``: The shapely geometry type id of every feature.
+- ``codes``: The style class of every feature, only for layers with a style rule.
+- ``index_boxes`` and ``index_order``: The :class:`PackedIndex` of the bounds.
+
+The arrays are opened with memory mapping, so opening a snapshot doesn't read or
+parse the data, and all processes rendering the same snapshot share the pages of
+the files in the page cache. Pickling a :class:`SnapshotLayer` only pickles the
+path, so starting a worker process doesn't copy the data either.
+"""
+import json
+import os
+from typing import Union
+import numpy as np
+import shapely
+from pyproj.crs.crs import CRS
+from ..instrumentation import get_instrumentation
+from ..render import (
+    BATCH_SIZE, draw_circles, draw_paths, draw_rings, explode_parts, get_offsets,
+    transform_coords, vector_context
+)
+from ..style import Style, get_symbol_extent
+from .base import BaseLayer, bbox_contains, buffer_bbox
+
+
+FORMAT_VERSION = 1
+"""The version of the snapshot format written by :func:`write_snapshot`."""
+
+METADATA_FILE = "snapshot.json"
+"""The name of the metadata file in a snapshot directory."""
+
+NODE_SIZE = 16
+"""Default number of children per node of a :class:`PackedIndex`."""
+
+POINT, LINE, SHELL, HOLE = 0, 1, 2, 3
+"""The part types of a snapshot."""
+
+POINT_TYPES = (shapely.GeometryType.POINT, shapely.GeometryType.MULTIPOINT)
+
+
+def gather_ranges(offsets, index):
+    """Get the element positions of groups of a flat array.
+
+    Args:
+        offsets (numpy.ndarray): Group start offsets, with the end of the last
+            group at the end.
+        index (numpy.ndarray): Integer positions of the groups to get.
+
+    Returns:
+        tuple: The positions of the elements of the groups, in the order of
+        ``index``, and their new group offsets.
+    """
+    starts = offsets[index]
+    counts = offsets[index + 1] - starts
+    return _concat_ranges(starts, counts), np.concatenate([[0], np.cumsum(counts)])
+
+
+def _concat_ranges(starts, counts):
+    """Concatenate the ranges ``start:start + count``."""
+    ends = np.cumsum(counts)
+    return np.repeat(starts - ends + counts, counts) + np.arange(
+        ends[-1] if len(ends) else 0
+    )
+
+
+def _morton_codes(bounds):
+    """Get the Z-order curve codes of the centers of bounding boxes."""
+    centers = np.column_stack([bounds[:, 0] + bounds[:, 2],
+                               bounds[:, 1] + bounds[:, 3]]) / 2
+    low, high = centers.min(axis=0), centers.max(axis=0)
+    scale = np.where(high > low, 0xFFFF / np.where(high > low, high - low, 1), 0)
+    cells = ((centers - low) * scale).astype(np.uint64)
+    for shift, mask in ((8, 0x00FF00FF), (4, 0x0F0F0F0F), (2, 0x33333333),
+                        (1, 0x55555555)):
+        cells = (cells | cells << np.uint64(shift)) & np.uint64(mask)
+    return cells[:, 0] | cells[:, 1] << np.uint64(1)
+
+
+class PackedIndex:
+    """Static packed R-tree of bounding boxes, stored as flat arrays.
+
+    The boxes are sorted along a Z-order curve and grouped by ``node_size`` into
+    nodes, level by level up to a single root. Queries descend the levels with
+    array operations, so the index is queried without building or unpickling a
+    tree, straight from memory mapped arrays.
+
+    Args:
+        boxes (numpy.ndarray): (nodes, 4) bounding boxes of all levels, from the
+            leaves to the root.
+        order (numpy.ndarray): The item position of every leaf.
+        node_size (int): The number of children per node.
+
+    Attributes:
+        boxes (numpy.ndarray): The bounding boxes of all levels.
+        order (numpy.ndarray): The item position of every leaf.
+        node_size (int): The number of children per node.
+        level_offsets (list): The start of every level in ``boxes``, with the end
+            of the root level at the end.
+    """
+
+    def __init__(self, boxes, order, node_size: int = NODE_SIZE):
+        """Initialize the class."""
+        self.boxes = boxes
+        self.order = order
+        self.node_size = node_size
+        self.level_offsets = [0]
+        size = len(order)
+        while size:
+            self.level_offsets.append(self.level_offsets[-1] + size)
+            size = 0 if size == 1 else -(-size // node_size)
+
+    @classmethod
+    def build(cls, bounds, node_size: int = NODE_SIZE) -> "PackedIndex":
+        """Build the index of bounding boxes.
+
+        Args:
+            bounds (numpy.ndarray): (items, 4) bounding boxes. Items with NaN
+                bounds are left out.
+            node_size (int): The number of children per node.
+
+        Returns:
+            PackedIndex: The index.
+        """
+        order = np.flatnonzero(np.isfinite(bounds).all(axis=1))
+        if len(order):
+            order = order[np.argsort(_morton_codes(bounds[order]), kind="stable")]
+        levels = [bounds[order]]
+        while len(levels[-1]) > 1:
+            boxes = levels[-1]
+            starts = np.arange(0, len(boxes), node_size)
+            levels.append(np.column_stack([
+                np.minimum.reduceat(boxes[:, 0], starts),
+                np.minimum.reduceat(boxes[:, 1], starts),
+                np.maximum.reduceat(boxes[:, 2], starts),
+                np.maximum.reduceat(boxes[:, 3], starts),
+            ]))
+        return cls(np.concatenate(levels).reshape(-1, 4), order, node_size)
+
+    def query(self, bbox) -> np.ndarray:
+        """Get the items whose bounding box intersects a bounding box.
+
+        Args:
+            bbox (tuple): (minx, miny, maxx, maxy) to query.
+
+        Returns:
+            numpy.ndarray: Sorted integer positions of the items.
+        """
+        minx, miny, maxx, maxy = bbox
+        offsets = self.level_offsets
+        nodes = np.arange(offsets[-2], offsets[-1]) if len(offsets) > 1 else (
+            np.empty(0, dtype=np.intp)
+        )
+        for level in range(len(offsets) - 2, -1, -1):
+            boxes = self.boxes[nodes]
+            nodes = nodes[(boxes[:, 0] <= maxx) & (boxes[:, 2] >= minx)
+                          & (boxes[:, 1] <= maxy) & (boxes[:, 3] >= miny)]
+            if level == 0:
+                break
+            starts = offsets[level - 1] + (nodes - offsets[level]) * self.node_size
+            counts = np.minimum(starts + self.node_size, offsets[level]) - starts
+            nodes = _concat_ranges(starts, counts)
+        return np.sort(self.order[nodes])
+
+
+def _style_to_dict(style: Style) -> dict:
+    """Get the values of a style as a JSON serializable dict."""
+    return {key: list(value) if isinstance(value, tuple) else value
+            for key, value in ((key, getattr(style, key)) for key in Style.KEYS)}
+
+
+def _style_from_dict(values: dict) -> Style:
+    """Create a style from the values written by :func:`_style_to_dict`."""
+    return Style(**{key: tuple(value) if isinstance(value, list) else value
+                    for key, value in values.items()})
+
+
+def _get_parts(geometries):  # pylint: disable=R0914
+    """Get the flat part arrays of geometries, with the parts ordered by feature.
+
+    Returns:
+        dict: The coordinates, part offsets, part types and feature offsets.
+    """
+    parts, part_feature = explode_parts(geometries)
+    type_ids = shapely.get_type_id(parts)
+    polygons = type_ids == shapely.GeometryType.POLYGON
+    points = type_ids == shapely.GeometryType.POINT
+    lines = ~(polygons | points)
+    rings, ring_polygon = shapely.get_rings(parts[polygons], return_index=True)
+    is_shell = np.ones(len(rings), dtype=bool)
+    is_shell[1:] = ring_polygon[1:] != ring_polygon[:-1]
+    row_parts = np.concatenate([parts[points], parts[lines], rings])
+    row_feature = np.concatenate([
+        part_feature[points], part_feature[lines],
+        part_feature[polygons][ring_polygon]
+    ])
+    row_types = np.concatenate([
+        np.full(points.sum(), POINT), np.full(lines.sum(), LINE),
+        np.where(is_shell, SHELL, HOLE)
+    ]).astype(np.uint8)
+    coords, coord_row = shapely.get_coordinates(row_parts, return_index=True)
+    order = np.argsort(row_feature, kind="stable")
+    positions, part_offsets = gather_ranges(
+        get_offsets(coord_row, len(row_parts)), order
+    )
+    return {
+        "coords": coords[positions],
+        "part_offsets": part_offsets.astype(np.int64),
+        "part_types": row_types[order],
+        "feature_offsets": get_offsets(
+            row_feature[order], len(geometries)
+        ).astype(np.int64),
+    }
+
+
+def write_snapshot(layer, path: str, node_size: int = NODE_SIZE) -> str:
+    """Write a snapshot of a GeoPandasLayer in its current crs.
+
+    The geometries are reprojected, and with a style rule the features are
+    classified, using the cached results of the layer.
+
+    Args:
+        layer (GeoPandasLayer): The layer.
+        path (str): The directory to write the snapshot to, which is created when
+            it doesn't exist.
+        node_size (int): The number of children per node of the spatial index.
+
+    Returns:
+        str: ``path``
+    """
+    os.makedirs(path, exist_ok=True)
+    geometries = layer.get_geometries()
+    bounds = shapely.bounds(geometries)
+    index = PackedIndex.build(bounds, node_size)
+    arrays = dict(
+        _get_parts(geometries),
+        bounds=bounds,
+        types=shapely.get_type_id(geometries).astype(np.int8),
+        index_boxes=index.boxes,
+        index_order=index.order.astype(np.int64),
+    )
+    if isinstance(layer.style, Style):
+        styles = [layer.style]
+    else:
+        codes, styles = layer.get_classes()
+        arrays["codes"] = codes.astype(np.int64)
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(array))
+    metadata = {
+        "format_version": FORMAT_VERSION,
+        "name": layer.name,
+        "crs": layer.crs.to_wkt() if layer.crs is not None else None,
+        "bbox": [float(value) for value in layer.bbox],
+        "features": len(geometries),
+        "data_hash": layer.get_data_hash(),
+        "styles": [_style_to_dict(style) for style in styles],
+        "simplify_tolerance": layer.simplify_tolerance,
+        "min_feature_size": layer.min_feature_size,
+        "node_size": node_size,
+        "arrays": sorted(arrays),
+    }
+    with open(os.path.join(path, METADATA_FILE), "w", encoding="utf-8") as file:
+        json.dump(metadata, file)
+    return path
+
+
+def _thin(coords, offsets, tolerance: float):
+    """Drop vertices in the same ``tolerance`` sized cell as the previous vertex,
+    keeping the first and last vertex of every part."""
+    cells = np.floor(coords / tolerance)
+    keep = np.ones(len(coords), dtype=bool)
+    keep[1:] = (cells[1:] != cells[:-1]).any(axis=1)
+    keep[offsets[:-1]] = True
+    keep[offsets[1:] - 1] = True
+    kept = np.concatenate([[0], np.cumsum(keep)])
+    return coords[keep], kept[offsets]
+
+
+class SnapshotLayer(BaseLayer):  # pylint: disable=R0902
+    """Vector layer drawn from a snapshot written by :func:`write_snapshot`.
+
+    The layer can only be drawn in the crs of the snapshot. Features are culled
+    with the packed spatial index and the feature bounds, and the coordinates of
+    the remaining parts are gathered from the memory mapped arrays and drawn
+    without creating shapely geometries. Instead of simplifying the geometries,
+    vertices within ``simplify_tolerance`` pixels of the previous vertex are
+    dropped. Labels and time ranges are not part of a snapshot.
+
+    Args:
+        name (str): The layer name, defaults to the name of the snapshotted layer.
+        path (str): The snapshot directory.
+        batch_size (int): The number of parts drawn per fill/stroke.
+
+    Attributes:
+        name (str): The layer name.
+        path (str): The snapshot directory.
+        metadata (dict): The contents of ``snapshot.json``.
+        styles (list): The style of every class, a single style for layers
+            without a style rule.
+        simplify_tolerance (float): The simplification tolerance in pixels.
+        min_feature_size (float): The minimum feature size in pixels.
+        batch_size (int): The number of parts drawn per fill/stroke.
+
+    Raises:
+        ValueError: If the snapshot format version is not supported.
+    """
+
+    LAYER_TYPE = "SnapshotLayer"
+
+    def __init__(self, name: Union[str, None], path: str,
+                 batch_size: int = BATCH_SIZE):
+        """Initialize the class."""
+        self.path = path
+        with open(os.path.join(path, METADATA_FILE), encoding="utf-8") as file:
+            self.metadata = json.load(file)
+        if self.metadata["format_version"] != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported snapshot format {self.metadata['format_version']}."
+            )
+        self.styles = [_style_from_dict(style) for style in self.metadata["styles"]]
+        self.simplify_tolerance = self.metadata["simplify_tolerance"]
+        self.min_feature_size = self.metadata["min_feature_size"]
+        self.batch_size = batch_size
+        self._arrays = {}
+        self._index = None
+        crs = self.metadata["crs"]
+        super().__init__(
+            name if name is not None else self.metadata["name"],
+            crs=CRS.from_user_input(crs) if crs is not None else None,
+            bbox=tuple(self.metadata["bbox"])
+        )
+
+    def __getstate__(self):
+        """Get the state for pickling, without the memory mapped arrays."""
+        state = self.__dict__.copy()
+        state["_arrays"] = {}
+        state["_index"] = None
+        return state
+
+    def get_array(self, name: str) -> np.ndarray:
+        """Get an array of the snapshot, memory mapped on first use.
+
+        Args:
+            name (str): The name of the array, like "coords".
+
+        Returns:
+            numpy.ndarray: The read-only array, or None when the snapshot doesn't
+            have it.
+        """
+        if name not in self._arrays:
+            array = None
+            if name in self.metadata["arrays"]:
+                array = np.load(os.path.join(self.path, f"{name}.npy"),
+                                mmap_mode="r")
+            self._arrays[name] = array
+        return self._arrays[name]
+
+    @property
+    def index(self) -> PackedIndex:
+        """The spatial index of the features."""
+        if self._index is None:
+            self._index = PackedIndex(
+                self.get_array("index_boxes"), self.get_array("index_order"),
+                self.metadata["node_size"]
+            )
+        return self._index
+
+    def set_crs(self, crs: CRS):
+        """Check that the layer is drawn in the crs of the snapshot.
+
+        Raises:
+            ValueError: If ``crs`` is another crs than the crs of the snapshot.
+        """
+        if crs is not None:
+            crs = CRS.from_user_input(crs)
+        if crs != self.crs:
+            raise ValueError(
+                f"The snapshot of layer {self.name!r} can only be drawn in its own "
+                "crs, write a snapshot of the layer in the map crs."
+            )
+
+    def prepare(self):
+        """Map all arrays of the snapshot."""
+        for name in self.metadata["arrays"]:
+            self.get_array(name)
+
+    def cache_key(self):
+        """Get a hashable key identifying the rendered output of the layer.
+
+        Returns:
+            tuple: The layer type, content hash of the snapshotted data, crs, style
+            keys and level of detail settings.
+        """
+        crs = self.crs.to_wkt() if self.crs is not None else None
+        return (self.LAYER_TYPE, self.metadata["data_hash"], crs,
+                tuple(style.key() for style in self.styles),
+                self.simplify_tolerance, self.min_feature_size)
+
+    def query_bbox(self, bbox):
+        """Get the positions of the features that intersect a bounding box.
+
+        Args:
+            bbox (tuple): (minx, miny, maxx, maxy) in the layer crs.
+
+        Returns:
+            numpy.ndarray: Sorted integer positions of the features.
+        """
+        if bbox_contains(bbox, self.bbox):
+            return np.flatnonzero(np.isfinite(self.get_array("bounds")[:, 0]))
+        return self.index.query(bbox)
+
+    def filter_small(self, positions, resolution: float):
+        """Drop lines and polygons smaller than ``min_feature_size`` pixels.
+
+        Args:
+            positions (numpy.ndarray): Integer positions of the features.
+            resolution (float): The size of a pixel in map units.
+
+        Returns:
+            numpy.ndarray: The positions of the features that are large enough or
+            are points.
+        """
+        minx, miny, maxx, maxy = self.get_array("bounds")[positions].T
+        keep = ~(np.fmax(maxx - minx, maxy - miny)
+                 < self.min_feature_size * resolution)
+        keep |= np.isin(self.get_array("types")[positions], POINT_TYPES)
+        return positions[keep]
+
+    def _get_coords(self, parts, matrix, tolerance):
+        """Get the pixel coordinates and offsets of parts."""
+        positions, offsets = gather_ranges(self.get_array("part_offsets"), parts)
+        coords = transform_coords(self.get_array("coords")[positions], matrix)
+        if tolerance and len(parts):
+            coords, offsets = _thin(coords, offsets, tolerance)
+        return coords, offsets
+
+    def _draw(self, context, positions, matrix, style):
+        """Draw the polygons, then the lines and then the points of features."""
+        parts, _ = gather_ranges(self.get_array("feature_offsets"), positions)
+        types = self.get_array("part_types")[parts]
+        tolerance = self.simplify_tolerance
+        with vector_context(context):
+            rings = parts[types >= SHELL]
+            is_shell = types[types >= SHELL] == SHELL
+            # Batches start at a shell, so holes are filled with their shell.
+            starts = np.append(np.flatnonzero(is_shell)[::self.batch_size], len(rings))
+            for start, end in zip(starts[:-1].tolist(), starts[1:].tolist()):
+                coords = self._get_coords(rings[start:end], matrix, tolerance)
+                draw_rings(context, *coords, is_shell[start:end], style)
+            for batch in self._batches(parts[types == LINE]):
+                draw_paths(context, *self._get_coords(batch, matrix, tolerance), style)
+            for batch in self._batches(parts[types == POINT]):
+                draw_circles(context, self._get_coords(batch, matrix, 0)[0], style)
+
+    def _batches(self, parts):
+        """Split parts in batches of ``batch_size``."""
+        return (parts[start:start + self.batch_size]
+                for start in range(0, len(parts), self.batch_size))
+
+    def render(self, context, transformation):
+        """Render the layer.
+
+        The ``cull``, ``path`` and ``draw`` stages and the number of features
+        considered and drawn are reported to the current instrumentation, see
+        :mod:`pymapper.instrumentation`.
+
+        Args:
+            context (cairo.Context): The context to draw on.
+            transformation (ImageTransformation): The transformation from the layer
+                crs to pixel space.
+        """
+        instrumentation = get_instrumentation()
+        with instrumentation.stage("cull"):
+            extent = max(get_symbol_extent(style) for style in self.styles)
+            positions = self.query_bbox(buffer_bbox(
+                transformation.bbox, extent * transformation.get_resolution()
+            ))
+            instrumentation.count("features_considered", len(positions))
+            codes = self.get_array("codes")
+            if codes is not None:
+                positions = positions[codes[positions] >= 0]
+            if self.min_feature_size:
+                positions = self.filter_small(
+                    positions, transformation.get_resolution()
+                )
+        instrumentation.count("features_drawn", len(positions))
+        matrix = transformation.get_shapely_matrix()
+        if codes is None:
+            self._draw(context, positions, matrix, self.styles[0])
+            return
+        # Draw the features grouped by class, from the first to the last class.
+        positions = positions[np.argsort(codes[positions], kind="stable")]
+        offsets = get_offsets(codes[positions], len(self.styles))
+        for code, style in enumerate(self.styles):
+            start, end = offsets[code], offsets[code + 1]
+            if end > start:
+                self._draw(context, positions[start:end], matrix, style)
@@ -0,0 +1,335 @@
+"""
+Define the raster layers backed by OGC web services: WMSLayer and WMTSLayer.
+"""
+import io
+import math
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+import cairo
+import requests
+from requests.adapters import HTTPAdapter
+from pyproj.crs.crs import CRS
+from ..cache import LRUCache
+from ..instrumentation import get_instrumentation
+from ..projection import transform_bounds
+from ..render import paint_surface
+from ..tiles import TILE_SIZE, WEB_MERCATOR, WORLD_SIZE, tile_bounds, tiles_for_bbox
+from .base import BaseLayer
+
+
+RESPONSE_CACHE_BYTES = 64 * 2 ** 20
+"""Default number of bytes of responses to keep per layer."""
+
+
+class _HTTPLayer(BaseLayer):  # pylint: disable=W0223
+    """Base class for layers that fetch PNG images over HTTP.
+
+    Responses are fetched with a pooled :class:`requests.Session` and kept in an LRU
+    cache keyed by URL. The session and thread pool are created on first use and
+    are not pickled.
+    """
+
+    def __init__(  # pylint: disable=R0913
+        self, name: str, crs, bbox, max_workers: int = 8, timeout: float = 30,
+        cache_bytes: int = RESPONSE_CACHE_BYTES
+    ):
+        """Initialize the class."""
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.responses = LRUCache(maxsize=100000, maxbytes=cache_bytes)
+        self._session = None
+        self._executor = None
+        super().__init__(name, crs=crs, bbox=bbox)
+
+    def __getstate__(self):
+        """Get the state for pickling, without the session and thread pool."""
+        state = self.__dict__.copy()
+        state["_session"] = state["_executor"] = None
+        return state
+
+    @property
+    def session(self) -> requests.Session:
+        """The HTTP session, with a connection pool of ``max_workers`` connections."""
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=self.max_workers, pool_maxsize=self.max_workers
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._session = session
+        return self._session
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """The thread pool used to fetch images concurrently."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def fetch(self, url: str) -> bytes:
+        """Fetch a URL, using the response cache.
+
+        Args:
+            url (str): The URL to fetch.
+
+        Returns:
+            bytes: The response body.
+
+        Raises:
+            requests.HTTPError: If the server returns an error status.
+        """
+        data = self.responses.get(url)
+        if data is None:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.content
+            self.responses.put(url, data)
+        return data
+
+    def close(self):
+        """Shut down the thread pool and close the HTTP connections."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+def paint_image(context, data: bytes, bbox, transformation):
+    """Paint a PNG image covering a bounding box onto a context.
+
+    Args:
+        context (cairo.Context): The context to draw on.
+        data (bytes): The PNG image.
+        bbox (tuple): (minx, miny, maxx, maxy) covered by the image, in the crs of
+            the transformation.
+        transformation (ImageTransformation): The transformation to pixel space.
+    """
+    image = cairo.ImageSurface.create_from_png(io.BytesIO(data))
+    paint_surface(context, image, bbox, transformation)
+
+
+class WMSLayer(_HTTPLayer):  # pylint: disable=R0902
+    """Raster layer fetching one image per render from a WMS GetMap request.
+
+    The image is requested in the layer crs for exactly the bbox and size of the
+    transformation.
+
+    Args:
+        name (str): The layer name.
+        url (str): The WMS service URL.
+        layers (list): The names of the WMS layers to request.
+        bbox (tuple): (minx, miny, maxx, maxy) bounding box in ``crs``. When None,
+            it is read from the service capabilities with :mod:`owslib`.
+        crs (pyproj.crs.crs.CRS): The crs of ``bbox`` (default EPSG:4326).
+        styles (list): The WMS styles, one per layer.
+        wms_version (str): The WMS version (default 1.3.0).
+        max_workers (int): The size of the connection pool.
+        timeout (float): The request timeout in seconds.
+
+    Attributes:
+        url (str): The WMS service URL.
+        layers (list): The names of the WMS layers to request.
+        styles (list): The WMS styles.
+        wms_version (str): The WMS version.
+        source_crs (pyproj.crs.crs.CRS): The crs of the initial bbox.
+        source_bbox (tuple): The initial bbox in ``source_crs``.
+        responses (LRUCache): The response cache.
+    """
+
+    LAYER_TYPE = "WMSLayer"
+
+    def __init__(  # pylint: disable=R0913
+        self, name: str, url: str, layers, bbox=None, crs="EPSG:4326", styles=None,
+        wms_version: str = "1.3.0", max_workers: int = 4, timeout: float = 30
+    ):
+        """Initialize the class."""
+        self.url = url
+        self.layers = list(layers)
+        self.styles = list(styles) if styles is not None else [""] * len(self.layers)
+        self.wms_version = wms_version
+        self.timeout = timeout
+        self.source_crs = CRS.from_user_input(crs)
+        if bbox is None:
+            bbox = transform_bounds(
+                self._read_bbox(), CRS.from_user_input("OGC:CRS84"), self.source_crs
+            )
+        self.source_bbox = tuple(bbox)
+        super().__init__(name, self.source_crs, self.source_bbox, max_workers, timeout)
+
+    def _read_bbox(self):
+        """Read the combined WGS84 bbox of the layers from the capabilities."""
+        from owslib.wms import WebMapService  # pylint: disable=C0415
+        service = WebMapService(
+            self.url, version=self.wms_version, timeout=self.timeout
+        )
+        boxes = [service[layer].boundingBoxWGS84 for layer in self.layers]
+        return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+                max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+    def set_crs(self, crs: CRS):
+        """Set the crs to request the images in."""
+        crs = CRS.from_user_input(crs)
+        self.crs = crs
+        self.bbox = transform_bounds(self.source_bbox, self.source_crs, crs)
+
+    def get_map_url(self, transformation) -> str:
+        """Get the GetMap URL for a transformation.
+
+        Args:
+            transformation (ImageTransformation): The transformation to request the
+                image for.
+
+        Returns:
+            str: The URL.
+        """
+        minx, miny, maxx, maxy = transformation.bbox
+        bbox = (minx, miny, maxx, maxy)
+        crs_key = "SRS"
+        if self.wms_version >= "1.3.0":
+            crs_key = "CRS"
+            if self.crs.axis_info and self.crs.axis_info[0].direction == "north":
+                bbox = (miny, minx, maxy, maxx)
+        params = {
+            "SERVICE": "WMS",
+            "VERSION": self.wms_version,
+            "REQUEST": "GetMap",
+            "LAYERS": ",".join(self.layers),
+            "STYLES": ",".join(self.styles),
+            crs_key: self.crs.to_string(),
+            "BBOX": ",".join(repr(float(value)) for value in bbox),
+            "WIDTH": transformation.width,
+            "HEIGHT": transformation.height,
+            "FORMAT": "image/png",
+            "TRANSPARENT": "TRUE",
+        }
+        separator = "&" if "?" in self.url else "?"
+        return f"{self.url}{separator}{urlencode(params)}"
+
+    def cache_key(self):
+        """Get a hashable key identifying the rendered output of the layer."""
+        return (self.LAYER_TYPE, self.url, tuple(self.layers), tuple(self.styles),
+                self.wms_version, self.crs.to_wkt())
+
+    def render(self, context, transformation):
+        """Fetch and paint the image for the transformation.
+
+        Args:
+            context (cairo.Context): The context to draw on.
+            transformation (ImageTransformation): The transformation from the layer
+                crs to pixel space.
+        """
+        with get_instrumentation().stage("fetch"):
+            data = self.fetch(self.get_map_url(transformation))
+        paint_image(context, data, transformation.bbox, transformation)
+
+
+class WMTSLayer(_HTTPLayer):  # pylint: disable=R0902
+    """Raster layer compositing web mercator tiles from a WMTS or XYZ tile service.
+
+    Tiles are fetched concurrently from a thread pool over pooled connections, kept
+    in a response cache and composited with cairo. The tile URL is a template with
+    ``{z}``, ``{x}`` and ``{y}`` placeholders, like the RESTful ``ResourceURL``
+    template of a WMTS GoogleMapsCompatible tile matrix set.
+
+    Args:
+        name (str): The layer name.
+        url (str): The tile URL template.
+        min_zoom (int): The lowest zoom level of the service.
+        max_zoom (int): The highest zoom level of the service.
+        tile_size (int): The tile width and height in pixels.
+        prefetch (int): The number of tile rings around the viewport to fetch in the
+            background after every render, so panning hits the cache.
+        max_workers (int): The number of concurrent requests.
+        timeout (float): The request timeout in seconds.
+
+    Attributes:
+        url (str): The tile URL template.
+        min_zoom (int): The lowest zoom level of the service.
+        max_zoom (int): The highest zoom level of the service.
+        tile_size (int): The tile width and height in pixels.
+        prefetch (int): The number of tile rings to prefetch.
+        responses (LRUCache): The response cache.
+    """
+
+    LAYER_TYPE = "WMTSLayer"
+
+    def __init__(  # pylint: disable=R0913
+        self, name: str, url: str, min_zoom: int = 0, max_zoom: int = 19,
+        tile_size: int = TILE_SIZE, prefetch: int = 0, max_workers: int = 8,
+        timeout: float = 30
+    ):
+        """Initialize the class."""
+        self.url = url
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.tile_size = tile_size
+        self.prefetch = prefetch
+        half = WORLD_SIZE / 2
+        super().__init__(name, CRS.from_user_input(WEB_MERCATOR),
+                         (-half, -half, half, half), max_workers, timeout)
+
+    def set_crs(self, crs: CRS):
+        """Check the crs, tiles can only be drawn in web mercator.
+
+        Raises:
+            ValueError: If ``crs`` is not web mercator.
+        """
+        if CRS.from_user_input(crs) != self.crs:
+            raise ValueError(
+                f"{self.LAYER_TYPE} can only be rendered in {WEB_MERCATOR}."
+            )
+
+    def get_zoom(self, transformation) -> int:
+        """Get the zoom level with a resolution at least that of the transformation.
+
+        Args:
+            transformation (ImageTransformation): The transformation to render.
+
+        Returns:
+            int: The zoom level, between ``min_zoom`` and ``max_zoom``.
+        """
+        tiles = WORLD_SIZE / (self.tile_size * transformation.get_resolution())
+        zoom = math.ceil(math.log2(tiles) - 1e-9)
+        return min(max(zoom, self.min_zoom), self.max_zoom)
+
+    def get_tile_url(self, z, x, y) -> str:  # pylint: disable=C0103
+        """Get the URL of a tile."""
+        return self.url.format(z=z, x=x, y=y)
+
+    def _prefetch(self, zoom, bbox):
+        """Fetch the tiles in ``prefetch`` rings around bbox in the background."""
+        margin = self.prefetch * WORLD_SIZE / 2 ** zoom
+        minx, miny, maxx, maxy = bbox
+        for tile in tiles_for_bbox(
+            (minx - margin, miny - margin, maxx + margin, maxy + margin), zoom
+        ):
+            url = self.get_tile_url(*tile)
+            if url not in self.responses:
+                self.executor.submit(self.fetch, url)
+
+    def cache_key(self):
+        """Get a hashable key identifying the rendered output of the layer."""
+        return (self.LAYER_TYPE, self.url, self.min_zoom, self.max_zoom,
+                self.tile_size)
+
+    def render(self, context, transformation):
+        """Fetch the tiles covering the transformation bbox and composite them.
+
+        Args:
+            context (cairo.Context): The context to draw on.
+            transformation (ImageTransformation): The transformation from web
+                mercator to pixel space.
+        """
+        zoom = self.get_zoom(transformation)
+        tiles = list(tiles_for_bbox(transformation.bbox, zoom))
+        with get_instrumentation().stage("fetch"):
+            images = list(self.executor.map(
+                self.fetch, [self.get_tile_url(*tile) for tile in tiles]
+            ))
+        for tile, data in zip(tiles, images):
+            paint_image(context, data, tile_bounds(*tile), transformation)
+        if self.prefetch:
+            self._prefetch(zoom, transformation.bbox)
@@ -1,51 +1,579 @@
 """
 Contains the base map class.
 """
+import io
+import math
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from contextvars import copy_context
+import cairo
+from pyproj.crs.crs import CRS
+from .cache import make_key
+from .instrumentation import get_instrumentation
+from .output import VECTOR_SURFACES, get_output_format, surface_to_array
+from .tiles import (
+    TILE_SIZE, WEB_MERCATOR, WORLD_SIZE, directory_sink, render_tiles, tiles_for_bbox
+)
 from .transformation import ImageTransformation
 
 
-class Map:
+MAX_DIRTY_RECTS = 32
+"""Above this number of changed areas, a single area covering all is redrawn."""
+
+
+class Map:  # pylint: disable=R0902
     """The map is the basic class governing map generation.
 
     Args:
         width (int): The width of the map in pixels/
         height (int): The height of the map in pixels.
         crs (pyproj.crs.crs.CRS): The map coordinate reference system.
+        bbox (tuple): (minx, miny, maxx, maxy) bounding box of the map, defaults to
+            the combined bbox of the layers.
+        marginx (float): The x margin of the image transformation (default 0.2).
+        marginy (float): The y margin of the image transformation (default 0.2).
+        cache (RenderCache): Cache for rendered images, or None to always render.
+        workers (int): The number of threads rendering layers concurrently, 1 to
+            render the layers one after the other.
+        instrumentation (Instrumentation): Receives the timings and counts of
+            every render, see :mod:`pymapper.instrumentation`.
+        incremental (bool): Keep the last rendered image, and when the next render
+            has the same transformation and layers, only redraw the areas of the
+            features that changed since, see :meth:`BaseLayer.get_changes
+            <pymapper.layer.base.BaseLayer.get_changes>`. Call ``invalidate()`` on
+            a layer after changing anything but its data, like its style.
+        dirty_margin (int): The number of pixels around a changed feature that are
+            redrawn, which should cover half the line width plus the point radius
+            of the layer styles.
 
     Attributes:
         width (int): The width of the map in pixels.
         height (int): The height of the map in pixels.
-        transformation (ImageTransformation): The image transformation instrance.
+        bbox (tuple): (minx, miny, maxx, maxy) bounding box of the map, merged
+            with the bbox of the layers added since it was last used.
+        transformation (ImageTransformation): The image transformation instrance,
+            created from ``bbox`` on first use.
         crs (pyproj.crs.crs.CRS): The map coordinate reference system.
         layers (list): Layers for the map.
+        cache (RenderCache): Cache for rendered images.
+        workers (int): The number of threads rendering layers concurrently.
+        instrumentation (Instrumentation): Receives the timings and counts of
+            every render, or None.
+        incremental (bool): Whether only changed areas are redrawn.
+        dirty_margin (int): The number of pixels around a changed feature that are
+            redrawn.
 
     """
-    def __init__(self, width, height, crs, bbox=None):
+    def __init__(  # pylint: disable=R0913
+        self, width, height, crs, bbox=None, marginx=0.2, marginy=0.2, cache=None,
+        workers=1, instrumentation=None, incremental=False, dirty_margin=8
+    ):
         """Initialize the class."""
         self.crs = crs
         self.width = width
         self.height = height
-        self.bbox = bbox
-        self.transformation = None
+        self._bbox = bbox
+        self._pending = []
+        self._transformation = None
+        self.marginx = marginx
+        self.marginy = marginy
+        self.cache = cache
+        self.workers = workers
+        self.instrumentation = instrumentation
+        self.incremental = incremental
+        self.dirty_margin = dirty_margin
+        self._background = None
         self.layers = []
-        if self.bbox is not None:
-            self._update_transformation()
 
-    def _update_transformation(self):
-        """Updates the image transformation."""
-        self.transformation = ImageTransformation(self.bbox, self.width, self.height)
+    @property
+    def bbox(self):
+        """The bounding box of the map.
+
+        The bboxes of the layers added since the last use are merged in here, so
+        adding many layers doesn't compute any layer bbox.
+        """
+        for layer in self._pending:
+            if self._bbox is None:
+                self._bbox = layer.bbox
+                continue
+            minx, miny, maxx, maxy = self._bbox
+            lminx, lminy, lmaxx, lmaxy = layer.bbox
+            self._bbox = (min(minx, lminx), min(miny, lminy),
+                          max(maxx, lmaxx), max(maxy, lmaxy))
+        self._pending = []
+        return self._bbox
+
+    @bbox.setter
+    def bbox(self, bbox):
+        self._bbox = bbox
+        self._pending = []
+        self._transformation = None
+
+    @property
+    def transformation(self):
+        """The image transformation of the map bbox, or None without a bbox."""
+        if self._transformation is None and self.bbox is not None:
+            self._transformation = ImageTransformation(
+                self.bbox, self.width, self.height, self.marginx, self.marginy
+            )
+        return self._transformation
+
+    @transformation.setter
+    def transformation(self, transformation):
+        self._transformation = transformation
 
     def add_layer(self, layer):
-        """Add a layert to the map."""
+        """Add a layert to the map.
+
+        The layer bbox is merged into the map bbox when either is next used.
+        """
         layer.set_crs(self.crs)
         self.layers.append(layer)
-        bbox = layer.bbox
-        if self.bbox is not None:
-            minx, miny, maxx, maxy = self.bbox
-            lminx, lminy, lmaxx, lmaxy = layer.bbox
-            bbox = (min(minx, lminx), min(miny, lminy),
-                    max(maxx, lmaxx), max(maxy, lmaxy))
-        self.bbox = bbox
+        self._pending.append(layer)
+        self._transformation = None
+
+    def __getstate__(self):
+        """Get the state for pickling, without the last rendered image."""
+        state = self.__dict__.copy()
+        state["_background"] = None
+        return state
+
+    def _prepare_layers(self):
+        """Set the map crs on layers that were last used in another crs."""
+        for layer in self.layers:
+            if layer.crs != self.crs:
+                layer.set_crs(self.crs)
+
+    def prepare(self):
+        """Prepare all layers to render many images with the map crs.
+
+        Layers reproject their data, build their spatial indexes and classify
+        their features once, see :meth:`BaseLayer.prepare
+        <pymapper.layer.base.BaseLayer.prepare>`, so every following render only
+        has to cull and draw.
+        """
+        self._prepare_layers()
+        for layer in self.layers:
+            layer.prepare()
+
+    def cache_key(self, transformation=None, output_format="png"):
+        """Get the content hash key of the rendered image.
+
+        The key combines the output format, the map crs, the transformation and the
+        cache key of every layer, which includes its data version or hash and
+        style.
+
+        Args:
+            transformation (ImageTransformation): The transformation to render
+                with, defaults to the map transformation.
+            output_format (str): The output format.
+
+        Returns:
+            str: Hexadecimal digest, see :func:`pymapper.cache.make_key`.
+        """
+        if transformation is None:
+            transformation = self.transformation
+        return make_key(
+            output_format,
+            CRS.from_user_input(self.crs).to_wkt(),
+            transformation.key(),
+            tuple(layer.cache_key() for layer in self.layers),
+        )
+
+    def _draw(self, transformation):
+        """Draw all layers onto a new image surface.
+
+        With more than one worker, every layer is drawn onto its own surface in a
+        thread pool, and the surfaces are composited in layer order. Compositing
+        with the OVER operator is associative, so the result matches drawing the
+        layers one after the other, up to 8 bit rounding where semi-transparent
+        layers overlap.
+        """
+        surface = cairo.ImageSurface(
+            cairo.FORMAT_ARGB32, transformation.width, transformation.height
+        )
+        context = cairo.Context(surface)
+        if self.workers <= 1 or len(self.layers) < 2:
+            for layer in self.layers:
+                self._render_layer(layer, context, transformation)
+            surface.flush()
+            return surface
+        first, *others = self.layers
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # Every task runs in a copy of the current context, so the layers see
+            # the active instrumentation.
+            futures = [
+                executor.submit(
+                    copy_context().run, self._draw_layer, layer, transformation
+                )
+                for layer in others
+            ]
+            self._render_layer(first, context, transformation)
+            for future in futures:
+                context.set_source_surface(future.result(), 0, 0)
+                context.paint()
+        surface.flush()
+        return surface
+
+    @staticmethod
+    def _render_layer(layer, context, transformation):
+        """Render a layer, reporting it as the ``render`` stage of the layer."""
+        instrumentation = get_instrumentation()
+        with instrumentation.layer(layer.name), instrumentation.stage("render"):
+            layer.render(context, transformation)
+
+    @staticmethod
+    def _draw_layer(layer, transformation):
+        """Draw a single layer onto a new image surface."""
+        surface = cairo.ImageSurface(
+            cairo.FORMAT_ARGB32, transformation.width, transformation.height
+        )
+        Map._render_layer(layer, cairo.Context(surface), transformation)
+        surface.flush()
+        return surface
+
+    def _draw_incremental(self, transformation):
+        """Redraw the changed areas of the last image, or draw a new image.
+
+        The last image is reused when it was drawn with the same crs,
+        transformation and layers, and every layer can report what changed since.
+        """
+        key = (CRS.from_user_input(self.crs).to_wkt(), transformation.key(),
+               tuple(id(layer) for layer in self.layers))
+        versions = [layer.version for layer in self.layers]
+        rects = None
+        if self._background is not None and self._background[0] == key:
+            rects = self._get_dirty_rects(transformation, self._background[1])
+        if rects is None:
+            surface = self._draw(transformation)
+        else:
+            surface = self._background[2]
+            self._redraw(surface, transformation, rects)
+        self._background = (key, versions, surface)
+        return surface
+
+    def _get_dirty_rects(self, transformation, versions):
+        """Get the pixel rectangles to redraw, or None to redraw everything."""
+        rects = []
+        for layer, version in zip(self.layers, versions):
+            bboxes = layer.get_changes(version)
+            if bboxes is None:
+                return None
+            for bbox in bboxes:
+                rect = self._get_pixel_rect(transformation, bbox)
+                if rect[0] < rect[2] and rect[1] < rect[3]:
+                    rects.append(rect)
+        if len(rects) > MAX_DIRTY_RECTS:
+            lefts, tops, rights, bottoms = zip(*rects)
+            rects = [(min(lefts), min(tops), max(rights), max(bottoms))]
+        return rects
+
+    def _get_pixel_rect(self, transformation, bbox):
+        """Get the pixel rectangle covering a bbox plus ``dirty_margin``, clipped
+        to the image."""
+        minx, miny, maxx, maxy = bbox
+        margin = self.dirty_margin
+        (left, right), (top, bottom) = transformation.to_pixels(
+            (minx, maxx), (maxy, miny)
+        )
+        left, top = math.floor(left) - margin, math.floor(top) - margin
+        right, bottom = math.ceil(right) + margin, math.ceil(bottom) + margin
+        return (max(left, 0), max(top, 0), min(right, transformation.width),
+                min(bottom, transformation.height))
+
+    def _redraw(self, surface, transformation, rects):
+        """Clear and redraw all layers within pixel rectangles of a surface.
+
+        Every rectangle is drawn with the window transformation of the rectangle
+        plus ``dirty_margin``, see :meth:`ImageTransformation.window
+        <pymapper.transformation.ImageTransformation.window>`, so layers only
+        draw the features that can touch it, and raster layers only request as
+        many pixels as the window has.
+        """
+        context = cairo.Context(surface)
+        margin = self.dirty_margin
+        for left, top, right, bottom in rects:
+            window = transformation.window(
+                left - margin, top - margin, right + margin, bottom + margin
+            )
+            context.save()
+            context.rectangle(left, top, right - left, bottom - top)
+            context.clip()
+            context.set_operator(cairo.OPERATOR_CLEAR)
+            context.paint()
+            context.set_operator(cairo.OPERATOR_OVER)
+            context.translate(left - margin, top - margin)
+            for layer in self.layers:
+                self._render_layer(layer, context, window)
+            context.restore()
+        surface.flush()
+
+    def _activate(self):
+        """Make the map instrumentation current, if the map has one."""
+        if self.instrumentation is None:
+            return nullcontext()
+        return self.instrumentation.activate()
+
+    def _get_transformation(self, transformation):
+        """Get the transformation to render with."""
+        if transformation is None:
+            transformation = self.transformation
+        if transformation is None:
+            raise ValueError("Can't render a map without a bbox.")
+        return transformation
+
+    def _encode(self, file, transformation, output_format):
+        """Draw the map and write it to a file in an output format.
+
+        PNG images are drawn on an image surface, see :meth:`_draw`. SVG and PDF
+        documents are drawn layer by layer on a vector surface that writes to the
+        file as it goes.
+        """
+        instrumentation = get_instrumentation()
+        if output_format == "png":
+            draw = self._draw_incremental if self.incremental else self._draw
+            surface = draw(transformation)
+            with instrumentation.stage("encode"):
+                surface.write_to_png(file)
+            return
+        surface = VECTOR_SURFACES[output_format](
+            file, transformation.width, transformation.height
+        )
+        context = cairo.Context(surface)
+        for layer in self.layers:
+            self._render_layer(layer, context, transformation)
+        with instrumentation.stage("encode"):
+            surface.finish()
+
+    def render(self, file, transformation=None, output_format=None):
+        """Render the map to a PNG image, or an SVG or PDF document.
+
+        The output is written to the file while it is encoded. When the map has a
+        cache, the output is looked up by :meth:`cache_key` and only rendered on a
+        cache miss.
+
+        While rendering, the map instrumentation is the current instrumentation.
+        Every layer reports its stages and counts to it, and the map reports the
+        ``encode`` stage and the ``cache_hits`` and ``cache_misses`` counts.
+
+        Args:
+            file (str or file object): The filename or writable binary file object to
+                write the image to.
+            transformation (ImageTransformation): Render with this transformation
+                instead of the map transformation, for instance to render a fixed
+                bbox without margins. The image size is taken from the
+                transformation.
+            output_format (str): "png", "svg" or "pdf". Defaults to the extension
+                of the filename, or "png".
+
+        Raises:
+            ValueError: If the map has no bbox, because there are no layers and no
+                bbox was given, or if the output format is not supported.
+        """
+        transformation = self._get_transformation(transformation)
+        output_format = get_output_format(file, output_format)
+        self._prepare_layers()
+        with self._activate():
+            if self.cache is None:
+                self._encode(file, transformation, output_format)
+                return
+            instrumentation = get_instrumentation()
+            key = self.cache_key(transformation, output_format)
+            data = self.cache.get(key)
+            if data is None:
+                instrumentation.count("cache_misses")
+                buffer = io.BytesIO()
+                self._encode(buffer, transformation, output_format)
+                data = buffer.getvalue()
+                self.cache.put(key, data)
+            else:
+                instrumentation.count("cache_hits")
+        if isinstance(file, str):
+            with open(file, "wb") as fileobj:
+                fileobj.write(data)
+        else:
+            file.write(data)
+
+    def render_array(self, transformation=None, raw=False):
+        """Render the map to a NumPy array of pixels, without encoding an image.
+
+        Args:
+            transformation (ImageTransformation): Render with this transformation
+                instead of the map transformation.
+            raw (bool): Return a view of the cairo image data instead of a copy,
+                see :func:`pymapper.output.surface_to_array`. With ``incremental``
+                the pixels are still in cairo's format but copied, because the
+                surface is redrawn in place by the next render.
+
+        Returns:
+            numpy.ndarray: (height, width, 4) uint8 array with RGBA pixels.
+
+        Raises:
+            ValueError: If the map has no bbox.
+        """
+        transformation = self._get_transformation(transformation)
+        self._prepare_layers()
+        with self._activate():
+            draw = self._draw_incremental if self.incremental else self._draw
+            surface = draw(transformation)
+        array = surface_to_array(surface, raw)
+        return array.copy() if raw and self.incremental else array
+
+    def hit_test(self, px, py, tolerance=3.0, transformation=None):
+        """Find the features under pixels of the map image.
+
+        Every layer with a ``hit_test`` method, like
+        :meth:`GeoPandasLayer.hit_test <pymapper.layer.GeoPandasLayer.hit_test>`,
+        is queried for all pixels at once.
+
+        Args:
+            px (numpy.ndarray): The x pixel coordinates.
+            py (numpy.ndarray): The y pixel coordinates.
+            tolerance (float): The distance in pixels within which a feature is
+                hit.
+            transformation (ImageTransformation): The transformation of the image,
+                instead of the map transformation.
+
+        Returns:
+            dict: For every layer with hits, from the top layer to the bottom
+            layer, the layer name and a tuple with the index of the pixel of every
+            hit and the integer position of the feature in the layer data.
+
+        Raises:
+            ValueError: If the map has no bbox.
+        """
+        transformation = self._get_transformation(transformation)
+        self._prepare_layers()
+        hits = {}
+        for layer in reversed(self.layers):
+            hit_test = getattr(layer, "hit_test", None)
+            if hit_test is None:
+                continue
+            pixels, positions = hit_test(transformation, px, py, tolerance)
+            if len(positions):
+                hits[layer.name] = (pixels, positions)
+        return hits
+
+    def render_frames(  # pylint: disable=R0913
+        self, frames, sink, time_column=None, workers=None, chunksize=1
+    ):
+        """Render a sequence of frames, for pan/zoom or time-series animations.
+
+        The map is prepared once with :meth:`prepare`, and then every frame only
+        swaps the transformation or the time range of the layers, see
+        :mod:`pymapper.frames`. The frames are spread over a pool of worker
+        processes that each receive the prepared map once.
+
+        Args:
+            frames (iterable): :class:`ImageTransformation` instances, (start, end)
+                time slices or :class:`pymapper.frames.Frame` instances.
+            sink (str or callable): A directory to write ``{index:06d}.png`` files
+                to, or a callable that is called as ``sink(index, data)`` with the
+                PNG data of every frame, in frame order.
+            time_column (str): The column of the time slices. Time slices are
+                applied to the GeoPandasLayers that have this column.
+            workers (int): The number of worker processes, defaults to the number
+                of cpus. With 1 worker the frames are rendered in this process.
+            chunksize (int): The number of frames sent to a worker at once.
+
+        Returns:
+            int: The number of rendered frames.
+        """
+        # Imported here, because the frames module imports the GeoPandasLayer.
+        from .frames import (  # pylint: disable=C0415
+            directory_sink as frames_directory_sink, render_frames
+        )
+        if not callable(sink):
+            sink = frames_directory_sink(sink)
+        self.prepare()
+        return render_frames(self, frames, sink, time_column, workers, chunksize)
+
+    def render_tiles(  # pylint: disable=R0913
+        self, zoom_range, out_dir_or_sink, tile_size=TILE_SIZE, workers=None,
+        chunksize=16
+    ):
+        """Render the XYZ tiles covering the map bbox.
+
+        Every tile is rendered with its own margin-free transformation, see
+        :func:`pymapper.tiles.tile_transformation`. The tiles are spread over a
+        pool of worker processes that each receive the map once.
+
+        Args:
+            zoom_range (iterable): The zoom levels to render, e.g. ``range(0, 8)``.
+            out_dir_or_sink (str or callable): A directory to write
+                ``{z}/{x}/{y}.png`` files to, or a callable that is called as
+                ``sink(z, x, y, data)`` with the PNG data of every tile.
+            tile_size (int): The tile width and height in pixels.
+            workers (int): The number of worker processes, defaults to the number
+                of cpus. With 1 worker the tiles are rendered in this process.
+            chunksize (int): The number of tiles sent to a worker at once.
+
+        Returns:
+            int: The number of rendered tiles.
+
+        Raises:
+            ValueError: If the map crs is not web mercator or the map has no bbox.
+        """
+        tiles = self._get_tiles(zoom_range)
+        sink = out_dir_or_sink
+        if not callable(sink):
+            sink = directory_sink(out_dir_or_sink)
+        self._prepare_layers()
+        return render_tiles(self, tiles, sink, tile_size, workers, chunksize)
+
+    def _get_tiles(self, zoom_range):
+        """Get the tiles covering the map bbox at every zoom level.
+
+        Raises:
+            ValueError: If the map crs is not web mercator or the map has no bbox.
+        """
+        if CRS.from_user_input(self.crs) != CRS.from_user_input(WEB_MERCATOR):
+            raise ValueError(f"Tiles can only be rendered in {WEB_MERCATOR}.")
+        if self.bbox is None:
+            raise ValueError("Can't render tiles for a map without a bbox.")
+        half = WORLD_SIZE / 2
+        minx, miny, maxx, maxy = self.bbox
+        bbox = (max(minx, -half), max(miny, -half), min(maxx, half), min(maxy, half))
+        return (tile for zoom in zoom_range for tile in tiles_for_bbox(bbox, zoom))
+
+    def render_vector_tiles(  # pylint: disable=R0913
+        self, zoom_range, out_dir_or_sink, extent=None, buffer=None, columns=None,
+        workers=None, chunksize=16
+    ):
+        """Encode the Mapbox Vector Tiles covering the map bbox.
+
+        Every GeoPandasLayer of the map is a layer of the tiles, see
+        :mod:`pymapper.mvt`. The map is prepared once with :meth:`prepare`, and
+        the tiles are spread over a pool of worker processes that each receive
+        the prepared map once. Tiles without features are skipped.
+
+        Args:
+            zoom_range (iterable): The zoom levels to encode, e.g. ``range(0, 15)``.
+            out_dir_or_sink (str or callable): A directory to write
+                ``{z}/{x}/{y}.mvt`` files to, or a callable that is called as
+                ``sink(z, x, y, data)`` with the data of every tile.
+            extent (int): The size of a tile in tile coordinates (default 4096).
+            buffer (int): The buffer around tiles in tile coordinates (default 64).
+            columns (list): The attribute columns to encode, defaults to all
+                columns.
+            workers (int): The number of worker processes, defaults to the number
+                of cpus. With 1 worker the tiles are encoded in this process.
+            chunksize (int): The number of tiles sent to a worker at once.
+
+        Returns:
+            int: The number of tiles with features.
 
-    def render(self, file):
-        """Render the map."""
+        Raises:
+            ValueError: If the map crs is not web mercator or the map has no bbox.
+        """
+        # Imported here, because the mvt module imports the GeoPandasLayer.
+        from .mvt import BUFFER, EXTENT, render_vector_tiles  # pylint: disable=C0415
+        tiles = self._get_tiles(zoom_range)
+        sink = out_dir_or_sink
+        if not callable(sink):
+            sink = directory_sink(out_dir_or_sink, "mvt")
+        self.prepare()
+        return render_vector_tiles(
+            self, tiles, sink, EXTENT if extent is None else extent,
+            BUFFER if buffer is None else buffer, columns, workers, chunksize
+        )
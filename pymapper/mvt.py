@@ -0,0 +1,493 @@
+"""
+Mapbox Vector Tiles of the vector layers of a map.
+
+Every :class:`pymapper.layer.GeoPandasLayer` of the map becomes a layer of the
+tile. Its features are selected like for raster tiles, culled with the spatial
+index, filtered and simplified with the cached simplified geometries, see
+:meth:`pymapper.layer.GeoPandasLayer.select_features`. They are then clipped to
+the tile bbox plus a buffer and quantized to integer tile coordinates with the
+affine transformation of an :class:`ImageTransformation` of ``extent`` by
+``extent`` pixels.
+
+The tiles are encoded following the `vector tile specification
+<https://github.com/mapbox/vector-tile-spec/tree/master/2.1>`_ without a
+protobuf library. The geometry commands and varints of all features of a layer
+are built at once with NumPy.
+"""
+import struct
+import numpy as np
+import pandas as pd
+import shapely
+from .instrumentation import get_instrumentation
+from .layer.geopandas import GeoPandasLayer
+from .render import explode_parts, orient_rings, transform_coords
+from .tiles import TILE_SIZE, WORLD_SIZE, map_batched, tile_bounds
+from .transformation import ImageTransformation
+
+
+EXTENT = 4096
+"""Default width and height of a tile in tile coordinates."""
+
+BUFFER = 64
+"""Default buffer around tiles in tile coordinates, geometries are clipped to the
+tile bbox plus the buffer."""
+
+POINT, LINESTRING, POLYGON = 1, 2, 3
+"""The geometry types of vector tile features."""
+
+MOVE_TO, LINE_TO, CLOSE_PATH = 1, 2, 7
+"""The geometry command ids."""
+
+
+def encode_varints(values):
+    """Encode unsigned integers as protobuf varints.
+
+    Args:
+        values (numpy.ndarray): The unsigned integers.
+
+    Returns:
+        tuple: The encoded bytes, and an array with the number of bytes of every
+        value.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = np.ones(len(values), dtype=np.intp)
+    for shift in range(7, 64, 7):
+        sizes += values >= np.uint64(1) << np.uint64(shift)
+    ends = np.cumsum(sizes)
+    starts = ends - sizes
+    out = np.empty(ends[-1] if len(ends) else 0, dtype=np.uint8)
+    for byte in range(int(sizes.max()) if len(sizes) else 0):
+        mask = sizes > byte
+        chunk = values[mask] >> np.uint64(7 * byte) & np.uint64(0x7F)
+        chunk |= (sizes[mask] > byte + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[mask] + byte] = chunk
+    return out.tobytes(), sizes
+
+
+def zigzag(values):
+    """ZigZag encode signed integers, so small negative numbers stay small.
+
+    Args:
+        values (numpy.ndarray): The signed integers.
+
+    Returns:
+        numpy.ndarray: The encoded unsigned integers.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def _varint(value: int) -> bytes:
+    """Encode a single unsigned integer as a varint."""
+    out = bytearray()
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _field(number: int, payload: bytes) -> bytes:
+    """Encode a length delimited field."""
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def encode_value(value) -> bytes:
+    """Encode an attribute value as a ``Value`` message.
+
+    Booleans, integers and floats keep their type, other values are encoded as
+    their string.
+
+    Args:
+        value: The attribute value.
+
+    Returns:
+        bytes: The encoded message.
+    """
+    if isinstance(value, (bool, np.bool_)):
+        return b"\x38" + _varint(int(value))
+    if isinstance(value, (int, np.integer)):
+        value = int(value)
+        return b"\x30" + _varint((value << 1) ^ (value >> 63))
+    if isinstance(value, (float, np.floating)):
+        return b"\x19" + struct.pack("<d", value)
+    return _field(1, str(value).encode())
+
+
+def quantize(coords, matrix):
+    """Transform coordinates to integer tile coordinates.
+
+    Args:
+        coords (numpy.ndarray): (n, 2) array of coordinates.
+        matrix (list): The shapely transformation matrix to tile coordinates.
+
+    Returns:
+        numpy.ndarray: (n, 2) int64 array.
+    """
+    return np.rint(transform_coords(coords, matrix, out=coords)).astype(np.int64)
+
+
+def _drop_repeated(coords, coord_part):
+    """Drop coordinates equal to the previous coordinate of the same part."""
+    keep = np.ones(len(coords), dtype=bool)
+    keep[1:] = (coords[1:] != coords[:-1]).any(axis=1)
+    keep[1:] |= coord_part[1:] != coord_part[:-1]
+    return coords[keep], coord_part[keep]
+
+
+def _feature_starts(feature):
+    """Get a mask of the first element of every feature in a sorted index."""
+    first = np.ones(len(feature), dtype=bool)
+    first[1:] = feature[1:] != feature[:-1]
+    return first
+
+
+def _deltas(coords, coord_feature):
+    """Get the offsets from the previous coordinate, starting at 0 per feature."""
+    deltas = coords.copy()
+    deltas[1:] -= coords[:-1]
+    first = _feature_starts(coord_feature)
+    deltas[first] = coords[first]
+    return zigzag(deltas)
+
+
+def encode_points(coords, coord_feature):
+    """Get the geometry commands of point features.
+
+    Every feature is a single ``MoveTo`` command with all its points.
+
+    Args:
+        coords (numpy.ndarray): (n, 2) integer tile coordinates.
+        coord_feature (numpy.ndarray): The sorted feature of every point.
+
+    Returns:
+        tuple: The command integers, their start offset per feature, with the end
+        as last offset, and the features.
+    """
+    first = _feature_starts(coord_feature)
+    features = coord_feature[first]
+    point_offsets = np.append(np.flatnonzero(first), len(coords))
+    counts = np.diff(point_offsets)
+    stream_offsets = point_offsets * 2 + np.arange(len(point_offsets))
+    stream = np.empty(stream_offsets[-1], dtype=np.uint64)
+    stream[stream_offsets[:-1]] = MOVE_TO | counts.astype(np.uint64) << np.uint64(3)
+    positions = (2 * np.arange(len(coords))
+                 + np.repeat(np.arange(len(counts)), counts) + 1)
+    deltas = _deltas(coords, coord_feature)
+    stream[positions] = deltas[:, 0]
+    stream[positions + 1] = deltas[:, 1]
+    return stream, stream_offsets, features
+
+
+def encode_paths(coords, coord_part, part_feature, close: bool):
+    """Get the geometry commands of line or polygon features.
+
+    Every part is a ``MoveTo`` to its first point and a ``LineTo`` with the other
+    points, followed by a ``ClosePath`` for rings.
+
+    Args:
+        coords (numpy.ndarray): (n, 2) integer tile coordinates, without the
+            closing point of rings.
+        coord_part (numpy.ndarray): The sorted part of every coordinate, every
+            part has at least 2 coordinates.
+        part_feature (numpy.ndarray): The sorted feature of every part.
+        close (bool): Whether the parts are rings.
+
+    Returns:
+        tuple: The command integers, their start offset per feature, with the end
+        as last offset, and the features.
+    """
+    part_offsets = np.searchsorted(coord_part, np.arange(len(part_feature) + 1))
+    counts = np.diff(part_offsets)
+    part_starts = np.concatenate([[0], np.cumsum(2 * counts + 2 + int(close))])
+    stream = np.empty(part_starts[-1], dtype=np.uint64)
+    starts = part_starts[:-1]
+    stream[starts] = MOVE_TO | 1 << 3
+    stream[starts + 3] = LINE_TO | (counts - 1).astype(np.uint64) << np.uint64(3)
+    if close:
+        stream[part_starts[1:] - 1] = CLOSE_PATH | 1 << 3
+    vertex = np.arange(len(coords)) - part_offsets[coord_part]
+    positions = starts[coord_part] + np.where(vertex == 0, 1, 2 * vertex + 2)
+    deltas = _deltas(coords, part_feature[coord_part])
+    stream[positions] = deltas[:, 0]
+    stream[positions + 1] = deltas[:, 1]
+    first = _feature_starts(part_feature)
+    stream_offsets = np.append(part_starts[:-1][first], part_starts[-1])
+    return stream, stream_offsets, part_feature[first]
+
+
+def _clean_parts(coords, coord_part, part_feature, min_count):
+    """Drop parts with less than ``min_count`` coordinates and renumber the rest."""
+    counts = np.bincount(coord_part, minlength=len(part_feature))
+    keep = counts >= min_count
+    coord_keep = keep[coord_part]
+    renumber = np.cumsum(keep) - 1
+    return coords[coord_keep], renumber[coord_part[coord_keep]], part_feature[keep]
+
+
+def _line_commands(lines, line_feature, matrix):
+    """Get the geometry commands of single part lines."""
+    coords, coord_part = shapely.get_coordinates(lines, return_index=True)
+    coords, coord_part = _drop_repeated(quantize(coords, matrix), coord_part)
+    coords, coord_part, line_feature = _clean_parts(
+        coords, coord_part, line_feature, 2
+    )
+    return encode_paths(coords, coord_part, line_feature, close=False)
+
+
+def _polygon_commands(polygons, polygon_feature, matrix):  # pylint: disable=R0914
+    """Get the geometry commands of single part polygons.
+
+    Rings that collapse to a zero area are dropped, with the holes of collapsed
+    exterior rings. Exterior rings are oriented clockwise and holes counter
+    clockwise in tile coordinates, as the specification requires.
+    """
+    rings, ring_polygon = shapely.get_rings(polygons, return_index=True)
+    coords, coord_ring = shapely.get_coordinates(rings, return_index=True)
+    coords, coord_ring = _drop_repeated(quantize(coords, matrix), coord_ring)
+    offsets = np.searchsorted(coord_ring, np.arange(len(rings) + 1))
+    is_shell = _feature_starts(ring_polygon)
+    x, y = coords[:, 0], coords[:, 1]  # pylint: disable=C0103
+    cross = np.zeros(len(coords), dtype=np.int64)
+    cross[1:] = np.cumsum(x[:-1] * y[1:] - x[1:] * y[:-1])
+    area = cross[offsets[1:] - 1] - cross[offsets[:-1]]
+    valid = (area != 0) & (np.diff(offsets) >= 4)
+    valid &= valid[np.flatnonzero(is_shell)[np.cumsum(is_shell) - 1]]
+    coords = orient_rings(coords, offsets, is_shell)
+    closing = np.zeros(len(coords), dtype=bool)
+    closing[offsets[1:] - 1] = True
+    keep = valid[coord_ring] & ~closing
+    renumber = np.cumsum(valid) - 1
+    return encode_paths(
+        coords[keep], renumber[coord_ring[keep]],
+        polygon_feature[ring_polygon[valid]], close=True
+    )
+
+
+def _point_commands(points, point_feature, matrix):
+    """Get the geometry commands of single points."""
+    return encode_points(quantize(shapely.get_coordinates(points), matrix),
+                         point_feature)
+
+
+def encode_geometries(geometries, matrix):  # pylint: disable=R0914
+    """Get the geometries of vector tile features.
+
+    Multi-part geometries become a single feature. Geometry collections become a
+    feature per geometry type.
+
+    Args:
+        geometries (numpy.ndarray): The clipped shapely geometries.
+        matrix (list): The shapely transformation matrix to tile coordinates.
+
+    Returns:
+        list: (position in ``geometries``, geometry type, encoded commands) of
+        every feature, ordered by geometry type and position.
+    """
+    parts, part_feature = explode_parts(geometries)
+    type_ids = shapely.get_type_id(parts)
+    types = np.select(
+        [type_ids == shapely.GeometryType.POINT,
+         type_ids == shapely.GeometryType.POLYGON],
+        [POINT, POLYGON], LINESTRING
+    )
+    features = []
+    for geometry_type, encode in ((POINT, _point_commands),
+                                  (LINESTRING, _line_commands),
+                                  (POLYGON, _polygon_commands)):
+        mask = types == geometry_type
+        if not mask.any():
+            continue
+        stream, stream_offsets, feature = encode(parts[mask], part_feature[mask],
+                                                 matrix)
+        data, sizes = encode_varints(stream)
+        byte_offsets = np.concatenate([[0], np.cumsum(sizes)])[stream_offsets]
+        for position, start, end in zip(feature.tolist(), byte_offsets[:-1].tolist(),
+                                        byte_offsets[1:].tolist()):
+            features.append((position, geometry_type, data[start:end]))
+    return features
+
+
+def encode_tags(data, columns):
+    """Get the keys, values and feature tags of attributes.
+
+    Missing values are left out of the tags.
+
+    Args:
+        data (pandas.DataFrame): The attributes of the features.
+        columns (list): The columns to encode.
+
+    Returns:
+        tuple: The encoded keys, the encoded ``Value`` messages and a list with the
+        packed tags of every row of ``data``.
+    """
+    keys = [_field(3, str(column).encode()) for column in columns]
+    values = []
+    tags = np.empty((len(data), 2 * len(columns)), dtype=np.int64)
+    for key, column in enumerate(columns):
+        codes, uniques = pd.factorize(data[column])
+        tags[:, 2 * key] = np.where(codes >= 0, key, -1)
+        tags[:, 2 * key + 1] = np.where(codes >= 0, codes + len(values), -1)
+        values.extend(_field(4, encode_value(value)) for value in uniques)
+    present = tags >= 0
+    encoded, sizes = encode_varints(tags[present])
+    row_sizes = np.zeros(tags.shape, dtype=np.intp)
+    row_sizes[present] = sizes
+    ends = np.cumsum(row_sizes.sum(axis=1))
+    starts = ends - row_sizes.sum(axis=1)
+    return keys, values, [encoded[start:end] for start, end in zip(
+        starts.tolist(), ends.tolist()
+    )]
+
+
+def buffered_bounds(tile, extent: int = EXTENT, buffer: int = BUFFER):
+    """Get the web mercator bounds of a tile with its buffer.
+
+    Args:
+        tile (tuple): (z, x, y) of the tile.
+        extent (int): The size of the tile in tile coordinates.
+        buffer (int): The buffer around the tile in tile coordinates.
+
+    Returns:
+        tuple: The (minx, miny, maxx, maxy) bounds of the tile and of the tile
+        with its buffer.
+    """
+    bbox = tile_bounds(*tile)
+    margin = (bbox[2] - bbox[0]) * buffer / extent
+    return bbox, (bbox[0] - margin, bbox[1] - margin, bbox[2] + margin,
+                  bbox[3] + margin)
+
+
+def encode_layer(  # pylint: disable=R0914
+    layer: GeoPandasLayer, tile, extent: int = EXTENT, buffer: int = BUFFER,
+    columns=None
+) -> bytes:
+    """Encode the features of a layer in a tile as a ``Layer`` message.
+
+    Args:
+        layer (GeoPandasLayer): The layer, in web mercator.
+        tile (tuple): (z, x, y) of the tile.
+        extent (int): The size of the tile in tile coordinates.
+        buffer (int): The buffer around the tile in tile coordinates.
+        columns (list): The attribute columns to encode, defaults to all columns.
+
+    Returns:
+        bytes: The encoded layer, or empty bytes when no feature is in the tile.
+    """
+    bbox, clip = buffered_bounds(tile, extent, buffer)
+    half = WORLD_SIZE / 2
+    # The buffer of edge tiles would wrap around the antimeridian in the source crs.
+    query = (max(clip[0], -half), max(clip[1], -half), min(clip[2], half),
+             min(clip[3], half))
+    instrumentation = get_instrumentation()
+    positions, geometries = layer.select_features(
+        query, (bbox[2] - bbox[0]) / TILE_SIZE
+    )
+    with instrumentation.stage("clip"):
+        geometries = shapely.clip_by_rect(geometries, *clip)
+    with instrumentation.stage("encode"):
+        matrix = ImageTransformation(bbox, extent, extent, 0, 0).get_shapely_matrix()
+        features = encode_geometries(geometries, matrix)
+        if not features:
+            return b""
+        if columns is None:
+            columns = [column for column in layer.data.columns
+                       if column != layer.data.geometry.name]
+        ids = positions[[feature[0] for feature in features]]
+        keys, values, tags = encode_tags(layer.data.iloc[ids], list(columns))
+        messages = [_field(1, layer.name.encode())]
+        for (_, geometry_type, geometry), feature_tags, position in zip(
+            features, tags, ids.tolist()
+        ):
+            messages.append(_field(2, b"".join((
+                b"\x08" + _varint(position), _field(2, feature_tags),
+                b"\x18" + _varint(geometry_type), _field(4, geometry)
+            ))))
+        messages += keys + values
+        messages.append(b"\x28" + _varint(extent) + b"\x78\x02")
+        instrumentation.count("features_encoded", len(features))
+        return b"".join(messages)
+
+
+def render_vector_tile(_map, tile, extent: int = EXTENT, buffer: int = BUFFER,
+                       columns=None) -> bytes:
+    """Encode a tile of the GeoPandasLayers of a map.
+
+    Args:
+        _map (Map): The map, in web mercator.
+        tile (tuple): (z, x, y) of the tile.
+        extent (int): The size of the tile in tile coordinates.
+        buffer (int): The buffer around the tile in tile coordinates.
+        columns (list): The attribute columns to encode, defaults to all columns.
+
+    Returns:
+        bytes: The encoded tile, or empty bytes when no feature is in the tile.
+    """
+    instrumentation = get_instrumentation()
+    layers = []
+    for layer in _map.layers:
+        if isinstance(layer, GeoPandasLayer):
+            with instrumentation.layer(layer.name):
+                data = encode_layer(layer, tile, extent, buffer, columns)
+            if data:
+                layers.append(_field(3, data))
+    return b"".join(layers)
+
+
+_WORKER_MAP = None
+
+
+def _init_worker(_map):
+    """Keep the map in the worker process, so it is only sent once per worker."""
+    global _WORKER_MAP  # pylint: disable=W0603
+    _WORKER_MAP = _map
+
+
+def _render_worker_tile(tile, options):
+    """Encode a tile with the map of the worker process."""
+    return tile, render_vector_tile(_WORKER_MAP, tile, *options)
+
+
+def render_vector_tiles(  # pylint: disable=R0913
+    _map, tiles, sink, extent: int = EXTENT, buffer: int = BUFFER, columns=None,
+    workers: int = None, chunksize: int = 16
+):
+    """Encode vector tiles of a map, spread over a pool of worker processes.
+
+    The map, including its prepared layers, is sent to every worker process once
+    when the worker starts. The tiles are sent to the workers in batches as they
+    are consumed, so a pyramid of millions of tiles can be a generator. Tiles
+    without features are skipped.
+
+    Args:
+        _map (Map): The map, in web mercator.
+        tiles (iterable): (z, x, y) tuples of the tiles to encode.
+        sink (callable): Called as ``sink(z, x, y, data)`` with the encoded data of
+            every tile that has features, in the parent process.
+        extent (int): The size of a tile in tile coordinates.
+        buffer (int): The buffer around tiles in tile coordinates.
+        columns (list): The attribute columns to encode, defaults to all columns.
+        workers (int): The number of worker processes, defaults to the number of
+            cpus. With 1 worker the tiles are encoded in the current process.
+        chunksize (int): The number of tiles sent to a worker at once.
+
+    Returns:
+        int: The number of tiles passed to the sink.
+    """
+    count = 0
+    options = (extent, buffer, columns)
+    if workers == 1:
+        for tile in tiles:
+            data = render_vector_tile(_map, tile, *options)
+            if data:
+                sink(*tile, data)
+                count += 1
+        return count
+    for tile, data in map_batched(
+        _render_worker_tile, tiles, options, workers=workers, chunksize=chunksize,
+        initializer=_init_worker, initargs=(_map,)
+    ):
+        if data:
+            sink(*tile, data)
+            count += 1
+    return count
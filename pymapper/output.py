@@ -0,0 +1,111 @@
+"""
+Output formats of rendered maps.
+
+Maps are rendered to PNG images from a :class:`cairo.ImageSurface`, or to SVG and
+PDF documents with a :class:`cairo.SVGSurface` or :class:`cairo.PDFSurface`. All
+formats are written to the file while they are encoded, without building the
+whole file in memory first. :func:`surface_to_array` gives the pixels of an image
+surface as a NumPy array, without encoding at all, and :func:`array_to_surface`
+turns an array of pixels into an image surface.
+"""
+import os
+import cairo
+import numpy as np
+
+
+OUTPUT_FORMATS = ("png", "svg", "pdf")
+"""The supported output formats."""
+
+VECTOR_SURFACES = {
+    "svg": cairo.SVGSurface,
+    "pdf": cairo.PDFSurface,
+}
+"""The cairo surface classes of the vector output formats."""
+
+
+def get_output_format(file, output_format: str = None) -> str:
+    """Get the output format for a file.
+
+    Args:
+        file (str or file object): The filename or file object to write to.
+        output_format (str): The output format, or None to use the extension of
+            the filename and PNG otherwise.
+
+    Returns:
+        str: One of :data:`OUTPUT_FORMATS`.
+
+    Raises:
+        ValueError: If ``output_format`` is not supported.
+    """
+    if output_format is None:
+        output_format = "png"
+        if isinstance(file, (str, os.PathLike)):
+            extension = os.path.splitext(os.fspath(file))[1].lower().lstrip(".")
+            if extension in OUTPUT_FORMATS:
+                output_format = extension
+    output_format = output_format.lower()
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Unsupported output format {output_format!r}, use one of "
+            f"{', '.join(OUTPUT_FORMATS)}."
+        )
+    return output_format
+
+
+def surface_to_array(surface, raw: bool = False) -> np.ndarray:
+    """Get the pixels of an ARGB32 image surface.
+
+    Args:
+        surface (cairo.ImageSurface): The image surface.
+        raw (bool): Return a view of the surface data instead of a copy. The view
+            has cairo's pixel format: premultiplied alpha, with the bytes in BGRA
+            order on little endian machines.
+
+    Returns:
+        numpy.ndarray: (height, width, 4) uint8 array, with RGBA pixels that are
+        not premultiplied unless ``raw`` is set.
+    """
+    surface.flush()
+    width, height, stride = (surface.get_width(), surface.get_height(),
+                             surface.get_stride())
+    data = surface.get_data()
+    if raw:
+        return np.ndarray(
+            (height, width, 4), dtype=np.uint8, buffer=data, strides=(stride, 4, 1)
+        )
+    argb = np.ndarray(
+        (height, width), dtype=np.uint32, buffer=data, strides=(stride, 4)
+    )
+    alpha = argb >> 24
+    divisor = np.maximum(alpha, 1)
+    rgba = np.empty((height, width, 4), dtype=np.uint8)
+    for channel, shift in enumerate((16, 8, 0)):
+        # Unpremultiply with rounding, like cairo does when writing PNG files.
+        rgba[..., channel] = ((argb >> shift & 0xFF) * 255 + alpha // 2) // divisor
+    rgba[..., 3] = alpha
+    return rgba
+
+
+def array_to_surface(rgba: np.ndarray):
+    """Create an ARGB32 image surface from pixels.
+
+    Args:
+        rgba (numpy.ndarray): (height, width, 4) uint8 array with RGBA pixels that
+            are not premultiplied.
+
+    Returns:
+        cairo.ImageSurface: The image surface.
+    """
+    height, width = rgba.shape[:2]
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    argb = np.ndarray(
+        (height, width), dtype=np.uint32, buffer=surface.get_data(),
+        strides=(surface.get_stride(), 4)
+    )
+    alpha = rgba[..., 3].astype(np.uint32)
+    argb[...] = alpha << 24
+    for channel, shift in enumerate((16, 8, 0)):
+        # Premultiply with rounding.
+        argb |= (rgba[..., channel] * alpha + 127) // 255 << shift
+    surface.mark_dirty()
+    return surface
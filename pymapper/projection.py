@@ -0,0 +1,68 @@
+"""
+Helpers for reprojecting geometries and bounding boxes with pyproj.
+"""
+from functools import lru_cache
+import numpy as np
+import shapely
+from pyproj.crs.crs import CRS
+from pyproj.transformer import Transformer
+
+
+@lru_cache(maxsize=64)
+def get_transformer(source: CRS, target: CRS) -> Transformer:
+    """Get a cached :class:`pyproj.transformer.Transformer` between two crs.
+
+    Transformers are created once per (source, target) pair and always use the
+    x, y (lon, lat) axis order.
+
+    Args:
+        source (pyproj.crs.crs.CRS): The crs to transform from.
+        target (pyproj.crs.crs.CRS): The crs to transform to.
+
+    Returns:
+        pyproj.transformer.Transformer: The transformer.
+    """
+    return Transformer.from_crs(source, target, always_xy=True)
+
+
+def transform_bounds(bbox, source: CRS, target: CRS, densify_pts: int = 21):
+    """Transform a bounding box to another crs.
+
+    The edges of the bounding box are densified before transforming, so the result
+    covers curved edges in the target crs.
+
+    Args:
+        bbox (tuple): (minx, miny, maxx, maxy) in the ``source`` crs.
+        source (pyproj.crs.crs.CRS): The crs of ``bbox``.
+        target (pyproj.crs.crs.CRS): The crs to transform to.
+        densify_pts (int): The number of points to add to each edge.
+
+    Returns:
+        tuple: (minx, miny, maxx, maxy) in the ``target`` crs.
+    """
+    if source == target:
+        return tuple(bbox)
+    return get_transformer(source, target).transform_bounds(
+        *bbox, densify_pts=densify_pts
+    )
+
+
+def transform_geometries(geometries, source: CRS, target: CRS):
+    """Reproject an array of shapely geometries.
+
+    All coordinates are transformed with a single call to the cached transformer.
+
+    Args:
+        geometries (numpy.ndarray): Array of shapely geometries.
+        source (pyproj.crs.crs.CRS): The crs of ``geometries``.
+        target (pyproj.crs.crs.CRS): The crs to transform to.
+
+    Returns:
+        numpy.ndarray: Array with the reprojected geometries.
+    """
+    transformer = get_transformer(source, target)
+
+    def _transform(coords):
+        return np.column_stack(transformer.transform(coords[:, 0], coords[:, 1]))
+
+    return shapely.transform(geometries, _transform)
@@ -0,0 +1,396 @@
+"""
+Vectorized drawing of shapely geometries onto a :class:`cairo.Context`.
+
+Geometries are split into points, lines and polygons, their coordinates are
+extracted into a single NumPy array per batch and transformed to pixel space in
+place, in one operation. The resulting paths are then sent to cairo batch by batch,
+so cairo only fills and strokes once for every ``batch_size`` geometries. The path
+of every part is built by mapping ``line_to`` over flat lists of x and y
+coordinates, without a Python tuple or bound method lookup per vertex.
+
+Building the paths is reported as the ``path`` stage and filling and stroking as
+the ``draw`` stage of the current instrumentation, together with the number of
+``vertices`` drawn, see :mod:`pymapper.instrumentation`.
+
+Coordinates that are already in flat arrays, like the ones of a layer snapshot,
+are drawn with :func:`draw_rings`, :func:`draw_paths` and :func:`draw_circles`.
+Images of raster layers are painted with :func:`paint_surface`.
+"""
+import math
+from collections import deque
+from contextlib import contextmanager
+import cairo
+import numpy as np
+import shapely
+from .instrumentation import get_instrumentation
+from .style import Style
+
+
+BATCH_SIZE = 10000
+"""Default number of geometries drawn with a single fill/stroke."""
+
+POINT_TYPES = (shapely.GeometryType.POINT,)
+LINE_TYPES = (shapely.GeometryType.LINESTRING, shapely.GeometryType.LINEARRING)
+POLYGON_TYPES = (shapely.GeometryType.POLYGON,)
+
+
+def explode(geometries):
+    """Split geometries into arrays of single part points, lines and polygons.
+
+    Multi-part geometries and geometry collections are exploded into their parts.
+    Missing and empty geometries are dropped.
+
+    Args:
+        geometries (numpy.ndarray): Array of shapely geometries.
+
+    Returns:
+        tuple: (points, lines, polygons) arrays of single part geometries.
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    points, lines, polygons = [], [], []
+    while len(geometries):
+        geometries = geometries[
+            ~(shapely.is_missing(geometries) | shapely.is_empty(geometries))
+        ]
+        type_ids = shapely.get_type_id(geometries)
+        points.append(geometries[np.isin(type_ids, POINT_TYPES)])
+        lines.append(geometries[np.isin(type_ids, LINE_TYPES)])
+        polygons.append(geometries[np.isin(type_ids, POLYGON_TYPES)])
+        multi = geometries[type_ids > shapely.GeometryType.POLYGON]
+        geometries = shapely.get_parts(multi)
+    return tuple(
+        np.concatenate(parts) if parts else np.empty(0, dtype=object)
+        for parts in (points, lines, polygons)
+    )
+
+
+def explode_parts(geometries):
+    """Split geometries into single part geometries.
+
+    Args:
+        geometries (numpy.ndarray): Array of shapely geometries.
+
+    Returns:
+        tuple: Array of the non-empty single part geometries, and an array with
+        the position in ``geometries`` of every part. The parts are ordered by
+        that position.
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    index = np.arange(len(geometries))
+    parts, indexes = [], []
+    while len(geometries):
+        keep = ~(shapely.is_missing(geometries) | shapely.is_empty(geometries))
+        geometries, index = geometries[keep], index[keep]
+        single = shapely.get_type_id(geometries) <= shapely.GeometryType.POLYGON
+        parts.append(geometries[single])
+        indexes.append(index[single])
+        geometries, part_index = shapely.get_parts(
+            geometries[~single], return_index=True
+        )
+        index = index[~single][part_index]
+    if not parts:
+        return np.empty(0, dtype=object), np.empty(0, dtype=np.intp)
+    index = np.concatenate(indexes)
+    order = np.argsort(index, kind="stable")
+    return np.concatenate(parts)[order], index[order]
+
+
+def transform_coords(coords, matrix, out=None):
+    """Apply an affine transformation to an array of coordinates.
+
+    Args:
+        coords (numpy.ndarray): (n, 2) array of x, y coordinates.
+        matrix (list): [a, b, d, e, xoff, yoff] as returned by
+            :meth:`pymapper.ImageTransformation.get_shapely_matrix`
+        out (numpy.ndarray): (n, 2) float array to write the result to, which may
+            be ``coords`` itself to transform in place.
+
+    Returns:
+        numpy.ndarray: (n, 2) array with the transformed coordinates.
+    """
+    a, b, d, e, xoff, yoff = matrix  # pylint: disable=C0103
+    out = np.matmul(coords, np.array([[a, d], [b, e]]), out=out)
+    out += np.array([xoff, yoff])
+    return out
+
+
+def get_offsets(index, count):
+    """Get the start offsets of each group in a sorted group index array.
+
+    Args:
+        index (numpy.ndarray): Sorted array with the group number of every element.
+        count (int): The number of groups.
+
+    Returns:
+        numpy.ndarray: Array of length ``count + 1``, where group ``i`` spans
+        ``offsets[i]:offsets[i + 1]``.
+    """
+    return np.searchsorted(index, np.arange(count + 1))
+
+
+def orient_rings(coords, offsets, is_shell):
+    """Orient rings so that shells and holes have opposite winding directions.
+
+    Drawing all polygons of a batch in a single path with the nonzero winding
+    fill rule then fills shells and leaves holes empty, even where features
+    overlap.
+
+    Args:
+        coords (numpy.ndarray): (n, 2) array of closed ring coordinates.
+        offsets (numpy.ndarray): Ring start offsets into ``coords``.
+        is_shell (numpy.ndarray): Boolean array, True for exterior rings.
+
+    Returns:
+        numpy.ndarray: The coordinates with the rings reoriented.
+    """
+    if len(coords) == 0:
+        return coords
+    x, y = coords[:, 0], coords[:, 1]  # pylint: disable=C0103
+    cross = np.zeros(len(coords))
+    cross[1:] = np.cumsum(x[:-1] * y[1:] - x[1:] * y[:-1])
+    starts, ends = offsets[:-1], offsets[1:]
+    area = cross[ends - 1] - cross[starts]
+    reverse = (area > 0) != is_shell
+    if not reverse.any():
+        return coords
+    ring = np.repeat(np.arange(len(starts)), ends - starts)
+    index = np.arange(len(coords))
+    mask = reverse[ring]
+    index[mask] = (starts + ends - 1)[ring[mask]] - index[mask]
+    return coords[index]
+
+
+def _set_color(context, color):
+    """Set a (r, g, b, a) color as the cairo source."""
+    context.set_source_rgba(*color)
+
+
+def _paint(context, style: Style, fill: bool):
+    """Fill and/or stroke the current path and start a new one."""
+    if fill and style.fill is not None:
+        _set_color(context, style.fill)
+        if style.stroke is not None and style.line_width > 0:
+            context.fill_preserve()
+        else:
+            context.fill()
+    if style.stroke is not None and style.line_width > 0:
+        _set_color(context, style.stroke)
+        context.set_line_width(style.line_width)
+        context.stroke()
+    context.new_path()
+
+
+def _append_parts(context, coords, offsets, close: bool):
+    """Append each part of a flat coordinate array as a subpath."""
+    xs, ys = coords[:, 0].tolist(), coords[:, 1].tolist()  # pylint: disable=C0103
+    move_to, line_to, close_path = (
+        context.move_to, context.line_to, context.close_path
+    )
+    # Exhausts an iterator at C speed without storing its items.
+    consume = deque(maxlen=0).extend
+    for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+        move_to(xs[start], ys[start])
+        consume(map(line_to, xs[start + 1:end], ys[start + 1:end]))
+        if close:
+            close_path()
+
+
+def draw_rings(context, coords, offsets, is_shell, style: Style):
+    """Draw polygon rings in pixel space with a single fill/stroke.
+
+    Args:
+        context (cairo.Context): The context to draw on.
+        coords (numpy.ndarray): (n, 2) array of closed ring coordinates in pixels.
+        offsets (numpy.ndarray): Ring start offsets into ``coords``, with the end
+            of the last ring at the end.
+        is_shell (numpy.ndarray): Boolean array, True for exterior rings, which
+            are followed by the holes of their polygon.
+        style (Style): The style to draw with.
+    """
+    instrumentation = get_instrumentation()
+    with instrumentation.stage("path"):
+        coords = orient_rings(coords, offsets, is_shell)
+        _append_parts(context, coords, offsets, close=True)
+    instrumentation.count("vertices", len(coords))
+    with instrumentation.stage("draw"):
+        _paint(context, style, fill=True)
+
+
+def draw_paths(context, coords, offsets, style: Style):
+    """Draw lines in pixel space with a single stroke.
+
+    Args:
+        context (cairo.Context): The context to draw on.
+        coords (numpy.ndarray): (n, 2) array of line coordinates in pixels.
+        offsets (numpy.ndarray): Line start offsets into ``coords``, with the end
+            of the last line at the end.
+        style (Style): The style to draw with.
+    """
+    instrumentation = get_instrumentation()
+    with instrumentation.stage("path"):
+        _append_parts(context, coords, offsets, close=False)
+    instrumentation.count("vertices", len(coords))
+    with instrumentation.stage("draw"):
+        _paint(context, style, fill=False)
+
+
+def draw_circles(context, coords, style: Style):
+    """Draw points in pixel space as circles with a single fill/stroke.
+
+    Args:
+        context (cairo.Context): The context to draw on.
+        coords (numpy.ndarray): (n, 2) array of point coordinates in pixels.
+        style (Style): The style to draw with.
+    """
+    instrumentation = get_instrumentation()
+    radius = style.point_radius
+    with instrumentation.stage("path"):
+        new_sub_path, arc = context.new_sub_path, context.arc
+        for x, y in zip(  # pylint: disable=C0103
+            coords[:, 0].tolist(), coords[:, 1].tolist()
+        ):
+            new_sub_path()
+            arc(x, y, radius, 0, 2 * math.pi)
+    instrumentation.count("vertices", len(coords))
+    with instrumentation.stage("draw"):
+        _paint(context, style, fill=True)
+
+
+def draw_polygons(context, polygons, matrix, style: Style, batch_size=BATCH_SIZE):
+    """Draw an array of shapely polygons.
+
+    Args:
+        context (cairo.Context): The context to draw on.
+        polygons (numpy.ndarray): Array of shapely polygons.
+        matrix (list): The shapely transformation matrix to pixel space.
+        style (Style): The style to draw with.
+        batch_size (int): The number of polygons drawn per fill/stroke.
+    """
+    instrumentation = get_instrumentation()
+    for start in range(0, len(polygons), batch_size):
+        with instrumentation.stage("path"):
+            rings, ring_index = shapely.get_rings(
+                polygons[start:start + batch_size], return_index=True
+            )
+            coords, coord_index = shapely.get_coordinates(rings, return_index=True)
+            offsets = get_offsets(coord_index, len(rings))
+            is_shell = np.ones(len(rings), dtype=bool)
+            is_shell[1:] = ring_index[1:] != ring_index[:-1]
+            transform_coords(coords, matrix, out=coords)
+        draw_rings(context, coords, offsets, is_shell, style)
+
+
+def draw_lines(context, lines, matrix, style: Style, batch_size=BATCH_SIZE):
+    """Draw an array of shapely linestrings.
+
+    Args:
+        context (cairo.Context): The context to draw on.
+        lines (numpy.ndarray): Array of shapely linestrings or linearrings.
+        matrix (list): The shapely transformation matrix to pixel space.
+        style (Style): The style to draw with.
+        batch_size (int): The number of lines drawn per stroke.
+    """
+    instrumentation = get_instrumentation()
+    for start in range(0, len(lines), batch_size):
+        with instrumentation.stage("path"):
+            batch = lines[start:start + batch_size]
+            coords, coord_index = shapely.get_coordinates(batch, return_index=True)
+            offsets = get_offsets(coord_index, len(batch))
+            transform_coords(coords, matrix, out=coords)
+        draw_paths(context, coords, offsets, style)
+
+
+def draw_points(context, points, matrix, style: Style, batch_size=BATCH_SIZE):
+    """Draw an array of shapely points as circles.
+
+    Args:
+        context (cairo.Context): The context to draw on.
+        points (numpy.ndarray): Array of shapely points.
+        matrix (list): The shapely transformation matrix to pixel space.
+        style (Style): The style to draw with.
+        batch_size (int): The number of points drawn per fill/stroke.
+    """
+    instrumentation = get_instrumentation()
+    for start in range(0, len(points), batch_size):
+        with instrumentation.stage("path"):
+            coords = shapely.get_coordinates(points[start:start + batch_size])
+            transform_coords(coords, matrix, out=coords)
+        draw_circles(context, coords, style)
+
+
+@contextmanager
+def vector_context(context):
+    """Set up a context to draw features within the context manager.
+
+    Polygons are filled with the nonzero winding rule, see :func:`orient_rings`,
+    and lines are joined with round joins. The previous state of the context is
+    restored afterwards.
+
+    Args:
+        context (cairo.Context): The context to draw on.
+    """
+    context.save()
+    try:
+        context.set_fill_rule(cairo.FILL_RULE_WINDING)
+        context.set_line_join(cairo.LINE_JOIN_ROUND)
+        yield context
+    finally:
+        context.restore()
+
+
+def render_geometries(
+    context, geometries, transformation, style: Style, batch_size=BATCH_SIZE
+):
+    """Draw an array of shapely geometries in pixel space.
+
+    Polygons are drawn first, then lines and then points.
+
+    Args:
+        context (cairo.Context): The context to draw on, with an identity matrix.
+        geometries (numpy.ndarray): Array of shapely geometries.
+        transformation (ImageTransformation): The transformation to pixel space.
+        style (Style): The style to draw with.
+        batch_size (int): The number of geometries drawn per fill/stroke.
+    """
+    points, lines, polygons = explode(geometries)
+    matrix = transformation.get_shapely_matrix()
+    with vector_context(context):
+        draw_polygons(context, polygons, matrix, style, batch_size)
+        draw_lines(context, lines, matrix, style, batch_size)
+        draw_points(context, points, matrix, style, batch_size)
+
+
+def paint_surface(context, image, bbox, transformation, alpha: float = 1.0):
+    """Paint an image surface covering a bounding box onto a context.
+
+    The edge pixels of the image are padded outwards before it is resampled and
+    the paint is clipped to the bbox, so filtering at fractional scales doesn't
+    blend in transparent pixels, which would show as seams between adjacent
+    images.
+
+    Args:
+        context (cairo.Context): The context to draw on.
+        image (cairo.ImageSurface): The image, with its first row at the top.
+        bbox (tuple): (minx, miny, maxx, maxy) covered by the image, in the crs of
+            the transformation.
+        transformation (ImageTransformation): The transformation to pixel space.
+        alpha (float): The opacity to paint with.
+    """
+    minx, miny, maxx, maxy = bbox
+    left = transformation.xx * minx + transformation.x0
+    top = transformation.yy * maxy + transformation.y0
+    context.save()
+    context.translate(left, top)
+    context.scale(
+        transformation.xx * (maxx - minx) / image.get_width(),
+        -transformation.yy * (maxy - miny) / image.get_height(),
+    )
+    context.set_source_surface(image, 0, 0)
+    context.get_source().set_extend(cairo.EXTEND_PAD)
+    context.rectangle(0, 0, image.get_width(), image.get_height())
+    context.clip()
+    if alpha < 1:
+        context.paint_with_alpha(alpha)
+    else:
+        context.paint()
+    context.restore()
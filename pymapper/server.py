@@ -0,0 +1,449 @@
+"""
+A small asyncio HTTP server for the tiles and images of a map.
+
+The server answers three kinds of GET requests:
+
+* ``/{z}/{x}/{y}.png`` for XYZ tiles of a web mercator map, see
+  :mod:`pymapper.tiles`.
+* ``/wms?REQUEST=GetMap&BBOX=...&WIDTH=...&HEIGHT=...&CRS=...&FORMAT=...``, a
+  WMS-like GetMap request for any bbox and size in the map crs.
+* ``/metrics`` with the server metrics in the Prometheus text format.
+
+Rendering happens in a pool of worker processes that each receive the map once,
+so the event loop only parses requests and writes responses. Rendered images are
+kept in an in-process LRU cache. Concurrent requests for the same image that miss
+the cache wait for a single render instead of rendering the image once per
+request. Start a server from a script with::
+
+    from pymapper.server import serve
+    serve(_map, port=8000)
+
+The workers render a copy of the map made when the server starts, so later
+changes to the map are not served. Restart the server after changing the map.
+"""
+import asyncio
+import io
+import math
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+from pyproj.crs.crs import CRS
+from .cache import LRUCache
+from .tiles import TILE_SIZE, WEB_MERCATOR, render_tile
+from .transformation import ImageTransformation
+
+
+CACHE_BYTES = 256 * 2 ** 20
+"""Default number of bytes of images to keep in the cache."""
+
+MAX_IMAGE_SIZE = 4096
+"""Default maximum width and height of GetMap images in pixels."""
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+"""Upper bounds in seconds of the request latency histogram buckets."""
+
+CONTENT_TYPES = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+    "pdf": "application/pdf",
+}
+"""The content type of every output format."""
+
+TILE_PATH = re.compile(r"^/(\d+)/(\d+)/(\d+)\.png$")
+
+
+class ServerMetrics:
+    """Counters and a request latency histogram of a :class:`TileServer`.
+
+    Attributes:
+        counts (dict): The counters by name: ``requests``, ``cache_hits``,
+            ``cache_misses``, ``renders``, ``deduplicated`` and ``errors``.
+        render_seconds (float): The total time spent waiting for renders.
+        latency_buckets (list): The number of requests per bucket of
+            :data:`LATENCY_BUCKETS`, and a last bucket for slower requests.
+        latency_sum (float): The total latency of all requests in seconds.
+    """
+
+    COUNTS = ("requests", "cache_hits", "cache_misses", "renders", "deduplicated",
+              "errors")
+
+    def __init__(self):
+        """Initialize the class."""
+        self.counts = dict.fromkeys(self.COUNTS, 0)
+        self.render_seconds = 0.0
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+
+    def count(self, name: str, value: int = 1):
+        """Add to a counter."""
+        self.counts[name] += value
+
+    def observe(self, seconds: float):
+        """Add the latency of a request to the histogram."""
+        index = 0
+        while index < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[index]:
+            index += 1
+        self.latency_buckets[index] += 1
+        self.latency_sum += seconds
+
+    def to_prometheus(self, prefix: str = "pymapper_server") -> str:
+        """Format the metrics in the Prometheus text exposition format.
+
+        Args:
+            prefix (str): The prefix of the metric names.
+
+        Returns:
+            str: ``{prefix}_{name}_total`` counters, the
+            ``{prefix}_render_seconds_total`` counter and the
+            ``{prefix}_request_seconds`` histogram.
+        """
+        lines = []
+        for name, value in self.counts.items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        lines.append(f"# TYPE {prefix}_render_seconds_total counter")
+        lines.append(f"{prefix}_render_seconds_total {self.render_seconds}")
+        lines.append(f"# TYPE {prefix}_request_seconds histogram")
+        cumulative = 0
+        for bound, value in zip(LATENCY_BUCKETS + (math.inf,), self.latency_buckets):
+            cumulative += value
+            label = "+Inf" if bound == math.inf else repr(bound)
+            lines.append(f'{prefix}_request_seconds_bucket{{le="{label}"}} '
+                         f"{cumulative}")
+        lines.append(f"{prefix}_request_seconds_sum {self.latency_sum}")
+        lines.append(f"{prefix}_request_seconds_count {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+class HTTPError(Exception):
+    """An error response.
+
+    Args:
+        status (http.HTTPStatus): The response status.
+        message (str): The response body.
+    """
+
+    def __init__(self, status: HTTPStatus, message: str = None):
+        """Initialize the class."""
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+def render_request(_map, request) -> bytes:
+    """Render the image of a request.
+
+    Args:
+        _map (Map): The map to render.
+        request (tuple): ``("tile", z, x, y, tile_size)`` or
+            ``("getmap", bbox, width, height, output_format)``.
+
+    Returns:
+        bytes: The encoded image.
+    """
+    if request[0] == "tile":
+        return render_tile(_map, request[1:4], request[4])
+    _, bbox, width, height, output_format = request
+    buffer = io.BytesIO()
+    _map.render(buffer, ImageTransformation(bbox, width, height, 0, 0),
+                output_format=output_format)
+    return buffer.getvalue()
+
+
+_WORKER_MAP = None
+
+
+def _init_worker(_map):
+    """Keep the map in the worker process, so it is only sent once per worker."""
+    global _WORKER_MAP  # pylint: disable=W0603
+    _WORKER_MAP = _map
+
+
+def _render_worker_request(request):
+    """Render a request with the map of the worker process."""
+    return render_request(_WORKER_MAP, request)
+
+
+class TileServer:  # pylint: disable=R0902
+    """Asyncio HTTP server for XYZ tiles and GetMap images of a map.
+
+    Args:
+        _map (Map): The map to serve. Tiles can only be served for web mercator
+            maps.
+        tile_size (int): The tile width and height in pixels.
+        workers (int): The number of worker processes, defaults to the number of
+            cpus. With 1 worker the images are rendered in a thread of this
+            process.
+        cache_bytes (int): The maximum number of bytes of images to cache.
+        max_image_size (int): The maximum width and height of GetMap images.
+
+    Attributes:
+        map (Map): The map to serve.
+        tile_size (int): The tile width and height in pixels.
+        workers (int): The number of worker processes.
+        cache (LRUCache): The image cache, keyed by request.
+        max_image_size (int): The maximum width and height of GetMap images.
+        metrics (ServerMetrics): The server metrics.
+        port (int): The port the server listens on, once it is started.
+    """
+
+    def __init__(  # pylint: disable=R0913
+        self, _map, tile_size: int = TILE_SIZE, workers: int = None,
+        cache_bytes: int = CACHE_BYTES, max_image_size: int = MAX_IMAGE_SIZE
+    ):
+        """Initialize the class."""
+        self.map = _map
+        self.tile_size = tile_size
+        self.workers = workers
+        self.cache = LRUCache(maxsize=1000000, maxbytes=cache_bytes)
+        self.max_image_size = max_image_size
+        self.metrics = ServerMetrics()
+        self.port = None
+        self._crs = CRS.from_user_input(_map.crs)
+        self._inflight = {}
+        self._executor = None
+        self._render = None
+        self._server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8000):
+        """Start the worker pool and listen for requests.
+
+        Args:
+            host (str): The address to listen on.
+            port (int): The port to listen on, or 0 for any free port.
+        """
+        self.map.prepare()
+        if self.workers == 1:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            self._render = partial(render_request, self.map)
+        else:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_worker,
+                initargs=(self.map,)
+            )
+            self._render = _render_worker_request
+        self._server = await asyncio.start_server(self._handle, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        """Serve requests until the server is closed."""
+        await self._server.serve_forever()
+
+    async def close(self):
+        """Stop listening and shut down the worker pool."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    async def get_image(self, request) -> bytes:
+        """Get the image of a request from the cache, or render it.
+
+        Concurrent calls for the same request that miss the cache share a single
+        render.
+
+        Args:
+            request (tuple): The request, see :func:`render_request`.
+
+        Returns:
+            bytes: The encoded image.
+        """
+        data = self.cache.get(request)
+        if data is not None:
+            self.metrics.count("cache_hits")
+            return data
+        self.metrics.count("cache_misses")
+        future = self._inflight.get(request)
+        if future is not None:
+            self.metrics.count("deduplicated")
+            return await asyncio.shield(future)
+        future = asyncio.ensure_future(self._render_once(request))
+        self._inflight[request] = future
+        return await asyncio.shield(future)
+
+    async def _render_once(self, request):
+        """Render a request in the worker pool and cache the result."""
+        start = time.perf_counter()
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._render, request
+            )
+        finally:
+            self._inflight.pop(request, None)
+            self.metrics.count("renders")
+            self.metrics.render_seconds += time.perf_counter() - start
+        self.cache.put(request, data)
+        return data
+
+    def parse_tile(self, path: str):
+        """Get the tile request of a ``/{z}/{x}/{y}.png`` path.
+
+        Returns:
+            tuple: The request, or None if the path is not a tile path.
+
+        Raises:
+            HTTPError: If the map is not in web mercator or the tile doesn't exist.
+        """
+        match = TILE_PATH.match(path)
+        if match is None:
+            return None
+        z, x, y = (int(value) for value in match.groups())  # pylint: disable=C0103
+        if self._crs != CRS.from_user_input(WEB_MERCATOR):
+            raise HTTPError(HTTPStatus.NOT_FOUND,
+                            f"Tiles can only be served for {WEB_MERCATOR} maps.")
+        if x >= 2 ** z or y >= 2 ** z:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Tile out of range.")
+        return ("tile", z, x, y, self.tile_size)
+
+    def parse_getmap(self, query: str):
+        """Get the request of the query string of a GetMap request.
+
+        Args:
+            query (str): The query string, with case insensitive parameter names.
+
+        Returns:
+            tuple: The request.
+
+        Raises:
+            HTTPError: If a parameter is missing or invalid.
+        """
+        params = {key.upper(): value for key, value in parse_qsl(query)}
+        if params.get("REQUEST", "GetMap").lower() != "getmap":
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Only GetMap is supported.")
+        try:
+            bbox = tuple(float(value) for value in params["BBOX"].split(","))
+            width, height = int(params["WIDTH"]), int(params["HEIGHT"])
+            crs = CRS.from_user_input(params.get("CRS") or params.get("SRS")
+                                      or self._crs)
+        except (KeyError, ValueError) as error:
+            raise HTTPError(HTTPStatus.BAD_REQUEST,
+                            f"Invalid GetMap parameters: {error}") from error
+        if crs != self._crs:
+            raise HTTPError(HTTPStatus.BAD_REQUEST,
+                            f"Only {self._crs.to_string()} is supported.")
+        if len(bbox) != 4 or bbox[0] >= bbox[2] or bbox[1] >= bbox[3]:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid BBOX.")
+        if not (0 < width <= self.max_image_size and 0 < height <= self.max_image_size):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid WIDTH or HEIGHT.")
+        if (params.get("VERSION", "1.3.0") >= "1.3.0" and crs.axis_info
+                and crs.axis_info[0].direction == "north"):
+            bbox = (bbox[1], bbox[0], bbox[3], bbox[2])
+        formats = {value: key for key, value in CONTENT_TYPES.items()}
+        output_format = formats.get(params.get("FORMAT", "image/png"))
+        if output_format is None:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Unsupported FORMAT.")
+        return ("getmap", bbox, width, height, output_format)
+
+    async def handle(self, method: str, target: str):
+        """Handle a request.
+
+        Args:
+            method (str): The HTTP method.
+            target (str): The request target, the path and query string.
+
+        Returns:
+            tuple: The status, content type and body of the response.
+        """
+        if method not in ("GET", "HEAD"):
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+        url = urlsplit(target)
+        if url.path == "/metrics":
+            return (HTTPStatus.OK, "text/plain; version=0.0.4",
+                    self.metrics.to_prometheus().encode())
+        request = self.parse_tile(url.path)
+        if request is None and url.path.rstrip("/") in ("/wms", ""):
+            if not url.query:
+                raise HTTPError(HTTPStatus.NOT_FOUND)
+            request = self.parse_getmap(url.query)
+        if request is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND)
+        data = await self.get_image(request)
+        output_format = request[-1] if request[0] == "getmap" else "png"
+        return HTTPStatus.OK, CONTENT_TYPES[output_format], data
+
+    async def _respond(self, method, target):
+        """Handle a request and turn errors into error responses."""
+        try:
+            return await self.handle(method, target)
+        except HTTPError as error:
+            return error.status, "text/plain", str(error).encode()
+        except Exception as error:  # pylint: disable=W0718
+            self.metrics.count("errors")
+            return (HTTPStatus.INTERNAL_SERVER_ERROR, "text/plain",
+                    f"{error.__class__.__name__}: {error}".encode())
+
+    @staticmethod
+    async def _read_headers(reader):
+        """Read the headers of a request, with lower case names."""
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                return headers
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    async def _handle(self, reader, writer):
+        """Serve the requests of a connection, keeping it alive between requests."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                start = time.perf_counter()
+                self.metrics.count("requests")
+                parts = line.decode("latin-1").split()
+                headers = await self._read_headers(reader)
+                if len(parts) == 3:
+                    method, target, version = parts
+                    status, content_type, body = await self._respond(method, target)
+                else:
+                    method, version = "GET", "HTTP/1.0"
+                    status, content_type, body = (HTTPStatus.BAD_REQUEST,
+                                                  "text/plain", b"Bad Request")
+                keep_alive = (version == "HTTP/1.1"
+                              and headers.get("connection", "").lower() != "close")
+                writer.write(
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                    "\r\n".encode("latin-1")
+                )
+                if method != "HEAD":
+                    writer.write(body)
+                await writer.drain()
+                self.metrics.observe(time.perf_counter() - start)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def serve(_map, host: str = "127.0.0.1", port: int = 8000, **kwargs):
+    """Serve the tiles and images of a map until interrupted.
+
+    Args:
+        _map (Map): The map to serve.
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+        **kwargs: Passed to :class:`TileServer`.
+    """
+    async def _serve():
+        server = TileServer(_map, **kwargs)
+        await server.start(host, port)
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+    try:
+        asyncio.run(_serve())
+    except KeyboardInterrupt:
+        pass
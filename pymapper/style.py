@@ -0,0 +1,233 @@
+"""
+Define the styles used to draw vector layers.
+
+A layer is drawn either with a single :class:`Style`, or with a style rule that
+assigns a style to every feature based on a column of the data:
+:class:`CategorizedStyle` for categorical data and :class:`ClassifiedStyle` for
+choropleth maps of numerical data. A rule returns the class of every feature as an
+integer array, so the features can be drawn grouped by style.
+"""
+from typing import Dict, List, Tuple, Union
+import numpy as np
+
+
+Color = Tuple[float, float, float, float]
+
+
+class Style:  # pylint: disable=R0903
+    """Drawing style for the features in a vector layer.
+
+    Colors are ``(red, green, blue, alpha)`` tuples with components between 0 and 1.
+
+    Args:
+        fill (tuple): The fill color for polygons and points, or None for no fill.
+        stroke (tuple): The stroke color for outlines and lines, or None for no
+            stroke.
+        line_width (float): The stroke width in pixels.
+        point_radius (float): The radius in pixels of the circle drawn for points.
+
+    Attributes:
+        fill (tuple): The fill color for polygons and points.
+        stroke (tuple): The stroke color for outlines and lines.
+        line_width (float): The stroke width in pixels.
+        point_radius (float): The radius in pixels of the circle drawn for points.
+    """
+
+    KEYS = ("fill", "stroke", "line_width", "point_radius")
+
+    def __init__(
+        self,
+        fill: Union[Color, None] = (0.6, 0.6, 0.8, 1.0),
+        stroke: Union[Color, None] = (0.2, 0.2, 0.4, 1.0),
+        line_width: float = 1.0,
+        point_radius: float = 3.0,
+    ):
+        """Initialize the class."""
+        self.fill = fill
+        self.stroke = stroke
+        self.line_width = line_width
+        self.point_radius = point_radius
+
+    def key(self):
+        """Get a hashable key identifying the style.
+
+        Returns:
+            tuple: The class name and the style values.
+        """
+        return (self.__class__.__name__,) + tuple(
+            getattr(self, key) for key in self.KEYS
+        )
+
+    def __eq__(self, other):
+        """Test equality."""
+        return all(getattr(self, key) == getattr(other, key) for key in self.KEYS)
+
+    def __hash__(self):
+        """Get the hash, consistent with equality."""
+        return hash(self.key())
+
+
+class CategorizedStyle:
+    """Style rule assigning a style to every distinct value of a column.
+
+    Args:
+        column (str): The name of the column.
+        styles (dict): The style for every value.
+        default (Style): The style for other values, or None to skip those
+            features.
+
+    Attributes:
+        column (str): The name of the column.
+        styles (dict): The style for every value.
+        default (Style): The style for other values.
+    """
+
+    def __init__(self, column: str, styles: Dict[object, Style],
+                 default: Union[Style, None] = None):
+        """Initialize the class."""
+        self.column = column
+        self.styles = dict(styles)
+        self.default = default
+
+    def key(self):
+        """Get a hashable key identifying the rule.
+
+        Returns:
+            tuple: The class name, column and the values and keys of the styles.
+        """
+        return (self.__class__.__name__, self.column,
+                tuple((value, style.key()) for value, style in self.styles.items()),
+                self.default.key() if self.default is not None else None)
+
+    def classify(self, values) -> Tuple[np.ndarray, List[Style]]:
+        """Get the class of every value.
+
+        Args:
+            values (pandas.Series): The column values.
+
+        Returns:
+            tuple: An integer array with the class of every value and the list of
+            styles per class. Values without a style get class -1 when there is no
+            default style.
+        """
+        styles = list(self.styles.values())
+        codes = values.map(
+            {value: code for code, value in enumerate(self.styles)}
+        ).to_numpy(dtype=float, na_value=np.nan)
+        missing = np.isnan(codes)
+        codes = np.where(missing, -1, codes).astype(np.intp)
+        if self.default is not None and missing.any():
+            codes[missing] = len(styles)
+            styles.append(self.default)
+        return codes, styles
+
+
+class ClassifiedStyle:
+    """Style rule assigning styles to classes of a numerical column.
+
+    The class breaks are computed with a :mod:`mapclassify` classification scheme,
+    which is installed with the ``classify`` extra, or given explicitly. A value
+    ``v`` is in class ``i`` when ``breaks[i - 1] < v <= breaks[i]``.
+
+    Args:
+        column (str): The name of the column.
+        styles (list): The style of every class, from low to high values.
+        scheme (str): The name of the mapclassify classifier, like "Quantiles",
+            "EqualInterval", "NaturalBreaks" or "FisherJenks". It is called with
+            ``k=len(styles)``.
+        breaks (list): The upper bounds of the classes, instead of a scheme.
+        default (Style): The style for missing values, or None to skip those
+            features.
+        **kwargs: Extra arguments for the classifier.
+
+    Attributes:
+        column (str): The name of the column.
+        styles (list): The style of every class.
+        scheme (str): The name of the mapclassify classifier.
+        breaks (numpy.ndarray): The upper bounds of the classes, set by
+            :meth:`classify` when they are computed with ``scheme``.
+        default (Style): The style for missing values.
+    """
+
+    def __init__(  # pylint: disable=R0913
+        self, column: str, styles: List[Style], scheme: str = "Quantiles",
+        breaks=None, default: Union[Style, None] = None, **kwargs
+    ):
+        """Initialize the class."""
+        self.column = column
+        self.styles = list(styles)
+        self.scheme = scheme if breaks is None else None
+        self.breaks = np.asarray(breaks, dtype=float) if breaks is not None else None
+        self.default = default
+        self.kwargs = kwargs
+
+    def key(self):
+        """Get a hashable key identifying the rule.
+
+        Returns:
+            tuple: The class name, column, style keys and classification settings.
+        """
+        breaks = tuple(self.breaks.tolist()) if self.scheme is None else None
+        return (self.__class__.__name__, self.column,
+                tuple(style.key() for style in self.styles), self.scheme, breaks,
+                self.default.key() if self.default is not None else None,
+                tuple(sorted(self.kwargs.items())))
+
+    def get_breaks(self, values) -> np.ndarray:
+        """Compute the class breaks with the classification scheme.
+
+        Args:
+            values (numpy.ndarray): The values without missing values.
+
+        Returns:
+            numpy.ndarray: The upper bounds of the classes.
+        """
+        import mapclassify  # pylint: disable=C0415,E0401
+        classifier = getattr(mapclassify, self.scheme)(
+            values, k=len(self.styles), **self.kwargs
+        )
+        return np.asarray(classifier.bins, dtype=float)
+
+    def classify(self, values) -> Tuple[np.ndarray, List[Style]]:
+        """Get the class of every value.
+
+        Args:
+            values (pandas.Series): The column values.
+
+        Returns:
+            tuple: An integer array with the class of every value and the list of
+            styles per class. Missing values get class -1 when there is no default
+            style.
+        """
+        values = values.to_numpy(dtype=float, na_value=np.nan)
+        missing = np.isnan(values)
+        if self.scheme is not None:
+            self.breaks = self.get_breaks(values[~missing])
+        codes = np.searchsorted(self.breaks, values, side="left")
+        codes = np.minimum(codes, len(self.styles) - 1)
+        styles = list(self.styles)
+        codes[missing] = -1
+        if self.default is not None and missing.any():
+            codes[missing] = len(styles)
+            styles.append(self.default)
+        return codes, styles
+
+
+def get_symbol_extent(style) -> float:
+    """Get how far the symbols of a style or style rule reach outside the
+    geometries they are drawn for.
+
+    Args:
+        style: A :class:`Style`, :class:`CategorizedStyle` or
+            :class:`ClassifiedStyle`.
+
+    Returns:
+        float: The largest point radius plus half the line width, in pixels.
+    """
+    if isinstance(style, Style):
+        return style.point_radius + style.line_width / 2
+    styles = style.styles
+    styles = list(styles.values() if isinstance(styles, dict) else styles)
+    if style.default is not None:
+        styles.append(style.default)
+    return max((get_symbol_extent(item) for item in styles), default=0.0)
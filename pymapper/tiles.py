@@ -0,0 +1,203 @@
+"""
+XYZ tile grid helpers and parallel tile rendering.
+
+Tiles follow the XYZ scheme used by most web maps (and the WMTS
+GoogleMapsCompatible tile matrix set): tile (0, 0) is the top left tile, and at
+zoom level ``z`` the world in web mercator (EPSG:3857) is split into ``2**z`` by
+``2**z`` tiles.
+"""
+import io
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+from .transformation import ImageTransformation
+
+
+WEB_MERCATOR = "EPSG:3857"
+"""The crs of the tile grid."""
+
+WORLD_SIZE = 2 * 20037508.342789244
+"""The width and height of the tile grid at zoom level 0 in web mercator meters."""
+
+TILE_SIZE = 256
+"""Default tile width and height in pixels."""
+
+
+def tile_bounds(z, x, y):  # pylint: disable=C0103
+    """Get the web mercator bounding box of a tile.
+
+    Args:
+        z (int): The zoom level.
+        x (int): The tile column, counted from the left.
+        y (int): The tile row, counted from the top.
+
+    Returns:
+        tuple: (minx, miny, maxx, maxy) in web mercator.
+    """
+    size = WORLD_SIZE / 2 ** z
+    minx = x * size - WORLD_SIZE / 2
+    maxy = WORLD_SIZE / 2 - y * size
+    return (minx, maxy - size, minx + size, maxy)
+
+
+def tile_transformation(z, x, y, tile_size=TILE_SIZE):  # pylint: disable=C0103
+    """Get the margin-free image transformation for a tile.
+
+    Args:
+        z (int): The zoom level.
+        x (int): The tile column.
+        y (int): The tile row.
+        tile_size (int): The tile width and height in pixels.
+
+    Returns:
+        ImageTransformation: A transformation whose bbox is exactly the tile bbox.
+    """
+    return ImageTransformation(
+        tile_bounds(z, x, y), tile_size, tile_size, marginx=0, marginy=0
+    )
+
+
+def tiles_for_bbox(bbox, zoom):  # pylint: disable=R0914
+    """Get the tiles at a zoom level that intersect a bounding box.
+
+    Args:
+        bbox (tuple): (minx, miny, maxx, maxy) in web mercator.
+        zoom (int): The zoom level.
+
+    Yields:
+        tuple: (z, x, y) for every tile intersecting ``bbox``.
+    """
+    count = 2 ** zoom
+    size = WORLD_SIZE / count
+    half = WORLD_SIZE / 2
+    minx, miny, maxx, maxy = bbox
+
+    def _clamp(value):
+        return min(max(int(value), 0), count - 1)
+
+    first_x = _clamp(math.floor((minx + half) / size))
+    last_x = _clamp(math.ceil((maxx + half) / size) - 1)
+    first_y = _clamp(math.floor((half - maxy) / size))
+    last_y = _clamp(math.ceil((half - miny) / size) - 1)
+    for x in range(first_x, last_x + 1):  # pylint: disable=C0103
+        for y in range(first_y, last_y + 1):  # pylint: disable=C0103
+            yield (zoom, x, y)
+
+
+def directory_sink(path, extension="png"):
+    """Get a sink that writes tiles to ``{path}/{z}/{x}/{y}.{extension}``.
+
+    Args:
+        path (str): The root directory of the tile tree.
+        extension (str): The file extension of the tiles.
+
+    Returns:
+        callable: ``sink(z, x, y, data)``
+    """
+    def _sink(z, x, y, data):  # pylint: disable=C0103
+        directory = os.path.join(path, str(z), str(x))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{y}.{extension}"), "wb") as file:
+            file.write(data)
+    return _sink
+
+
+_WORKER_MAP = None
+
+
+def _init_worker(_map):
+    """Keep the map in the worker process, so it is only sent once per worker."""
+    global _WORKER_MAP  # pylint: disable=W0603
+    _WORKER_MAP = _map
+
+
+def render_tile(_map, tile, tile_size=TILE_SIZE):
+    """Render a single tile of a map to PNG.
+
+    Args:
+        _map (Map): The map to render, in web mercator.
+        tile (tuple): (z, x, y) of the tile.
+        tile_size (int): The tile width and height in pixels.
+
+    Returns:
+        bytes: The PNG image.
+    """
+    buffer = io.BytesIO()
+    _map.render(buffer, transformation=tile_transformation(*tile, tile_size))
+    return buffer.getvalue()
+
+
+def _render_worker_tile(tile, tile_size):
+    """Render a tile with the map of the worker process."""
+    return tile, render_tile(_WORKER_MAP, tile, tile_size)
+
+
+def map_batched(  # pylint: disable=R0913
+    func, items, *args, workers=None, chunksize=16, initializer=None, initargs=()
+):
+    """Map a function over items in a process pool, a bounded batch at a time.
+
+    ``Executor.map`` submits all the items at once, and keeps every pending result
+    until it is consumed. Here only about four chunks per worker are in flight, so
+    ``items`` can be a generator of millions of tiles.
+
+    Args:
+        func (callable): Called as ``func(item, *args)`` in the worker processes.
+        items (iterable): The items to map over.
+        *args: Extra arguments, the same for every item.
+        workers (int): The number of worker processes, defaults to the number of
+            cpus.
+        chunksize (int): The number of items sent to a worker at once.
+        initializer (callable): Called as ``initializer(*initargs)`` when a worker
+            process starts.
+        initargs (tuple): The arguments of ``initializer``.
+
+    Yields:
+        The results of ``func``, in the order of ``items``.
+    """
+    batch_size = chunksize * (workers or os.cpu_count() or 1) * 4
+    items = iter(items)
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=initializer, initargs=initargs
+    ) as executor:
+        for batch in iter(lambda: list(islice(items, batch_size)), []):
+            yield from executor.map(
+                func, batch, *(repeat(arg) for arg in args), chunksize=chunksize
+            )
+
+
+def render_tiles(_map, tiles, sink, tile_size=TILE_SIZE, workers=None,
+                 chunksize=16):
+    """Render tiles of a map, spread over a pool of worker processes.
+
+    The map, including its layers, is sent to every worker process once when the
+    worker starts. Only the tile coordinates and the resulting images are sent per
+    tile, in batches as the tiles are consumed, see :func:`map_batched`.
+
+    Args:
+        _map (Map): The map to render, in web mercator.
+        tiles (iterable): (z, x, y) tuples of the tiles to render.
+        sink (callable): Called as ``sink(z, x, y, data)`` with the PNG data of
+            every tile, in the parent process.
+        tile_size (int): The tile width and height in pixels.
+        workers (int): The number of worker processes, defaults to the number of
+            cpus. With 1 worker the tiles are rendered in the current process.
+        chunksize (int): The number of tiles sent to a worker at once.
+
+    Returns:
+        int: The number of rendered tiles.
+    """
+    count = 0
+    if workers == 1:
+        for tile in tiles:
+            sink(*tile, render_tile(_map, tile, tile_size))
+            count += 1
+        return count
+    for tile, data in map_batched(
+        _render_worker_tile, tiles, tile_size, workers=workers, chunksize=chunksize,
+        initializer=_init_worker, initargs=(_map,)
+    ):
+        sink(*tile, data)
+        count += 1
+    return count
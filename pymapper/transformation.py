@@ -1,4 +1,6 @@
+import copy
 import cairo
+import numpy as np
 
 
 class ImageTransformation:  # pylint: disable=R0902
@@ -47,6 +49,8 @@ class ImageTransformation:  # pylint: disable=R0902
 
     """
 
+    KEYS = ("xx", "xy", "x0", "yx", "yy", "y0", "extentx", "extenty", "width", "height")
+
     def __init__(  # pylint: disable=C0103,R0913,R0914
         self, bbox, width, height, marginx=0.2, marginy=0.2
     ):
@@ -71,7 +75,7 @@ class ImageTransformation:  # pylint: disable=R0902
         scaley = height / extenty
         originx = minx - offsetx
         originy = miny - offsety
-        bbox = ((originx, originy, originx + extentx, originy + extenty),)
+        bbox = (originx, originy, originx + extentx, originy + extenty)
 
         xx = scalex
         xy = 0
@@ -92,6 +96,15 @@ class ImageTransformation:  # pylint: disable=R0902
         self.width = width
         self.height = height
 
+    def get_resolution(self):
+        """Get the size of a pixel in user coordinate space.
+
+        Returns:
+            float: The number of map units per pixel, in the direction with the
+            highest resolution.
+        """
+        return 1 / max(abs(self.xx), abs(self.yy))
+
     def get_cairo_matrix(self):
         """Get :class:`cairo.Matrix` version of this transformation.
 
@@ -107,12 +120,22 @@ class ImageTransformation:  # pylint: disable=R0902
             y0=self.y0,
         )
 
+    def key(self):
+        """Get a hashable key identifying the transformation.
+
+        Returns:
+            tuple: The values of ``xx``, ``xy``, ``x0``, ``yx``, ``yy``, ``y0``,
+            ``extentx``, ``extenty``, ``width`` and ``height``.
+        """
+        return tuple(getattr(self, key) for key in self.KEYS)
+
     def __eq__(self, other):
         """Test equality."""
-        keys = {
-            "xx", "xy", "x0", "yx", "yy", "y0", "extentx", "extenty", "width", "height"
-            }
-        return all(getattr(self, key) == getattr(other, key) for key in keys)
+        return all(getattr(self, key) == getattr(other, key) for key in self.KEYS)
+
+    def __hash__(self):
+        """Get the hash, consistent with equality."""
+        return hash(self.key())
 
     def get_shapely_matrix(self):
         """Get arguments for :func:`shapely.affinity.affine_transform`
@@ -130,3 +153,79 @@ class ImageTransformation:  # pylint: disable=R0902
             self.x0,
             self.y0,
         ]
+
+    def get_inverse_matrix(self):
+        """Get the inverse of :meth:`get_shapely_matrix`, from pixel space to user
+        coordinate space.
+
+        Returns:
+            list: [a, b, d, e, xoff, yoff] like :meth:`get_shapely_matrix`, for
+            :func:`pymapper.render.transform_coords` or
+            :func:`shapely.affinity.affine_transform`.
+        """
+        det = self.xx * self.yy - self.xy * self.yx
+        xx, xy = self.yy / det, -self.xy / det  # pylint: disable=C0103
+        yx, yy = -self.yx / det, self.xx / det  # pylint: disable=C0103
+        return [
+            xx,
+            xy,
+            yx,
+            yy,
+            -(xx * self.x0 + xy * self.y0),
+            -(yx * self.x0 + yy * self.y0),
+        ]
+
+    def to_pixels(self, xs, ys):
+        """Transform coordinates from user coordinate space to pixel space.
+
+        Args:
+            xs (numpy.ndarray): The x coordinates, or a single x coordinate.
+            ys (numpy.ndarray): The y coordinates, or a single y coordinate.
+
+        Returns:
+            tuple: Arrays with the x and y pixel coordinates, with (0, 0) at the
+            top left corner of the image.
+        """
+        xs, ys = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+        return (self.xx * xs + self.xy * ys + self.x0,
+                self.yx * xs + self.yy * ys + self.y0)
+
+    def to_world(self, px, py):  # pylint: disable=C0103
+        """Transform coordinates from pixel space to user coordinate space.
+
+        Args:
+            px (numpy.ndarray): The x pixel coordinates, or a single x coordinate.
+            py (numpy.ndarray): The y pixel coordinates, or a single y coordinate.
+
+        Returns:
+            tuple: Arrays with the x and y coordinates in user coordinate space.
+        """
+        xx, xy, yx, yy, x0, y0 = self.get_inverse_matrix()  # pylint: disable=C0103
+        px, py = np.asarray(px, dtype=float), np.asarray(py, dtype=float)
+        return xx * px + xy * py + x0, yx * px + yy * py + y0
+
+    def window(self, left: int, top: int, right: int, bottom: int):
+        """Get the transformation of a pixel rectangle of the image.
+
+        The rectangle becomes an image of its own size, with (0, 0) at its top
+        left corner, so layers request and draw only as many pixels as it has.
+
+        Args:
+            left (int): The left pixel column of the rectangle.
+            top (int): The top pixel row of the rectangle.
+            right (int): The pixel column right of the rectangle.
+            bottom (int): The pixel row below the rectangle.
+
+        Returns:
+            ImageTransformation: The transformation to the pixels of the rectangle.
+        """
+        window = copy.copy(self)
+        xs, ys = self.to_world((left, right), (bottom, top))
+        window.bbox = (float(xs[0]), float(ys[0]), float(xs[1]), float(ys[1]))
+        window.x0 = self.x0 - left
+        window.y0 = self.y0 - top
+        window.width = right - left
+        window.height = bottom - top
+        window.extentx = window.bbox[2] - window.bbox[0]
+        window.extenty = window.bbox[3] - window.bbox[1]
+        return window
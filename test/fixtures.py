@@ -1,3 +1,9 @@
+import struct
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pytest
 from pytest import fixture
 from geopandas import GeoDataFrame, GeoSeries
 
@@ -69,3 +75,83 @@ def transformation_port():  # pylint: disable=R0914
     x0 = -(minx-(maxx-minx)*marginx) * scalex  # pylint: disable=C0103
     matrix = (width/extentx, 0, x0, 0, -height/extenty, y0)
     return (matrix, extentx, extenty, bbox, width, height, marginx, marginy)
+
+
+@fixture(params=["gpkg", "shp", "parquet"])
+def gpfile(request, gpdata, tmp_path):  # pylint: disable=W0621
+    """Write the test data to a GeoPackage, shapefile or GeoParquet file."""
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / f"data.{request.param}")
+    if request.param == "parquet":
+        gpdata.to_parquet(path)
+    else:
+        gpdata.to_file(path)
+    return path
+
+
+def make_png(width, height, rgba=(255, 0, 0, 255)):
+    """Encode a PNG image of a single color."""
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(
+            ">I", zlib.crc32(body) & 0xFFFFFFFF)
+    row = b"\x00" + bytes(rgba) * width
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(row * height))
+            + chunk(b"IEND", b""))
+
+
+@fixture
+def tile_server():
+    """Local HTTP server answering every GET request with a 256x256 PNG image.
+
+    Returns:
+        tuple: (base url, list of requested paths)
+    """
+    paths = []
+    image = make_png(256, 256)
+
+    class Handler(BaseHTTPRequestHandler):
+        """Serve the image."""
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):  # pylint: disable=C0103
+            """Answer a GET request."""
+            paths.append(self.path)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(image)))
+            self.end_headers()
+            self.wfile.write(image)
+
+        def log_message(self, *args):  # pylint: disable=W0221
+            """Don't log requests."""
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", paths
+    server.shutdown()
+    server.server_close()
+
+
+@fixture
+def geotiff(tmp_path):
+    """Write a 256x256 single band EPSG:4326 GeoTIFF with two overviews.
+
+    The value of every pixel is its column, the bbox is (0, 0, 10, 10).
+    """
+    rasterio = pytest.importorskip("rasterio")
+    from rasterio.enums import Resampling  # pylint: disable=C0415,E0401
+    from rasterio.transform import from_bounds  # pylint: disable=C0415,E0401
+    path = str(tmp_path / "data.tif")
+    data = np.tile(np.arange(256, dtype=np.float32), (256, 1))
+    with rasterio.open(
+        path, "w", driver="GTiff", width=256, height=256, count=1,
+        dtype="float32", crs="EPSG:4326", nodata=-1,
+        transform=from_bounds(0, 0, 10, 10, 256, 256),
+    ) as dataset:
+        dataset.write(data, 1)
+        dataset.build_overviews([2, 4], Resampling.average)
+    return path
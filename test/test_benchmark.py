@@ -0,0 +1,31 @@
+import json
+from pymapper import benchmark
+
+
+def test_make_data():
+    """Test generating synthetic data."""
+    for geometry_type in benchmark.GEOMETRY_TYPES:
+        data = benchmark.make_data(geometry_type, 10)
+        assert len(data) == 10
+        assert data.is_valid.all()
+
+
+def test_run_and_compare():
+    """Test running the benchmarks and comparing results."""
+    results = benchmark.run(sizes=[10], repeat=2)
+    assert len(results["results"]) == len(benchmark.BENCHMARKS) * 3
+    result = results["results"][0]
+    assert len(result["times"]) == 2
+    assert result["min"] <= result["median"]
+    rows = benchmark.compare(results, results)
+    assert len(rows) == len(results["results"])
+    assert all(row[-1] == 1 for row in rows)
+
+
+def test_main_writes_json(tmp_path):
+    """Test writing the results to a JSON file."""
+    path = tmp_path / "results.json"
+    benchmark.main(["--sizes", "10", "--geometry-types", "points",
+                    "--benchmarks", "matrix", "--output", str(path)])
+    results = json.loads(path.read_text())
+    assert [result["name"] for result in results["results"]] == ["matrix"]
@@ -0,0 +1,71 @@
+import pickle
+from pymapper.cache import LRUCache, RenderCache, make_key
+
+
+def test_lru_eviction():
+    """Test that the least recently used item is evicted."""
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_hits_and_misses():
+    """Test counting cache hits and misses."""
+    cache = LRUCache()
+    assert cache.get("a") is None
+    cache.put("a", 1)
+    cache.get("a")
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_pickle():
+    """Test that a cache can be pickled, e.g. to send it to worker processes."""
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    copy = pickle.loads(pickle.dumps(cache))
+    assert copy.get("a") == 1
+    copy.put("b", 2)
+    assert len(copy) == 2
+
+
+def test_maxbytes_eviction():
+    """Test evicting items beyond the maximum total size."""
+    evicted = []
+    cache = LRUCache(maxbytes=10, on_evict=lambda key, value: evicted.append(key))
+    cache.put("a", b"12345")
+    cache.put("b", b"12345")
+    cache.put("c", b"123")
+    assert evicted == ["a"]
+    assert cache.currbytes == 8
+
+
+def test_make_key():
+    """Test that keys are stable and distinguish different parts."""
+    assert make_key(1, ("a", 2.5)) == make_key(1, ("a", 2.5))
+    assert make_key(1, ("a", 2.5)) != make_key(1, ("a", 2.6))
+
+
+def test_render_cache_spills_to_disk(tmp_path):
+    """Test that images evicted from memory are read back from disk."""
+    cache = RenderCache(maxbytes=4, directory=str(tmp_path))
+    cache.put("aa", b"1234")
+    cache.put("bb", b"5678")
+    assert "aa" not in cache.memory
+    assert cache.get("aa") == b"1234"
+    assert cache.disk_hits == 1
+    assert cache.get("cc") is None
+
+
+def test_render_cache_without_directory():
+    """Test that evicted images are dropped without a disk store."""
+    cache = RenderCache(maxbytes=4)
+    cache.put("aa", b"1234")
+    cache.put("bb", b"5678")
+    assert cache.get("aa") is None
+    assert cache.get("bb") == b"5678"
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+import shapely
+from pytest import approx
+from pyproj.crs.crs import CRS
+from pymapper import ImageTransformation
+from pymapper.layer import FileLayer
+from pymapper.layer import file as file_module
+from pymapper.projection import transform_bounds
+
+
+def test_create_file_layer(gpfile, gpdata):
+    """Test that crs and bbox are read from the file metadata."""
+    lyr = FileLayer(name="test", path=gpfile)
+    assert lyr.crs == gpdata.crs
+    assert lyr.bbox == approx(tuple(gpdata.total_bounds))
+
+
+def test_iter_chunks(gpfile):
+    """Test reading the file in chunks, filtered by bbox."""
+    lyr = FileLayer(name="test", path=gpfile, chunk_size=2)
+    assert [len(chunk) for chunk in lyr.iter_chunks()] == [2, 2, 1]
+    chunks = list(lyr.iter_chunks((-120, 20, 0, 70)))
+    assert sum(len(chunk) for chunk in chunks) == 3
+    assert all(len(chunk) <= 2 for chunk in chunks)
+
+
+def test_parquet_3d_bbox(gpdata, tmp_path, monkeypatch):
+    """Test reading the 2D extent from a 3D GeoParquet bbox."""
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "data.parquet")
+    gpdata.to_parquet(path)
+    metadata = {"primary_column": "geometry", "columns": {"geometry": {
+        "bbox": [-10, -20, 0, 30, 40, 5]
+    }}}
+    monkeypatch.setattr(FileLayer, "_read_geo_metadata",
+                        lambda self: (None, metadata))
+    assert FileLayer(name="test", path=path).bbox == (-10, -20, 30, 40)
+
+
+def test_parquet_null_crs(gpdata, tmp_path, monkeypatch):
+    """Test that a null GeoParquet crs is an undefined crs."""
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "data.parquet")
+    gpdata.to_parquet(path)
+    metadata = {"primary_column": "geometry", "columns": {"geometry": {
+        "crs": None, "bbox": [0, 0, 1, 1]
+    }}}
+    monkeypatch.setattr(FileLayer, "_read_geo_metadata",
+                        lambda self: (None, metadata))
+    assert FileLayer(name="test", path=path).crs is None
+
+
+def test_parquet_covering_bbox(gpdata, tmp_path, monkeypatch):
+    """Test that only the rows in the bbox are decoded with a bbox covering
+    column."""
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "data.parquet")
+    gpdata.to_parquet(path, write_covering_bbox=True, row_group_size=1)
+    decoded = []
+    from_wkb = shapely.from_wkb
+    monkeypatch.setattr(
+        shapely, "from_wkb", lambda wkb: decoded.append(len(wkb)) or from_wkb(wkb)
+    )
+    lyr = FileLayer(name="test", path=path)
+    chunks = list(lyr.iter_chunks((-120, 20, 0, 70)))
+    assert sum(len(chunk) for chunk in chunks) == 3
+    assert sum(decoded) == 3
+
+
+def test_set_crs(gpfile, gpdata):
+    """Test that set_crs transforms the bbox."""
+    lyr = FileLayer(name="test", path=gpfile)
+    crs = CRS.from_epsg(3857)
+    lyr.set_crs(crs)
+    expected = transform_bounds(tuple(gpdata.total_bounds), gpdata.crs, crs)
+    assert lyr.bbox == approx(expected)
+
+
+def test_render_per_chunk(gpfile, monkeypatch):
+    """Test that every chunk in the viewport is reprojected and drawn."""
+    drawn = []
+    monkeypatch.setattr(
+        file_module, "render_geometries",
+        lambda context, geometries, *args: drawn.append(geometries)
+    )
+    lyr = FileLayer(name="test", path=gpfile, chunk_size=2)
+    lyr.set_crs(CRS.from_epsg(3857))
+    bbox = transform_bounds((-120, 20, 0, 70), CRS.from_epsg(4326), lyr.crs)
+    lyr.render(None, ImageTransformation(bbox, 100, 100, 0, 0))
+    geometries = np.concatenate(drawn)
+    assert len(geometries) == 3
+    assert all(abs(geom.x) > 180 for geom in geometries)
@@ -0,0 +1,77 @@
+import pandas as pd
+import pytest
+from pymapper import Map, GeoPandasLayer, ImageTransformation
+from pymapper.frames import Frame, as_frame
+
+
+def test_as_frame():
+    """Test converting transformations and time slices to frames."""
+    trans = ImageTransformation((0, 0, 10, 10), 100, 100)
+    assert as_frame(trans).transformation is trans
+    assert as_frame((1, 2)).time == (1, 2)
+    frame = Frame(trans, (1, 2))
+    assert as_frame(frame) is frame
+
+
+def test_set_time_range(gpdata, monkeypatch):
+    """Test that only the features in the time range are drawn."""
+    data = gpdata.assign(time=pd.to_datetime(
+        ["2022-01-03", "2022-01-01", "2022-01-02", "2022-01-05", "2022-01-04"]
+    ))
+    lyr = GeoPandasLayer(name="test", data=data)
+    drawn = []
+    monkeypatch.setattr(
+        "pymapper.layer.geopandas.render_geometries",
+        lambda context, geometries, *args: drawn.append(len(geometries)),
+    )
+    trans = ImageTransformation(lyr.bbox, 200, 100)
+    lyr.set_time_range("time", "2022-01-02", "2022-01-04")
+    lyr.render(None, trans)
+    lyr.set_time_range("time", pd.Timestamp("2022-01-04"))
+    lyr.render(None, trans)
+    lyr.set_time_range(None)
+    lyr.render(None, trans)
+    assert drawn == [2, 2, 5]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_render_frames(gpdata, workers):
+    """Test rendering transformations and time slices as frames, in order."""
+    data = gpdata.assign(time=[1, 2, 3, 4, 5])
+    _map = Map(200, 100, crs=gpdata.crs)
+    _map.add_layer(GeoPandasLayer(name="test", data=data))
+    frames = [ImageTransformation(_map.bbox, 100, 50), (1, 3), Frame(time=(3, 6))]
+    images = []
+    count = _map.render_frames(
+        frames, lambda index, data: images.append((index, data)),
+        time_column="time", workers=workers,
+    )
+    assert count == 3
+    assert [index for index, _ in images] == [0, 1, 2]
+    assert all(data[:4] == b"\x89PNG" for _, data in images)
+    assert _map.layers[0].time_range is None
+
+
+def test_render_frames_clears_time(gpdata, monkeypatch):
+    """Test that a frame without a time slice draws all features again."""
+    data = gpdata.assign(time=[1, 2, 3, 4, 5])
+    _map = Map(200, 100, crs=gpdata.crs)
+    _map.add_layer(GeoPandasLayer(name="test", data=data))
+    drawn = []
+    monkeypatch.setattr(
+        "pymapper.layer.geopandas.render_geometries",
+        lambda context, geometries, *args: drawn.append(len(geometries)),
+    )
+    _map.render_frames([(1, 2), _map.transformation], lambda index, data: None,
+                       time_column="time", workers=1)
+    assert drawn == [1, 5]
+
+
+def test_render_frames_to_directory(gpdata, tmp_path):
+    """Test writing numbered frames to a directory."""
+    _map = Map(200, 100, crs=gpdata.crs)
+    _map.add_layer(GeoPandasLayer(name="test", data=gpdata))
+    _map.render_frames([_map.transformation] * 2, str(tmp_path), workers=1)
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "000000.png", "000001.png"
+    ]
@@ -1,7 +1,19 @@
+import numpy as np
+import shapely
+from cairo import ImageSurface, Context, FORMAT_ARGB32
+from geopandas import GeoDataFrame, GeoSeries
 from pyproj.crs.crs import CRS
 from pyproj.transformer import Transformer
+from pytest import approx
+from shapely.geometry import LineString, Point, box
 from shapely.ops import transform
+from pymapper import ImageTransformation
 from pymapper.layer import GeoPandasLayer
+from pymapper.label import LabelStyle
+from pymapper.layer.geopandas import get_zoom_band
+from pymapper.projection import transform_bounds
+from pymapper.render import transform_coords
+from pymapper.style import Style, ClassifiedStyle
 
 
 def test_create_geopandas_layer(gpdata):
@@ -23,9 +35,304 @@ def test_set_crs(gpdata):
         new_crs = CRS.from_epsg(4326)
     transformer: Transformer = Transformer.from_crs(old_crs, new_crs)
     lyr.set_crs(new_crs)
-    new_geom = lyr.data.iloc[0].geometry
+    new_geom = lyr.get_geometries()[0]
     assert (
         transform(lambda x, y: transformer.transform(y, x), old_geom).wkt
         == new_geom.wkt
     )
-    assert all(lyr.bbox[i] == val for i, val in enumerate(lyr.data.total_bounds))
+    expected = GeoSeries(lyr.get_geometries()).total_bounds
+    assert lyr.bbox == approx(tuple(expected))
+
+
+def test_set_crs_keeps_data(gpdata):
+    """Test that reprojecting the layer doesn't modify the data."""
+    wkt = gpdata.geometry.to_wkt().tolist()
+    lyr = GeoPandasLayer(name="test", data=gpdata)
+    lyr.set_crs(CRS.from_epsg(3857))
+    assert lyr.data is gpdata
+    assert lyr.data.crs == CRS.from_epsg(4326)
+    assert gpdata.geometry.to_wkt().tolist() == wkt
+
+
+def test_reproject_visible_only(gpdata):
+    """Test that only the queried features are reprojected."""
+    lyr = GeoPandasLayer(name="test", data=gpdata)
+    lyr.set_crs(CRS.from_epsg(3857))
+    bbox = transform_bounds((30, -10, 40, 0), gpdata.crs, lyr.crs)
+    positions = lyr.query_bbox(bbox)
+    assert positions.tolist() == [1]
+    lyr.get_geometries(positions)
+    assert lyr._projection.done.tolist() == [  # pylint: disable=W0212
+        False, True, False, False, False]
+
+
+def test_projection_cache(gpdata):
+    """Test that reprojected geometries are cached per crs, with eviction."""
+    lyr = GeoPandasLayer(name="test", data=gpdata, projection_cache_size=1)
+    lyr.set_crs(CRS.from_epsg(3857))
+    first = lyr.get_geometries()
+    lyr.set_crs(CRS.from_epsg(4326))
+    lyr.set_crs(CRS.from_epsg(3857))
+    assert lyr.get_geometries()[0] is first[0]
+    lyr.set_crs(CRS.from_epsg(32631))
+    lyr.set_crs(CRS.from_epsg(3857))
+    assert lyr.get_geometries()[0] is not first[0]
+
+
+def test_render(gpdata):
+    """Test rendering the layer draws the points."""
+    lyr = GeoPandasLayer(name="test", data=gpdata, style=Style(stroke=None))
+    trans = ImageTransformation(lyr.bbox, 200, 100)
+    surface = ImageSurface(FORMAT_ARGB32, 200, 100)
+    lyr.render(Context(surface), trans)
+    surface.flush()
+    data = np.ndarray((100, 200, 4), dtype=np.uint8, buffer=surface.get_data())
+    x, y = transform_coords(  # pylint: disable=C0103
+        np.array([[163.85316, -17.31631]]), trans.get_shapely_matrix())[0]
+    assert data[int(y), int(x), 3] > 0
+
+
+def test_render_symbol_extent(monkeypatch):
+    """Test that features just outside the image whose symbols reach into it are
+    drawn."""
+    data = GeoDataFrame(geometry=GeoSeries.from_wkt([
+        "POINT (10.2 5)", "POINT (10.6 5)", "LINESTRING (-0.1 0, -0.1 10)"
+    ]).values, crs="epsg:4326")
+    drawn = []
+    monkeypatch.setattr(
+        "pymapper.layer.geopandas.render_geometries",
+        lambda context, geometries, *args: drawn.append(len(geometries)),
+    )
+    lyr = GeoPandasLayer(name="test", data=data, style=Style(point_radius=4.5))
+    # One pixel is 0.1 map units, the point radius plus half the line width is
+    # 5 pixels.
+    lyr.render(None, ImageTransformation((0, 0, 10, 10), 100, 100, 0, 0))
+    assert drawn == [2]
+
+
+def test_query_bbox(gpdata):
+    """Test querying the features within a bbox."""
+    lyr = GeoPandasLayer(name="test", data=gpdata)
+    assert lyr.query_bbox(lyr.bbox).tolist() == [0, 1, 2, 3, 4]
+    assert lyr.query_bbox((30, -10, 40, 0)).tolist() == [1]
+    assert lyr.query_bbox((0, 80, 10, 90)).tolist() == []
+
+
+def test_data_hash(gpdata):
+    """Test that the data hash changes with the data."""
+    lyr = GeoPandasLayer(name="test", data=gpdata)
+    first = lyr.get_data_hash()
+    assert GeoPandasLayer(name="other", data=gpdata.copy()).get_data_hash() == first
+    lyr.data = gpdata.iloc[:3]
+    assert lyr.version == 1
+    assert lyr.get_data_hash() != first
+    assert lyr.bbox == approx(tuple(gpdata.iloc[:3].total_bounds))
+
+
+def test_data_hash_drawn_columns(gpdata):
+    """Test that the data hash covers the style, label and priority columns."""
+    style = ClassifiedStyle("a", [Style(), Style(fill=(1, 0, 0, 1))], breaks=[2, 5])
+    lyr = GeoPandasLayer(name="test", data=gpdata.copy(), style=style)
+    first = lyr.cache_key()
+    lyr.data["b"] = ["x"] * 5
+    lyr.invalidate()
+    assert lyr.cache_key() == first
+    lyr.data["a"] = [5, 4, 3, 2, 1]
+    lyr.invalidate()
+    second = lyr.cache_key()
+    assert second != first
+    lyr.labels = LabelStyle("b", priority="a")
+    third = lyr.cache_key()
+    lyr.data["b"] = ["y"] * 5
+    lyr.invalidate()
+    assert lyr.cache_key() != third
+
+
+def test_cache_key_includes_style(gpdata):
+    """Test that the cache key changes with the style."""
+    lyr = GeoPandasLayer(name="test", data=gpdata)
+    key = lyr.cache_key()
+    lyr.style = Style(fill=(1, 0, 0, 1))
+    assert lyr.cache_key() != key
+
+
+def test_zoom_band():
+    """Test that zoom bands are powers of two."""
+    assert get_zoom_band(1) == 0
+    assert get_zoom_band(3.9) == 1
+    assert get_zoom_band(0.3) == -2
+
+
+def test_get_simplified():
+    """Test simplifying geometries per zoom band, with caching."""
+    line = LineString([(0, 0), (5, 0.01), (10, 0), (10, 10)])
+    lyr = GeoPandasLayer(
+        name="test", data=GeoDataFrame(geometry=[line], crs="epsg:3857")
+    )
+    positions = np.array([0])
+    detailed = lyr.get_simplified(positions, 0.001)[0]
+    simple = lyr.get_simplified(positions, 1)[0]
+    assert len(detailed.coords) == 4
+    assert len(simple.coords) == 3
+    assert lyr.get_simplified(positions, 1.5)[0] is simple
+
+
+def test_filter_small():
+    """Test dropping lines and polygons smaller than a pixel, but not points."""
+    data = GeoDataFrame(geometry=[
+        box(0, 0, 0.5, 0.5), box(0, 0, 5, 0.5), Point(0, 0),
+        LineString([(0, 0), (0.1, 0.1)])
+    ], crs="epsg:3857")
+    lyr = GeoPandasLayer(name="test", data=data)
+    positions = np.arange(4)
+    actual = lyr.filter_small(positions, lyr.get_geometries(positions), 1)
+    assert actual.tolist() == [1, 2]
+
+
+def test_render_classified(gpdata, monkeypatch):
+    """Test that features are drawn grouped by class with cached classes."""
+    calls = []
+    monkeypatch.setattr(
+        "pymapper.layer.geopandas.render_geometries",
+        lambda context, geometries, transformation, style: calls.append(
+            (len(geometries), style)
+        ),
+    )
+    red, green = Style(fill=(1, 0, 0, 1)), Style(fill=(0, 1, 0, 1))
+    lyr = GeoPandasLayer(
+        name="test", data=gpdata,
+        style=ClassifiedStyle("a", [red, green], breaks=[2, 4]),
+    )
+    classify = lyr.style.classify
+    counts = []
+    monkeypatch.setattr(
+        lyr.style, "classify", lambda values: counts.append(1) or classify(values)
+    )
+    trans = ImageTransformation(lyr.bbox, 200, 100)
+    lyr.render(None, trans)
+    lyr.render(None, trans)
+    assert calls == [(2, red), (3, green)] * 2
+    assert len(counts) == 1
+    lyr.data = gpdata.iloc[:3]
+    lyr.render(None, trans)
+    assert calls[-1] == (1, green)
+    assert len(counts) == 2
+
+
+def test_update(gpdata):
+    """Test that updating rows reprojects them again and records the change."""
+    lyr = GeoPandasLayer(name="test", data=gpdata.copy())
+    lyr.set_crs(CRS.from_epsg(3857))
+    lyr.get_geometries()
+    version = lyr.version
+    rows = GeoDataFrame(
+        {"a": [10]}, geometry=GeoSeries.from_wkt(["POINT (10 10)"]).values, index=[1],
+        crs=gpdata.crs,
+    )
+    lyr.update(rows)
+    assert lyr.data["a"].tolist() == [1, 10, 3, 4, 5]
+    expected = transform_bounds((10, 10, 10, 10), gpdata.crs, lyr.crs)
+    assert lyr.get_geometries()[1].bounds == approx(expected)
+    changes = lyr.get_changes(version)
+    assert len(changes) == 2
+    assert changes[1] == approx(expected)
+    assert not lyr.get_changes(lyr.version)
+    lyr.invalidate()
+    assert lyr.get_changes(version) is None
+
+
+def test_bbox_lazy(gpdata):
+    """Test that the bbox is only computed when it is used, once per crs."""
+    lyr = GeoPandasLayer(name="test", data=gpdata)
+    lyr.set_crs(CRS.from_epsg(3857))
+    lyr.set_crs(gpdata.crs)
+    assert lyr._bounds is None  # pylint: disable=W0212
+    assert lyr.bbox == approx(tuple(gpdata.total_bounds))
+    bounds = lyr.get_bounds()
+    lyr.set_crs(CRS.from_epsg(3857))
+    expected = transform_bounds(tuple(gpdata.total_bounds), gpdata.crs, lyr.crs)
+    assert lyr.bbox == approx(expected)
+    assert lyr.get_bounds() is bounds
+    lyr.invalidate()
+    assert lyr._bounds is None  # pylint: disable=W0212
+
+
+def test_update_keeps_classes(gpdata):
+    """Test that updates only classify again when the style column changed."""
+    style = ClassifiedStyle("a", [Style(), Style(fill=(1, 0, 0, 1))], breaks=[2, 5])
+    lyr = GeoPandasLayer(name="test", data=gpdata.copy(), style=style)
+    classes = lyr.get_classes()
+    lyr.update(GeoDataFrame(
+        geometry=GeoSeries.from_wkt(["POINT (10 10)"]).values, index=[1],
+        crs=gpdata.crs,
+    ))
+    assert lyr.get_classes() is classes
+    lyr.update(GeoDataFrame({"a": [5]}, geometry=GeoSeries.from_wkt(
+        ["POINT (10 10)"]
+    ).values, index=[0], crs=gpdata.crs))
+    assert lyr.get_classes()[0].tolist() == [1, 0, 1, 1, 1]
+
+
+def test_update_bbox(gpdata):
+    """Test that updates keep the bbox up to date without computing all bounds."""
+    lyr = GeoPandasLayer(name="test", data=gpdata.copy())
+    assert lyr.bbox == approx(tuple(gpdata.total_bounds))
+    bounds = lyr.get_bounds()
+    lyr.update(GeoDataFrame(
+        geometry=GeoSeries.from_wkt(["POINT (10 10)"]).values, index=[1],
+        crs=gpdata.crs,
+    ))
+    assert lyr.bbox == approx(tuple(gpdata.total_bounds))
+    lyr.update(GeoDataFrame(
+        geometry=GeoSeries.from_wkt(["POINT (170 70)"]).values, index=[1],
+        crs=gpdata.crs,
+    ))
+    assert lyr.bbox == approx((-112.59944, -17.31631, 170, 70))
+    assert lyr.get_bounds() is bounds
+    assert bounds[1].tolist() == [170, 70, 170, 70]
+    # Moving a feature on the edge inwards shrinks the bbox.
+    lyr.update(GeoDataFrame(
+        geometry=GeoSeries.from_wkt(["POINT (0 0)"]).values, index=[0],
+        crs=gpdata.crs,
+    ))
+    assert lyr.bbox == approx(tuple(lyr.data.total_bounds))
+    assert lyr.bbox == approx((-112.59944, 0, 170, 70))
+
+
+def test_hit_test(gpdata):
+    """Test finding the features under pixels."""
+    lyr = GeoPandasLayer(name="test", data=gpdata)
+    trans = ImageTransformation(lyr.bbox, 200, 100)
+    px, py = trans.to_pixels(gpdata.geometry.x.values, gpdata.geometry.y.values)
+    pixels, positions = lyr.hit_test(trans, px[[1, 3]] + 2, py[[1, 3]])
+    assert pixels.tolist() == [0, 1]
+    assert positions.tolist() == [1, 3]
+    pixels, positions = lyr.hit_test(trans, px[[1]] + 5, py[[1]], tolerance=3)
+    assert positions.tolist() == []
+
+
+def test_hit_test_order():
+    """Test that hits are ordered by pixel and position."""
+    rng = np.random.default_rng(0)
+    data = GeoDataFrame(geometry=GeoSeries(shapely.points(
+        rng.uniform(0, 10, 500), rng.uniform(0, 10, 500)
+    )), crs="epsg:3857")
+    lyr = GeoPandasLayer(name="test", data=data)
+    trans = ImageTransformation((0, 0, 10, 10), 100, 100)
+    pixels, positions = lyr.hit_test(
+        trans, np.array([90, 50, 10]), np.array([10, 50, 90]), tolerance=20
+    )
+    assert len(positions) > 50
+    assert np.array_equal(np.lexsort((positions, pixels)), np.arange(len(pixels)))
+
+
+def test_hit_test_reprojected(gpdata):
+    """Test hit testing a layer drawn in another crs, filtered by time range."""
+    lyr = GeoPandasLayer(name="test", data=gpdata)
+    lyr.set_crs(CRS.from_epsg(3857))
+    trans = ImageTransformation(lyr.bbox, 200, 100)
+    coords = shapely.get_coordinates(lyr.get_geometries())
+    px, py = trans.to_pixels(coords[:, 0], coords[:, 1])
+    assert lyr.hit_test(trans, px, py)[1].tolist() == [0, 1, 2, 3, 4]
+    lyr.set_time_range("a", 2, 4)
+    assert lyr.hit_test(trans, px, py)[1].tolist() == [1, 2]
@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+import pytest
+
+
+IMPORT_BUDGET = 0.1
+"""Maximum seconds for ``import pymapper``, far above what it takes."""
+
+HEAVY_MODULES = ("geopandas", "pandas", "pyproj", "pyogrio", "requests", "shapely")
+
+
+def _run(code):
+    """Run python code in a new interpreter and return its stdout and stderr."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True,
+        text=True, check=True, env=dict(os.environ),
+    )
+    return result.stdout, result.stderr
+
+
+def _import_time(stderr, module):
+    """Get the cumulative import time in seconds of a module from -X importtime."""
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and line.split("|")[-1].strip() == module:
+            return int(line.split("|")[1]) / 1e6
+    raise AssertionError(f"{module} not in the import time report")
+
+
+def test_import_budget():
+    """Test that importing pymapper stays within the import time budget."""
+    stdout, stderr = _run(
+        "import sys, pymapper; print(' '.join(sorted(sys.modules)))"
+    )
+    modules = set(stdout.split())
+    assert not modules.intersection(HEAVY_MODULES)
+    assert _import_time(stderr, "pymapper") < IMPORT_BUDGET
+
+
+@pytest.mark.parametrize("module, heavy", [
+    ("pymapper.layer", HEAVY_MODULES),
+    ("pymapper.map", ("geopandas", "pandas", "pyogrio", "requests")),
+])
+def test_import_lazy(module, heavy):
+    """Test that modules don't import the layer backends."""
+    stdout, _ = _run(f"import sys, {module}; print(' '.join(sorted(sys.modules)))")
+    assert not set(stdout.split()).intersection(heavy)
+
+
+def test_lazy_attributes():
+    """Test that the public names are imported on first access."""
+    stdout, _ = _run(
+        "import sys, pymapper; pymapper.GeoPandasLayer; "
+        "print(' '.join(sorted(sys.modules)))"
+    )
+    modules = set(stdout.split())
+    assert "pymapper.layer.geopandas" in modules
+    assert "pymapper.layer.wms" not in modules
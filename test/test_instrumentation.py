@@ -0,0 +1,61 @@
+import pickle
+from pymapper.instrumentation import (
+    Event, Instrumentation, MetricsCollector, NULL_INSTRUMENTATION,
+    get_instrumentation
+)
+
+
+def test_events():
+    """Test that stages and counts are sent to the sinks with the layer name."""
+    events = []
+    instrumentation = Instrumentation(events.append)
+    with instrumentation.layer("roads"):
+        with instrumentation.stage("draw"):
+            pass
+        instrumentation.count("vertices", 10)
+    instrumentation.count("cache_hits")
+    assert [event[:3] for event in events] == [
+        ("timing", "roads", "draw"),
+        ("count", "roads", "vertices"),
+        ("count", None, "cache_hits"),
+    ]
+    assert events[0].value >= 0
+    assert events[1].value == 10
+
+
+def test_activate():
+    """Test that the active instrumentation is the current instrumentation."""
+    instrumentation = Instrumentation()
+    assert get_instrumentation() is NULL_INSTRUMENTATION
+    with instrumentation.activate():
+        assert get_instrumentation() is instrumentation
+    assert get_instrumentation() is NULL_INSTRUMENTATION
+
+
+def test_disabled():
+    """Test that instrumentation without sinks does nothing."""
+    instrumentation = Instrumentation()
+    assert not instrumentation.enabled
+    with instrumentation.stage("draw"):
+        instrumentation.count("vertices", 10)
+    instrumentation.add_sink(lambda event: None)
+    assert instrumentation.enabled
+
+
+def test_metrics_collector():
+    """Test aggregating events and the Prometheus text format."""
+    metrics = MetricsCollector()
+    metrics(Event("timing", "roads", "draw", 0.5))
+    metrics(Event("timing", "roads", "draw", 0.25))
+    metrics(Event("count", "roads", "vertices", 10))
+    metrics(Event("count", None, "cache_hits", 1))
+    assert metrics.seconds[("roads", "draw")] == 0.75
+    assert metrics.calls[("roads", "draw")] == 2
+    text = metrics.to_prometheus()
+    assert 'pymapper_stage_seconds_total{layer="roads",stage="draw"} 0.75' in text
+    assert 'pymapper_stage_calls_total{layer="roads",stage="draw"} 2' in text
+    assert 'pymapper_vertices_total{layer="roads"} 10' in text
+    assert 'pymapper_cache_hits_total{layer=""} 1' in text
+    metrics = pickle.loads(pickle.dumps(metrics))
+    metrics.reset()
+    assert not metrics.seconds and not metrics.counts
@@ -0,0 +1,122 @@
+import numpy as np
+from cairo import ImageSurface, Context, FORMAT_ARGB32
+from geopandas import GeoDataFrame
+from shapely import wkt
+from pymapper import ImageTransformation
+from pymapper.label import (
+    CollisionGrid, LabelStyle, get_anchors, layout_labels, place_labels
+)
+from pymapper.layer import GeoPandasLayer
+from pymapper.style import CategorizedStyle, Style
+
+
+def test_collision_grid():
+    """Test detecting overlapping boxes across cells."""
+    grid = CollisionGrid(cell_size=10)
+    grid.insert((5, 5, 25, 15))
+    assert grid.collides((20, 10, 30, 20))
+    assert not grid.collides((25, 5, 35, 15))
+    assert not grid.collides((0, 20, 100, 30))
+
+
+def test_get_anchors():
+    """Test label anchors of points, lines and polygons."""
+    geoms = np.array([wkt.loads(geom) for geom in [
+        "POINT (1 2)",
+        "LINESTRING (0 0, 10 0)",
+        "POLYGON ((0 0, 4 0, 4 4, 0 4, 0 0))",
+    ]], dtype=object)
+    assert get_anchors(geoms).tolist() == [[1, 2], [5, 0], [2, 2]]
+
+
+def test_place_labels():
+    """Test that labels are placed in order without overlaps."""
+    anchors = np.array([[50.0, 50.0], [52.0, 50.0], [50.0, 52.0], [95.0, 50.0]])
+    sizes = np.array([[20.0, 10.0]] * 4)
+    is_point = np.array([True, True, True, False])
+    placed, corners = place_labels(anchors, sizes, is_point, 100, 100)
+    # The second label is placed to the left, the third collides at every
+    # position and the fourth would fall outside the image.
+    assert placed.tolist() == [0, 1]
+    assert corners.tolist() == [[54, 45], [28, 45]]
+
+
+def test_place_labels_dense():
+    """Test that no two placed labels overlap on a dense layer."""
+    rng = np.random.default_rng(0)
+    anchors = rng.uniform(0, 500, (5000, 2))
+    sizes = np.array([[30.0, 10.0]] * len(anchors))
+    placed, corners = place_labels(
+        anchors, sizes, np.ones(len(anchors), dtype=bool), 500, 500, padding=0
+    )
+    assert 0 < len(placed) < len(anchors)
+    boxes = np.hstack([corners, corners + sizes[placed]])
+    overlap = ((boxes[:, None, 0] < boxes[None, :, 2])
+               & (boxes[None, :, 0] < boxes[:, None, 2])
+               & (boxes[:, None, 1] < boxes[None, :, 3])
+               & (boxes[None, :, 1] < boxes[:, None, 3]))
+    assert overlap.sum() == len(placed)
+
+
+def test_layer_labels(gpdata):
+    """Test that the label layout follows the priority and is cached."""
+    lyr = GeoPandasLayer(
+        name="test", data=gpdata, labels=LabelStyle("b", priority="a")
+    )
+    trans = ImageTransformation(lyr.bbox, 400, 200)
+    context = Context(ImageSurface(FORMAT_ARGB32, 400, 200))
+    positions = np.arange(len(gpdata))
+    texts, corners = lyr.get_label_layout(context, positions, trans)
+    assert texts == ["e", "d", "c", "b", "a"]
+    assert len(corners) == 5
+    assert lyr.get_label_layout(context, positions, trans)[0] is texts
+    lyr.invalidate()
+    assert lyr.get_label_layout(context, positions, trans)[0] is not texts
+
+
+def test_layout_labels_outside():
+    """Test that a view without label anchors places no labels."""
+    data = GeoDataFrame({"name": ["line"]}, geometry=[
+        wkt.loads("LINESTRING (0 0, 100 0)")
+    ], crs="epsg:4326")
+    trans = ImageTransformation((0, -1, 10, 1), 100, 100)
+    context = Context(ImageSurface(FORMAT_ARGB32, 100, 100))
+    texts, corners = layout_labels(
+        context, ["line"], data.geometry.values, trans, LabelStyle("name")
+    )
+    assert texts == [] and corners.shape == (0, 2)
+    lyr = GeoPandasLayer(name="test", data=data, labels=LabelStyle("name"))
+    lyr.render(context, trans)
+
+
+def test_layer_labels_drawn_only(gpdata, monkeypatch):
+    """Test that features without a class of the style rule aren't labeled."""
+    drawn = []
+    monkeypatch.setattr(
+        "pymapper.layer.geopandas.draw_labels",
+        lambda context, texts, corners, style: drawn.extend(texts),
+    )
+    lyr = GeoPandasLayer(
+        name="test", data=gpdata, labels=LabelStyle("b"),
+        style=CategorizedStyle("b", {"a": Style(), "c": Style()}),
+    )
+    trans = ImageTransformation(lyr.bbox, 400, 200)
+    lyr.render(Context(ImageSurface(FORMAT_ARGB32, 400, 200)), trans)
+    assert sorted(drawn) == ["a", "c"]
+
+
+def test_layer_labels_time_range(gpdata, monkeypatch):
+    """Test that the cached label layout follows the time range."""
+    drawn = []
+    monkeypatch.setattr(
+        "pymapper.layer.geopandas.draw_labels",
+        lambda context, texts, corners, style: drawn.append(sorted(texts)),
+    )
+    lyr = GeoPandasLayer(name="test", data=gpdata, labels=LabelStyle("b"))
+    trans = ImageTransformation(lyr.bbox, 400, 200)
+    context = Context(ImageSurface(FORMAT_ARGB32, 400, 200))
+    lyr.set_time_range("a", 1, 3)
+    lyr.render(context, trans)
+    lyr.set_time_range("a", 3, 6)
+    lyr.render(context, trans)
+    assert drawn == [["a", "b"], ["c", "d", "e"]]
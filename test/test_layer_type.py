@@ -1,7 +1,36 @@
-from pymapper.layer import LayerType, GeoPandasLayer
+import pytest
+import pymapper.layer
+from pymapper.layer import LayerType, GeoPandasLayer, FileLayer, WMSLayer, WMTSLayer
+from pymapper.layer import RasterLayer, SnapshotLayer
+from pymapper.layer import get_layer_type, layer_types, register_layer_type
+from pymapper.layer import _LAYER_TYPES
 
 
 def test_layer_types():
     """Test the LayerType enum."""
-    assert list(LayerType.__members__.keys()) == [GeoPandasLayer.LAYER_TYPE]
-    assert LayerType[GeoPandasLayer.LAYER_TYPE].value == GeoPandasLayer
+    layers = [GeoPandasLayer, FileLayer, WMSLayer, WMTSLayer, RasterLayer,
+              SnapshotLayer]
+    assert list(LayerType.__members__.keys()) == [
+        layer.LAYER_TYPE for layer in layers
+    ]
+    for layer in layers:
+        assert LayerType[layer.LAYER_TYPE].value == layer
+
+
+def test_get_layer_type():
+    """Test getting layer classes from the registry."""
+    assert get_layer_type("WMSLayer") is WMSLayer
+    assert "FileLayer" in layer_types()
+    with pytest.raises(KeyError):
+        get_layer_type("NoLayer")
+
+
+def test_register_layer_type():
+    """Test registering a layer type by import path."""
+    register_layer_type("TestLayer", "pymapper.layer.file:FileLayer")
+    try:
+        assert get_layer_type("TestLayer") is FileLayer
+        assert pymapper.layer.LayerType["TestLayer"].value is FileLayer
+    finally:
+        del _LAYER_TYPES["TestLayer"]
+        del pymapper.layer.LayerType
@@ -1,5 +1,13 @@
+import io
+import threading
+import numpy as np
+import pytest
+import shapely
+from geopandas import GeoSeries
 from pyproj.crs.crs import CRS
-from pymapper import Map, ImageTransformation, GeoPandasLayer
+from pymapper import Map, ImageTransformation, GeoPandasLayer, RenderCache, Style
+from pymapper.instrumentation import Instrumentation, MetricsCollector
+from pymapper.layer.base import BaseLayer
 
 
 def test_has_transformation(transformation):
@@ -27,3 +35,232 @@ def test_add_layer_resets_bbox(gpdata):
     expected_bbox = list(gpdata.total_bounds)
     expected_bbox[3] = maxy+10
     assert all(_map.bbox[i] == val for i, val in enumerate(expected_bbox))
+
+
+def test_add_layer_lazy_bbox(gpdata):
+    """Test that adding layers doesn't compute their bbox until it is used."""
+    _map = Map(100, 100, crs="epsg:3857")
+    layers = [GeoPandasLayer(f"test{i}", gpdata) for i in range(3)]
+    for layer in layers:
+        _map.add_layer(layer)
+    assert all(layer._bounds is None for layer in layers)  # pylint: disable=W0212
+    assert _map.bbox == layers[0].bbox
+    transformation = _map.transformation
+    assert transformation == ImageTransformation(layers[0].bbox, 100, 100)
+    assert _map.transformation is transformation
+    _map.add_layer(GeoPandasLayer("other", gpdata.iloc[:1]))
+    assert _map.transformation is not transformation
+    assert _map.transformation == transformation
+
+
+def test_render(gpdata, tmp_path):
+    """Test rendering the map to a PNG file."""
+    _map = Map(200, 100, crs=gpdata.crs)
+    _map.add_layer(GeoPandasLayer(name="test", data=gpdata))
+    path = tmp_path / "map.png"
+    _map.render(str(path))
+    assert path.read_bytes()[:8] == b"\x89PNG\r\n\x1a\n"
+
+
+def test_render_without_bbox():
+    """Test that rendering a map without bbox raises a ValueError."""
+    _map = Map(200, 100, crs="epsg:4326")
+    with pytest.raises(ValueError):
+        _map.render(io.BytesIO())
+
+
+def test_render_cache(gpdata, monkeypatch):
+    """Test that cached images are reused until the data changes."""
+    _map = Map(200, 100, crs=gpdata.crs, cache=RenderCache())
+    lyr = GeoPandasLayer(name="test", data=gpdata)
+    _map.add_layer(lyr)
+    first = io.BytesIO()
+    _map.render(first)
+    calls = []
+    monkeypatch.setattr(lyr, "render", lambda *args: calls.append(args))
+    second = io.BytesIO()
+    _map.render(second)
+    assert not calls
+    assert first.getvalue() == second.getvalue()
+    lyr.data = gpdata.iloc[:3]
+    _map.render(io.BytesIO())
+    assert len(calls) == 1
+
+
+class BarrierLayer(BaseLayer):
+    """Layer that waits for all other layers to render at the same time."""
+    LAYER_TYPE = "BarrierLayer"
+
+    def __init__(self, name, barrier):
+        """Initialize the class."""
+        super().__init__(name, crs=CRS.from_epsg(4326), bbox=(0, 0, 10, 10))
+        self.barrier = barrier
+
+    def set_crs(self, crs):
+        """Keep the crs."""
+        self.crs = crs
+
+    def render(self, context, transformation):
+        """Wait for the other layers."""
+        self.barrier.wait(timeout=5)
+
+
+def test_render_layers_concurrently():
+    """Test that layers are rendered at the same time with multiple workers."""
+    barrier = threading.Barrier(3)
+    _map = Map(100, 100, crs=CRS.from_epsg(4326), workers=3)
+    for i in range(3):
+        _map.add_layer(BarrierLayer(f"layer{i}", barrier))
+    _map.render(io.BytesIO())
+    assert not barrier.broken
+
+
+def test_render_layers_concurrently_matches_sequential(gpdata):
+    """Test that compositing concurrently rendered layers matches sequential
+    rendering, up to rounding."""
+    images = []
+    for workers in (1, 4):
+        _map = Map(200, 100, crs=gpdata.crs, workers=workers)
+        _map.add_layer(GeoPandasLayer(name="a", data=gpdata))
+        _map.add_layer(GeoPandasLayer(
+            name="b", data=gpdata, style=Style(point_radius=8, fill=(1, 0, 0, 1))))
+        _map.add_layer(GeoPandasLayer(
+            name="c", data=gpdata, style=Style(point_radius=4, fill=(0, 1, 0, 1))))
+        surface = _map._draw(_map.transformation)  # pylint: disable=W0212
+        images.append(np.ndarray(
+            (100, 200, 4), dtype=np.uint8, buffer=surface.get_data()
+        ).astype(int))
+    assert np.abs(images[0] - images[1]).max() <= 1
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_render_instrumentation(gpdata, workers):
+    """Test that every layer reports its stages to the map instrumentation."""
+    metrics = MetricsCollector()
+    _map = Map(200, 100, crs="epsg:3857", workers=workers,
+               instrumentation=Instrumentation(metrics))
+    _map.add_layer(GeoPandasLayer(name="a", data=gpdata))
+    _map.add_layer(GeoPandasLayer(name="b", data=gpdata))
+    _map.render(io.BytesIO())
+    for name in ("a", "b"):
+        for stage in ("render", "cull", "reproject", "simplify", "path", "draw"):
+            assert metrics.calls[(name, stage)] >= 1
+        assert metrics.counts[(name, "features_considered")] == len(gpdata)
+        assert metrics.counts[(name, "vertices")] > 0
+    assert metrics.calls[(None, "encode")] == 1
+
+
+def test_render_instrumentation_cache_hits(gpdata):
+    """Test that cache hits and misses are counted."""
+    metrics = MetricsCollector()
+    _map = Map(200, 100, crs=gpdata.crs, cache=RenderCache(),
+               instrumentation=Instrumentation(metrics))
+    _map.add_layer(GeoPandasLayer(name="test", data=gpdata))
+    _map.render(io.BytesIO())
+    _map.render(io.BytesIO())
+    assert metrics.counts[(None, "cache_misses")] == 1
+    assert metrics.counts[(None, "cache_hits")] == 1
+
+
+def _pixels(surface):
+    """Get the pixels of an image surface as an array."""
+    return np.ndarray(
+        (surface.get_height(), surface.get_width(), 4), dtype=np.uint8,
+        buffer=surface.get_data()
+    ).copy()
+
+
+def test_render_incremental(gpdata, monkeypatch):
+    """Test that only the changed areas are redrawn and the result matches a full
+    render."""
+    lyr = GeoPandasLayer(name="test", data=gpdata.copy())
+    _map = Map(200, 100, crs=gpdata.crs, incremental=True)
+    _map.add_layer(lyr)
+    _map.render(io.BytesIO())
+    rows = gpdata.iloc[[1]].copy()
+    rows.geometry = GeoSeries.from_wkt(["POINT (30 -5)"], crs=gpdata.crs).values
+    lyr.update(rows)
+    bboxes = []
+    render = lyr.render
+    sizes = []
+    monkeypatch.setattr(lyr, "render", lambda context, transformation: (
+        bboxes.append(transformation.bbox), render(context, transformation),
+        sizes.append((transformation.width, transformation.height))
+    ))
+    surface = _map._draw_incremental(_map.transformation)  # pylint: disable=W0212
+    assert len(bboxes) == 2
+    assert all(width < 50 and height < 50 for width, height in sizes)
+    full_minx, _, full_maxx, _ = _map.transformation.bbox
+    for minx, _, maxx, _ in bboxes:
+        assert maxx - minx < (full_maxx - full_minx) / 4
+    full = Map(200, 100, crs=gpdata.crs)
+    full.add_layer(GeoPandasLayer(name="test", data=lyr.data))
+    expected = full._draw(full.transformation)  # pylint: disable=W0212
+    assert np.abs(
+        _pixels(surface).astype(int) - _pixels(expected).astype(int)
+    ).max() <= 1
+
+
+@pytest.mark.parametrize("output_format, magic", [("svg", b"<svg"), ("pdf", b"%PDF")])
+def test_render_vector(gpdata, tmp_path, output_format, magic):
+    """Test rendering the map to SVG and PDF files and streams."""
+    _map = Map(200, 100, crs=gpdata.crs)
+    _map.add_layer(GeoPandasLayer(name="test", data=gpdata))
+    path = tmp_path / f"map.{output_format}"
+    _map.render(str(path))
+    assert magic in path.read_bytes()[:256]
+    buffer = io.BytesIO()
+    _map.render(buffer, output_format=output_format)
+    assert magic in buffer.getvalue()[:256]
+
+
+def test_render_cache_per_output_format(gpdata):
+    """Test that cached images are kept per output format."""
+    _map = Map(200, 100, crs=gpdata.crs, cache=RenderCache())
+    _map.add_layer(GeoPandasLayer(name="test", data=gpdata))
+    png, svg = io.BytesIO(), io.BytesIO()
+    _map.render(png)
+    _map.render(svg, output_format="svg")
+    assert png.getvalue() != svg.getvalue()
+    assert _map.cache_key() != _map.cache_key(output_format="svg")
+
+
+def test_render_array(gpdata):
+    """Test rendering the map to an array of pixels."""
+    _map = Map(200, 100, crs=gpdata.crs)
+    _map.add_layer(GeoPandasLayer(name="test", data=gpdata))
+    pixels = _map.render_array()
+    assert pixels.shape == (100, 200, 4)
+    assert pixels.dtype == np.uint8
+    raw = _map.render_array(raw=True)
+    assert raw.shape == (100, 200, 4)
+    alpha = np.ascontiguousarray(raw).view(np.uint32)[..., 0] >> 24
+    assert np.array_equal(pixels[..., 3], alpha)
+
+
+def test_render_array_raw_incremental(gpdata):
+    """Test that raw arrays of incremental maps don't share the kept surface."""
+    _map = Map(200, 100, crs=gpdata.crs, incremental=True)
+    _map.add_layer(GeoPandasLayer(name="test", data=gpdata))
+    expected = _map.render_array(raw=True).copy()
+    raw = _map.render_array(raw=True)
+    raw[:] = 7
+    assert np.array_equal(_map.render_array(raw=True), expected)
+
+
+def test_hit_test(gpdata):
+    """Test finding the features of all layers under pixels."""
+    _map = Map(200, 100, crs="epsg:3857")
+    _map.add_layer(GeoPandasLayer(name="bottom", data=gpdata))
+    _map.add_layer(GeoPandasLayer(name="top", data=gpdata.iloc[:2]))
+    _map.add_layer(BarrierLayer("other", None))
+    px, py = _map.transformation.to_pixels(
+        *shapely.get_coordinates(_map.layers[0].get_geometries()).T
+    )
+    hits = _map.hit_test(px[[1, 4]], py[[1, 4]])
+    assert list(hits) == ["top", "bottom"]
+    assert hits["top"][0].tolist() == [0]
+    assert hits["top"][1].tolist() == [1]
+    assert hits["bottom"][0].tolist() == [0, 1]
+    assert hits["bottom"][1].tolist() == [1, 4]
+    assert not _map.hit_test([0], [0])
@@ -0,0 +1,173 @@
+import struct
+import numpy as np
+import pytest
+import shapely
+import shapely.affinity
+from geopandas import GeoDataFrame
+from pymapper import Map, GeoPandasLayer
+from pymapper.mvt import (
+    encode_geometries, encode_value, encode_varints, render_vector_tile, zigzag
+)
+from pymapper.tiles import tile_bounds
+from pymapper.transformation import ImageTransformation
+
+
+def _read_varint(data, pos):
+    """Read a varint, returning the value and the next position."""
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def _decode(data):
+    """Decode a protobuf message into lists of values per field number."""
+    fields, pos = {}, 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        else:
+            length, pos = _read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        fields.setdefault(number, []).append(value)
+    return fields
+
+
+def _packed(data):
+    """Decode packed varints."""
+    values, pos = [], 0
+    while pos < len(data):
+        value, pos = _read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+def _unzigzag(value):
+    """Decode a zigzag encoded integer."""
+    return (value >> 1) ^ -(value & 1)
+
+
+def test_encode_varints():
+    """Test encoding varints of one to ten bytes."""
+    data, sizes = encode_varints(np.array([0, 1, 127, 128, 300, 2 ** 63],
+                                          dtype=np.uint64))
+    assert data == (b"\x00\x01\x7f\x80\x01\xac\x02"
+                    + b"\x80" * 9 + b"\x01")
+    assert sizes.tolist() == [1, 1, 1, 2, 2, 10]
+    assert encode_varints(np.empty(0))[0] == b""
+
+
+def test_zigzag():
+    """Test zigzag encoding."""
+    assert zigzag([0, -1, 1, -2, 2]).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_encode_value():
+    """Test encoding attribute values with their type."""
+    assert _decode(encode_value("a")) == {1: [b"a"]}
+    assert _decode(encode_value(np.float64(0.5))) == {3: [struct.pack("<d", 0.5)]}
+    assert _decode(encode_value(np.int64(-3))) == {6: [5]}
+    assert _decode(encode_value(True)) == {7: [1]}
+
+
+def test_encode_geometries():
+    """Test the geometry commands of points, lines and polygons."""
+    matrix = ImageTransformation((0, 0, 10, 10), 10, 10, 0, 0).get_shapely_matrix()
+    features = encode_geometries(shapely.from_wkt([
+        "MULTIPOINT (1 9, 2 8)",
+        "LINESTRING (1 9, 1 9.1, 3 9, 3 7)",
+        "POLYGON ((0 10, 0 0, 10 0, 0 10))",
+        "POLYGON ((0 0, 0 0.1, 0.1 0, 0 0))",
+    ]), matrix)
+    assert [(position, kind) for position, kind, _ in features] == [
+        (0, 1), (1, 2), (2, 3)
+    ]
+    assert _packed(features[0][2]) == [
+        1 | 2 << 3, 2, 2, 2, 2
+    ]
+    # The repeated point is dropped after quantization.
+    assert _packed(features[1][2]) == [
+        1 | 1 << 3, 2, 2, 2 | 2 << 3, 4, 0, 0, 4
+    ]
+    # The exterior ring is clockwise in tile coordinates.
+    assert _packed(features[2][2]) == [
+        1 | 1 << 3, 0, 0, 2 | 2 << 3, 20, 20, 19, 0, 7 | 1 << 3
+    ]
+
+
+def test_render_vector_tile(gpdata):
+    """Test encoding the features and attributes of a tile."""
+    _map = Map(256, 256, crs="epsg:3857")
+    _map.add_layer(GeoPandasLayer(name="test", data=gpdata))
+    tile = _decode(render_vector_tile(_map, (0, 0, 0), extent=256))
+    layer = _decode(tile[3][0])
+    assert layer[1] == [b"test"]
+    assert layer[5] == [256]
+    assert layer[15] == [2]
+    assert layer[3] == [b"a", b"b"]
+    values = [_decode(value) for value in layer[4]]
+    features = [_decode(feature) for feature in layer[2]]
+    assert [feature[1][0] for feature in features] == [0, 1, 2, 3, 4]
+    assert all(feature[3] == [1] for feature in features)
+    tags = _packed(features[1][2][0])
+    assert values[tags[1]] == {6: [4]}
+    assert values[tags[3]] == {1: [b"b"]}
+    commands = _packed(features[0][4][0])
+    assert commands[0] == 1 | 1 << 3
+    matrix = ImageTransformation(tile_bounds(0, 0, 0), 256, 256, 0, 0)
+    point = shapely.affinity.affine_transform(
+        gpdata.to_crs(3857).geometry.values[0], matrix.get_shapely_matrix()
+    )
+    assert [_unzigzag(value) for value in commands[1:]] == [
+        round(point.x), round(point.y)
+    ]
+
+
+def test_render_vector_tile_empty(gpdata):
+    """Test that tiles without features are empty."""
+    _map = Map(256, 256, crs="epsg:3857")
+    _map.add_layer(GeoPandasLayer(name="test", data=gpdata))
+    assert render_vector_tile(_map, (10, 0, 0)) == b""
+
+
+def test_render_vector_tile_clips():
+    """Test that lines are clipped to the tile and its buffer."""
+    data = GeoDataFrame(geometry=shapely.from_wkt(
+        ["LINESTRING (-10000000 10000000, 10000000 10000000)"]
+    ), crs="epsg:3857")
+    _map = Map(256, 256, crs="epsg:3857")
+    _map.add_layer(GeoPandasLayer(name="test", data=data, simplify_tolerance=0))
+    layer = _decode(_decode(render_vector_tile(_map, (1, 0, 0), 4096, 64))[3][0])
+    commands = _packed(_decode(layer[2][0])[4][0])
+    assert _unzigzag(commands[1]) == 2052
+    assert _unzigzag(commands[1]) + _unzigzag(commands[4]) == 4096 + 64
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_render_vector_tiles(gpdata, tmp_path, workers):
+    """Test encoding a pyramid of tiles with and without worker processes."""
+    _map = Map(256, 256, crs="epsg:3857")
+    _map.add_layer(GeoPandasLayer(name="test", data=gpdata))
+    count = _map.render_vector_tiles(range(0, 3), str(tmp_path), workers=workers)
+    paths = sorted(path.relative_to(tmp_path).as_posix()
+                   for path in tmp_path.rglob("*.mvt"))
+    assert count == len(paths)
+    assert paths[0] == "0/0/0.mvt"
+    # Only tiles with features are written.
+    assert 1 < len(paths) < 1 + 4 + 16
+
+
+def test_render_vector_tiles_requires_web_mercator(gpdata):
+    """Test that vector tiles can only be encoded in web mercator."""
+    _map = Map(256, 256, crs="epsg:4326")
+    _map.add_layer(GeoPandasLayer(name="test", data=gpdata))
+    with pytest.raises(ValueError):
+        _map.render_vector_tiles([0], lambda *args: None)
@@ -0,0 +1,67 @@
+import io
+import numpy as np
+import pytest
+import cairo
+from pymapper.output import array_to_surface, get_output_format, surface_to_array
+
+
+@pytest.mark.parametrize("file, output_format, expected", [
+    ("map.png", None, "png"),
+    ("map.SVG", None, "svg"),
+    ("map.pdf", None, "pdf"),
+    ("map.jpg", None, "png"),
+    ("map.png", "pdf", "pdf"),
+    (io.BytesIO(), None, "png"),
+    (io.BytesIO(), "SVG", "svg"),
+])
+def test_get_output_format(file, output_format, expected):
+    """Test selecting the output format from the argument or the extension."""
+    assert get_output_format(file, output_format) == expected
+
+
+def test_get_output_format_unsupported():
+    """Test that unsupported output formats raise a ValueError."""
+    with pytest.raises(ValueError):
+        get_output_format(io.BytesIO(), "gif")
+
+
+def _surface(pixels):
+    """Create an ARGB32 surface with premultiplied 0xAARRGGBB pixels."""
+    height, width = pixels.shape
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    stride = surface.get_stride()
+    data = np.ndarray((height, width), dtype=np.uint32, buffer=surface.get_data(),
+                      strides=(stride, 4))
+    data[...] = pixels
+    surface.mark_dirty()
+    return surface
+
+
+def test_surface_to_array():
+    """Test converting premultiplied ARGB32 pixels to straight RGBA."""
+    surface = _surface(np.array([[0xFFFF0000, 0x80400000, 0x00000000]],
+                                dtype=np.uint32))
+    pixels = surface_to_array(surface)
+    assert pixels.shape == (1, 3, 4)
+    assert pixels.tolist() == [[[255, 0, 0, 255], [128, 0, 0, 128], [0, 0, 0, 0]]]
+
+
+def test_surface_to_array_raw():
+    """Test that the raw array is a view of the surface data."""
+    surface = _surface(np.array([[0xFF102030, 0]], dtype=np.uint32))
+    pixels = surface_to_array(surface, raw=True)
+    assert pixels.shape == (1, 2, 4)
+    assert np.shares_memory(pixels, np.frombuffer(surface.get_data(), np.uint8))
+    assert pixels[0, 0].view(np.uint32)[0] == 0xFF102030
+
+
+def test_array_to_surface():
+    """Test that array_to_surface premultiplies and surface_to_array reverses it."""
+    rgba = np.array([[[255, 0, 0, 255], [255, 128, 0, 128], [10, 20, 30, 0]]],
+                    dtype=np.uint8)
+    surface = array_to_surface(rgba)
+    raw = surface_to_array(surface, raw=True)
+    assert np.ascontiguousarray(raw).view(np.uint32)[0, :, 0].tolist() == [
+        0xFFFF0000, 0x80804000, 0
+    ]
+    assert surface_to_array(surface)[0, :2].tolist() == rgba[0, :2].tolist()
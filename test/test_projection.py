@@ -0,0 +1,31 @@
+from pyproj.crs.crs import CRS
+from pytest import approx
+import shapely
+from pymapper.projection import (
+    get_transformer, transform_bounds, transform_geometries
+)
+
+
+def test_transformer_is_cached():
+    """Test that transformers are reused."""
+    source, target = CRS.from_epsg(4326), CRS.from_epsg(3857)
+    assert get_transformer(source, target) is get_transformer(source, target)
+
+
+def test_transform_bounds():
+    """Test transforming a bbox."""
+    source, target = CRS.from_epsg(4326), CRS.from_epsg(3857)
+    minx, miny, maxx, maxy = transform_bounds((0, 0, 10, 10), source, target)
+    x, y = get_transformer(source, target).transform(10, 10)  # pylint: disable=C0103
+    assert (minx, miny) == approx((0, 0))
+    assert (maxx, maxy) == approx((x, y))
+    assert transform_bounds((0, 0, 1, 1), source, source) == (0, 0, 1, 1)
+
+
+def test_transform_geometries():
+    """Test reprojecting geometries."""
+    source, target = CRS.from_epsg(4326), CRS.from_epsg(3857)
+    geoms = shapely.points([[10, 10], [20, 20]])
+    actual = shapely.get_coordinates(transform_geometries(geoms, source, target))
+    x, y = get_transformer(source, target).transform(20, 20)  # pylint: disable=C0103
+    assert actual[1].tolist() == approx([x, y])
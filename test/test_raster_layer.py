@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+from cairo import ImageSurface, Context, FORMAT_ARGB32
+from pymapper import ImageTransformation, Map
+from pymapper.layer import RasterLayer
+from pymapper.layer import raster as raster_module
+from pymapper.layer.raster import scale_bands, select_overview
+
+
+@pytest.mark.parametrize("target, expected", [
+    (0.5, None), (1, None), (1.9, None), (2, 0), (3, 0), (4, 1), (100, 1),
+])
+def test_select_overview(target, expected):
+    """Test selecting the coarsest overview at least as detailed as the output."""
+    assert select_overview([2, 4], 1.0, target) == expected
+
+
+def test_select_overview_without_overviews():
+    """Test that rasters without overviews are read at full resolution."""
+    assert select_overview([], 1.0, 100) is None
+
+
+def test_scale_bands():
+    """Test scaling one, two, three and four bands to RGBA."""
+    data = np.array([[[0, 40, 100]]], dtype=float)
+    mask = np.array([[False, False, True]])
+    rgba = scale_bands(data, mask, 0, 100)
+    assert rgba.tolist() == [[[0, 0, 0, 255], [102, 102, 102, 255], [255, 255, 255, 0]]]
+    rgba = scale_bands(np.concatenate([data] * 3), mask, 0, 100)
+    assert rgba[0, 1].tolist() == [102, 102, 102, 255]
+    rgba = scale_bands(np.concatenate([data] * 4), np.zeros_like(mask), 0, 100)
+    assert rgba[0, :, 3].tolist() == [0, 102, 255]
+    rgba = scale_bands(np.concatenate([data] * 2), np.zeros_like(mask), 0, 100)
+    assert rgba[0, 0].tolist() == [0, 0, 0, 0]
+    with pytest.raises(ValueError):
+        scale_bands(np.concatenate([data] * 5), mask, 0, 100)
+
+
+def test_raster_layer(geotiff):
+    """Test reading the raster metadata and value range."""
+    lyr = RasterLayer(name="test", path=geotiff)
+    assert lyr.bbox == pytest.approx((0, 0, 10, 10))
+    assert lyr.bands == [1]
+    assert lyr.overviews == [2, 4]
+    assert lyr.vmin == pytest.approx(0, abs=2)
+    assert lyr.vmax == pytest.approx(255, abs=2)
+
+
+def test_raster_layer_range_sample(tmp_path, monkeypatch):
+    """Test that the value range of a raster without overviews is read from a
+    decimated sample, and that a sample without data gets the default range."""
+    rasterio = pytest.importorskip("rasterio")
+    path = str(tmp_path / "data.tif")
+    with rasterio.open(
+        path, "w", driver="GTiff", width=300, height=150, count=1,
+        dtype="float32", crs="EPSG:4326", nodata=-1,
+        transform=rasterio.transform.from_bounds(0, 0, 10, 5, 300, 150),
+    ) as dataset:
+        dataset.write(np.full((150, 300), -1, dtype=np.float32), 1)
+    shapes = []
+    read = rasterio.io.DatasetReader.read
+
+    def _read(dataset, *args, **kwargs):
+        shapes.append(kwargs.get("out_shape"))
+        return read(dataset, *args, **kwargs)
+    monkeypatch.setattr(rasterio.io.DatasetReader, "read", _read)
+    monkeypatch.setattr(raster_module, "RANGE_SAMPLE_SIZE", 100)
+    lyr = RasterLayer(name="test", path=path)
+    assert shapes == [(1, 50, 100)]
+    assert (lyr.vmin, lyr.vmax) == (0, 255)
+
+
+def test_raster_layer_get_overview(geotiff):
+    """Test that the overview matches the output pixel size."""
+    lyr = RasterLayer(name="test", path=geotiff)
+    assert lyr.get_overview(ImageTransformation(lyr.bbox, 256, 256, 0, 0)) is None
+    assert lyr.get_overview(ImageTransformation(lyr.bbox, 128, 128, 0, 0)) == 0
+    assert lyr.get_overview(ImageTransformation(lyr.bbox, 32, 32, 0, 0)) == 1
+
+
+def test_raster_layer_read_window(geotiff):
+    """Test that only the window of the bbox is read."""
+    lyr = RasterLayer(name="test", path=geotiff)
+    data = lyr.read((5, 0, 10, 10), 128, 256)
+    assert data.shape == (1, 256, 128)
+    assert data[0, 0, 0] == 128
+    assert data[0, 0, -1] == 255
+
+
+def test_raster_layer_render(geotiff):
+    """Test drawing the raster, dark on the left and light on the right."""
+    lyr = RasterLayer(name="test", path=geotiff, vmin=0, vmax=255)
+    trans = ImageTransformation((0, 0, 20, 10), 200, 100, 0, 0)
+    surface = ImageSurface(FORMAT_ARGB32, 200, 100)
+    lyr.render(Context(surface), trans)
+    surface.flush()
+    pixels = np.ndarray((100, 200, 4), np.uint8, surface.get_data())
+    assert pixels[50, 5, 3] == 255
+    assert pixels[50, 5, 0] < pixels[50, 95, 0]
+    assert pixels[50, 150, 3] == 0
+
+
+def test_raster_layer_reproject(geotiff):
+    """Test rendering the raster on a map in another crs."""
+    _map = Map(100, 100, crs="EPSG:3857")
+    _map.add_layer(RasterLayer(name="test", path=geotiff))
+    pixels = _map.render_array()
+    assert pixels[50, 50, 3] == 255
@@ -0,0 +1,95 @@
+import numpy as np
+import shapely
+from shapely import wkt
+from pytest import approx
+from cairo import ImageSurface, Context, FORMAT_ARGB32
+from pymapper import ImageTransformation
+from pymapper.render import (
+    explode, explode_parts, transform_coords, get_offsets, orient_rings,
+    paint_surface, render_geometries
+)
+from pymapper.style import Style
+
+
+def test_explode():
+    """Test splitting geometries in single part points, lines and polygons."""
+    geoms = np.array([wkt.loads(geom) for geom in [
+        "POINT (1 2)",
+        "MULTIPOINT ((1 1), (2 2))",
+        "LINESTRING (0 0, 1 1)",
+        "POLYGON ((0 0, 1 0, 1 1, 0 1, 0 0))",
+        "GEOMETRYCOLLECTION (POINT (5 5), MULTIPOLYGON (((0 0, 1 0, 1 1, 0 0))))",
+        "POINT EMPTY",
+    ]] + [None], dtype=object)
+    points, lines, polygons = explode(geoms)
+    assert len(points) == 4
+    assert len(lines) == 1
+    assert len(polygons) == 2
+
+
+def test_explode_parts():
+    """Test splitting multi-part geometries and collections into parts."""
+    parts, index = explode_parts(shapely.from_wkt([
+        "MULTIPOINT (0 0, 1 1)", None, "POINT EMPTY",
+        "GEOMETRYCOLLECTION (LINESTRING (0 0, 1 1), POINT (2 2))",
+    ]))
+    assert index.tolist() == [0, 0, 3, 3]
+    assert shapely.get_type_id(parts).tolist() == [0, 0, 1, 0]
+
+
+def test_transform_coords(transformation):
+    """Test transforming a coordinate array with a shapely matrix."""
+    _, _, _, bbox, width, height, marginx, marginy = transformation
+    trans = ImageTransformation(bbox, width, height, marginx, marginy)
+    coords = np.array([[2150.0, 2015.0], [5000.0, 3500.0]])
+    actual = transform_coords(coords, trans.get_shapely_matrix())
+    expected = shapely.get_coordinates(shapely.affinity.affine_transform(
+        shapely.multipoints(coords), trans.get_shapely_matrix()))
+    assert actual.ravel().tolist() == approx(expected.ravel().tolist())
+    inplace = transform_coords(coords, trans.get_shapely_matrix(), out=coords)
+    assert inplace is coords
+    assert coords.ravel().tolist() == approx(expected.ravel().tolist())
+
+
+def test_orient_rings():
+    """Test that shells and holes get opposite orientations."""
+    polygon = wkt.loads(
+        "POLYGON ((0 0, 0 10, 10 10, 10 0, 0 0), (2 2, 4 2, 4 4, 2 4, 2 2))"
+    )
+    rings = shapely.get_rings(polygon)
+    coords, index = shapely.get_coordinates(rings, return_index=True)
+    offsets = get_offsets(index, len(rings))
+    oriented = orient_rings(coords, offsets, np.array([True, False]))
+    shell = shapely.linearrings(oriented[offsets[0]:offsets[1]])
+    hole = shapely.linearrings(oriented[offsets[1]:offsets[2]])
+    assert shapely.is_ccw(shell) != shapely.is_ccw(hole)
+
+
+def test_render_geometries():
+    """Test that rendering geometries draws pixels at their location."""
+    trans = ImageTransformation((0, 0, 10, 10), 100, 100, 0, 0)
+    surface = ImageSurface(FORMAT_ARGB32, 100, 100)
+    context = Context(surface)
+    geoms = np.array([
+        wkt.loads("POLYGON ((0 0, 5 0, 5 5, 0 5, 0 0), (1 1, 1 4, 4 4, 4 1, 1 1))")
+    ])
+    render_geometries(context, geoms, trans, Style(fill=(1, 0, 0, 1), stroke=None))
+    surface.flush()
+    data = np.ndarray((100, 100, 4), dtype=np.uint8, buffer=surface.get_data())
+    assert data[95, 5, 3] == 255  # inside the shell
+    assert data[75, 25, 3] == 0  # inside the hole
+    assert data[5, 95, 3] == 0  # outside the polygon
+
+
+def test_paint_surface_edges():
+    """Test that scaled images are opaque up to their edges and clipped there."""
+    image = ImageSurface(FORMAT_ARGB32, 2, 2)
+    np.ndarray((2, 2, 4), dtype=np.uint8, buffer=image.get_data())[:] = 255
+    image.mark_dirty()
+    surface = ImageSurface(FORMAT_ARGB32, 40, 40)
+    trans = ImageTransformation((-5, -5, 15, 15), 40, 40, 0, 0)
+    paint_surface(Context(surface), image, (0, 0, 10, 10), trans)
+    surface.flush()
+    data = np.ndarray((40, 40, 4), dtype=np.uint8, buffer=surface.get_data())
+    assert (data[10:30, 10:30, 3] == 255).all()
+    assert data[9, 9, 3] == 0 and data[30, 30, 3] == 0
@@ -0,0 +1,146 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import urlopen
+import pytest
+from pymapper import Map, GeoPandasLayer
+from pymapper import server as server_module
+from pymapper.server import ServerMetrics, TileServer
+
+
+@pytest.fixture(name="tile_map")
+def fixture_tile_map(gpdata):
+    """A web mercator map of the test data."""
+    _map = Map(256, 256, crs="epsg:3857")
+    _map.add_layer(GeoPandasLayer(name="test", data=gpdata))
+    return _map
+
+
+def _start(server):
+    """Run a server on a free port in a background event loop."""
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def _run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start(port=0))
+        started.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=_run, daemon=True)
+    thread.start()
+    started.wait(timeout=10)
+
+    def _stop():
+        asyncio.run_coroutine_threadsafe(server.close(), loop).result(timeout=10)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=10)
+    return f"http://127.0.0.1:{server.port}", _stop
+
+
+def _get(url):
+    """Get the status, content type and body of a URL."""
+    try:
+        with urlopen(url, timeout=10) as response:
+            return response.status, response.headers["Content-Type"], response.read()
+    except HTTPError as error:
+        return error.code, error.headers["Content-Type"], error.read()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_serve_tiles(tile_map, workers):
+    """Test serving tiles from the cache after the first render."""
+    server = TileServer(tile_map, workers=workers)
+    url, stop = _start(server)
+    try:
+        status, content_type, body = _get(f"{url}/1/0/0.png")
+        assert status == 200
+        assert content_type == "image/png"
+        assert body[:4] == b"\x89PNG"
+        assert _get(f"{url}/1/0/0.png")[2] == body
+        assert _get(f"{url}/1/2/0.png")[0] == 404
+        assert _get(f"{url}/nothing")[0] == 404
+    finally:
+        stop()
+    assert server.metrics.counts["renders"] == 1
+    assert server.metrics.counts["cache_hits"] == 1
+    assert server.metrics.counts["requests"] == 4
+
+
+def test_serve_getmap(tile_map):
+    """Test GetMap requests and their validation."""
+    url, stop = _start(TileServer(tile_map, workers=1, max_image_size=512))
+    query = "REQUEST=GetMap&CRS=EPSG:3857&BBOX=0,0,1000000,1000000"
+    try:
+        status, content_type, body = _get(
+            f"{url}/wms?{query}&WIDTH=200&HEIGHT=100&FORMAT=image/png"
+        )
+        assert status == 200
+        assert content_type == "image/png"
+        assert body[:4] == b"\x89PNG"
+        status, content_type, _ = _get(
+            f"{url}/wms?{query}&WIDTH=200&HEIGHT=100&FORMAT=image/svg%2Bxml"
+        )
+        assert (status, content_type) == (200, "image/svg+xml")
+        assert _get(f"{url}/wms?{query}&WIDTH=2000&HEIGHT=100")[0] == 400
+        assert _get(f"{url}/wms?{query}&WIDTH=200")[0] == 400
+        assert _get(f"{url}/wms?{query.replace('3857', '4326')}"
+                    "&WIDTH=200&HEIGHT=100")[0] == 400
+        assert _get(f"{url}/wms?{query}&WIDTH=200&HEIGHT=100&FORMAT=image/gif")[0] \
+            == 400
+    finally:
+        stop()
+
+
+def test_serve_deduplicates(tile_map, monkeypatch):
+    """Test that concurrent requests for the same tile share a single render."""
+    renders = []
+    render_request = server_module.render_request
+
+    def _slow_render(_map, request):
+        renders.append(request)
+        time.sleep(0.3)
+        return render_request(_map, request)
+
+    monkeypatch.setattr(server_module, "render_request", _slow_render)
+    server = TileServer(tile_map, workers=1)
+    url, stop = _start(server)
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(_get, [f"{url}/2/1/1.png"] * 8))
+    finally:
+        stop()
+    assert len(renders) == 1
+    assert all(result[0] == 200 for result in results)
+    assert server.metrics.counts["deduplicated"] == 7
+
+
+def test_serve_metrics(tile_map):
+    """Test the metrics endpoint."""
+    url, stop = _start(TileServer(tile_map, workers=1))
+    try:
+        _get(f"{url}/0/0/0.png")
+        status, content_type, body = _get(f"{url}/metrics")
+    finally:
+        stop()
+    assert status == 200
+    assert content_type.startswith("text/plain")
+    text = body.decode()
+    assert "pymapper_server_requests_total 2" in text
+    assert "pymapper_server_renders_total 1" in text
+    assert 'pymapper_server_request_seconds_bucket{le="+Inf"} 1' in text
+
+
+def test_server_metrics_histogram():
+    """Test the cumulative latency histogram."""
+    metrics = ServerMetrics()
+    for seconds in (0.001, 0.02, 0.02, 100):
+        metrics.observe(seconds)
+    text = metrics.to_prometheus("test")
+    assert 'test_request_seconds_bucket{le="0.005"} 1' in text
+    assert 'test_request_seconds_bucket{le="0.025"} 3' in text
+    assert 'test_request_seconds_bucket{le="10.0"} 3' in text
+    assert 'test_request_seconds_bucket{le="+Inf"} 4' in text
+    assert "test_request_seconds_count 4" in text
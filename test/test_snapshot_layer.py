@@ -0,0 +1,128 @@
+import json
+import pickle
+import numpy as np
+import pytest
+import shapely
+from geopandas import GeoDataFrame
+from pymapper import Map
+from pymapper.layer import GeoPandasLayer, SnapshotLayer
+from pymapper.layer.snapshot import (
+    HOLE, LINE, POINT, SHELL, PackedIndex, gather_ranges
+)
+from pymapper.style import ClassifiedStyle, Style
+
+
+@pytest.fixture(name="shapes")
+def fixture_shapes():
+    """Points, lines and polygons with holes and multiple parts."""
+    geometries = shapely.from_wkt([
+        "POINT (1 1)",
+        "LINESTRING (0 0, 2 3, 4 1)",
+        "POLYGON ((5 5, 9 5, 9 9, 5 9, 5 5), (6 6, 7 6, 7 7, 6 6))",
+        "MULTIPOLYGON (((0 5, 1 5, 1 6, 0 5)), ((2 5, 3 5, 3 6, 2 5)))",
+        "GEOMETRYCOLLECTION (POINT (8 1), LINESTRING (6 1, 8 3))",
+    ])
+    return GeoDataFrame({"value": [1.0, 2.0, 3.0, 4.0, None]}, geometry=geometries,
+                        crs="epsg:4326")
+
+
+def test_gather_ranges():
+    """Test gathering the elements of groups."""
+    positions, offsets = gather_ranges(np.array([0, 2, 3, 6]), np.array([2, 0]))
+    assert positions.tolist() == [3, 4, 5, 0, 1]
+    assert offsets.tolist() == [0, 3, 5]
+
+
+def test_packed_index():
+    """Test that the packed index finds the same boxes as a full scan."""
+    rng = np.random.default_rng(0)
+    corners = rng.uniform(0, 100, (1000, 2))
+    bounds = np.hstack([corners, corners + rng.uniform(0, 5, (1000, 2))])
+    bounds[::100] = np.nan
+    index = PackedIndex.build(bounds, node_size=4)
+    for bbox in [(10, 10, 20, 30), (0, 0, 100, 100), (-10, -10, -5, -5)]:
+        expected = np.flatnonzero(
+            (bounds[:, 0] <= bbox[2]) & (bounds[:, 2] >= bbox[0])
+            & (bounds[:, 1] <= bbox[3]) & (bounds[:, 3] >= bbox[1])
+        )
+        assert index.query(bbox).tolist() == expected.tolist()
+    assert PackedIndex.build(np.empty((0, 4))).query((0, 0, 1, 1)).size == 0
+
+
+def test_write_snapshot(shapes, tmp_path):
+    """Test writing the reprojected geometries as flat arrays."""
+    lyr = GeoPandasLayer(name="test", data=shapes)
+    lyr.set_crs("epsg:3857")
+    lyr.write_snapshot(str(tmp_path))
+    with open(tmp_path / "snapshot.json", encoding="utf-8") as file:
+        metadata = json.load(file)
+    assert metadata["name"] == "test"
+    assert metadata["bbox"] == pytest.approx(lyr.bbox)
+    assert "codes" not in metadata["arrays"]
+    snapshot = SnapshotLayer(None, str(tmp_path))
+    assert snapshot.name == "test"
+    assert snapshot.crs == lyr.crs
+    assert snapshot.styles == [lyr.style]
+    coords = snapshot.get_array("coords")
+    assert isinstance(coords, np.memmap)
+    assert coords == pytest.approx(shapely.get_coordinates(lyr.get_geometries()))
+    assert snapshot.get_array("part_types").tolist() == [
+        POINT, LINE, SHELL, HOLE, SHELL, SHELL, POINT, LINE
+    ]
+    assert snapshot.get_array("feature_offsets").tolist() == [0, 1, 2, 4, 6, 8]
+    assert snapshot.get_array("codes") is None
+
+
+def test_snapshot_layer_crs(shapes, tmp_path):
+    """Test that snapshots are only drawn in their own crs."""
+    snapshot = SnapshotLayer("test", GeoPandasLayer(
+        name="test", data=shapes
+    ).write_snapshot(str(tmp_path)))
+    Map(100, 100, crs="epsg:4326").add_layer(snapshot)
+    with pytest.raises(ValueError):
+        Map(100, 100, crs="epsg:3857").add_layer(snapshot)
+
+
+def test_snapshot_layer_pickle(shapes, tmp_path):
+    """Test that pickling only keeps the path, not the arrays."""
+    snapshot = SnapshotLayer("test", GeoPandasLayer(
+        name="test", data=shapes
+    ).write_snapshot(str(tmp_path)))
+    snapshot.prepare()
+    snapshot.index.query((0, 0, 1, 1))
+    state = snapshot.__getstate__()
+    assert not state["_arrays"] and state["_index"] is None
+    copy = pickle.loads(pickle.dumps(snapshot))
+    assert copy.query_bbox((0, 0, 2, 2)).tolist() == [0, 1]
+
+
+def test_snapshot_layer_cull(shapes, tmp_path):
+    """Test culling features with the packed index and by size."""
+    lyr = GeoPandasLayer(name="test", data=shapes)
+    snapshot = SnapshotLayer("test", lyr.write_snapshot(str(tmp_path)))
+    assert snapshot.query_bbox(snapshot.bbox).tolist() == [0, 1, 2, 3, 4]
+    assert snapshot.query_bbox((5.5, 5.5, 6, 6)).tolist() == [2]
+    positions = np.arange(5)
+    assert snapshot.filter_small(positions, 3.5).tolist() == [0, 1, 2]
+    assert snapshot.filter_small(positions, 3.5).tolist() == lyr.filter_small(
+        positions, lyr.get_geometries(), 3.5
+    ).tolist()
+
+
+@pytest.mark.parametrize("style", [
+    Style(),
+    ClassifiedStyle("value", [Style(fill=(1, 0, 0, 1)), Style(fill=(0, 1, 0, 1))],
+                    breaks=[2, 4]),
+])
+def test_snapshot_layer_render(shapes, tmp_path, style):
+    """Test that a snapshot draws the same image as the layer."""
+    lyr = GeoPandasLayer(name="test", data=shapes, style=style,
+                         simplify_tolerance=0, min_feature_size=0)
+    expected = Map(100, 100, crs="epsg:3857")
+    expected.add_layer(lyr)
+    snapshot = SnapshotLayer("test", lyr.write_snapshot(str(tmp_path)))
+    assert (snapshot.get_array("codes") is None) == isinstance(style, Style)
+    _map = Map(100, 100, crs="epsg:3857")
+    _map.add_layer(snapshot)
+    assert _map.transformation == expected.transformation
+    assert np.array_equal(_map.render_array(), expected.render_array())
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pymapper.style import (
+    Style, CategorizedStyle, ClassifiedStyle, get_symbol_extent
+)
+
+
+RED = Style(fill=(1, 0, 0, 1))
+GREEN = Style(fill=(0, 1, 0, 1))
+BLUE = Style(fill=(0, 0, 1, 1))
+
+
+def test_style_key():
+    """Test that equal styles have equal keys and hashes."""
+    assert Style().key() == Style().key()
+    assert hash(Style()) == hash(Style())
+    assert RED != GREEN
+
+
+def test_categorized_style():
+    """Test assigning styles by category."""
+    rule = CategorizedStyle("kind", {"a": RED, "b": GREEN})
+    codes, styles = rule.classify(pd.Series(["b", "a", "c", None]))
+    assert codes.tolist() == [1, 0, -1, -1]
+    assert styles == [RED, GREEN]
+    rule = CategorizedStyle("kind", {"a": RED, "b": GREEN}, default=BLUE)
+    codes, styles = rule.classify(pd.Series(["b", "a", "c"]))
+    assert codes.tolist() == [1, 0, 2]
+    assert styles == [RED, GREEN, BLUE]
+
+
+def test_classified_style_breaks():
+    """Test classifying values with explicit breaks."""
+    rule = ClassifiedStyle("value", [RED, GREEN, BLUE], breaks=[1, 2, 3])
+    codes, styles = rule.classify(pd.Series([0.5, 1, 1.5, 3, 4, np.nan]))
+    assert codes.tolist() == [0, 0, 1, 2, 2, -1]
+    assert styles == [RED, GREEN, BLUE]
+    assert rule.key() != ClassifiedStyle("value", [RED, GREEN, BLUE]).key()
+
+
+def test_classified_style_scheme():
+    """Test classifying values with a mapclassify scheme."""
+    pytest.importorskip("mapclassify")
+    rule = ClassifiedStyle("value", [RED, GREEN], scheme="Quantiles")
+    codes, _ = rule.classify(pd.Series([1.0, 2, 3, 4]))
+    assert codes.tolist() == [0, 0, 1, 1]
+    assert rule.breaks.tolist() == [2.5, 4.0]
+
+
+def test_get_symbol_extent():
+    """Test the symbol extent of styles and style rules."""
+    assert get_symbol_extent(Style(line_width=2, point_radius=3)) == 4
+    rule = CategorizedStyle("a", {"x": RED}, default=Style(point_radius=6))
+    assert get_symbol_extent(rule) == 6.5
+    assert get_symbol_extent(ClassifiedStyle("a", [RED, GREEN], breaks=[1, 2])) == 3.5
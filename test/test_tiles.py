@@ -0,0 +1,93 @@
+import pytest
+from pytest import approx
+from pymapper import Map, GeoPandasLayer
+from pymapper.tiles import (
+    WORLD_SIZE, map_batched, tile_bounds, tile_transformation, tiles_for_bbox
+)
+
+
+def test_tile_bounds():
+    """Test the web mercator bounds of tiles."""
+    half = WORLD_SIZE / 2
+    assert tile_bounds(0, 0, 0) == approx((-half, -half, half, half))
+    assert tile_bounds(1, 0, 0) == approx((-half, 0, 0, half))
+    assert tile_bounds(1, 1, 1) == approx((0, -half, half, 0))
+
+
+def test_tile_transformation():
+    """Test that tile transformations have no margin."""
+    trans = tile_transformation(3, 2, 5, tile_size=512)
+    assert trans.bbox == approx(tile_bounds(3, 2, 5))
+    assert trans.width == trans.height == 512
+
+
+def test_tiles_for_bbox():
+    """Test finding the tiles covering a bbox."""
+    assert list(tiles_for_bbox((-1, -1, 1, 1), 0)) == [(0, 0, 0)]
+    assert list(tiles_for_bbox((-1, -1, 1, 1), 1)) == [
+        (1, 0, 0), (1, 0, 1), (1, 1, 0), (1, 1, 1)
+    ]
+    assert list(tiles_for_bbox((1, 1, 2, 2), 1)) == [(1, 1, 0)]
+
+
+def test_map_batched(monkeypatch):
+    """Test that only a bounded batch of items is submitted at a time."""
+    batches = []
+
+    class Executor:  # pylint: disable=R0903
+        """Executor mapping in the current process, recording the batches."""
+        def __init__(self, max_workers, initializer, initargs):
+            assert max_workers == 2 and initializer is None and not initargs
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        @staticmethod
+        def map(func, *iterables, chunksize=1):
+            """Map ``func`` over the items."""
+            assert chunksize == 2
+            batches.append(len(iterables[0]))
+            return map(func, *iterables)
+
+    monkeypatch.setattr("pymapper.tiles.ProcessPoolExecutor", Executor)
+    consumed = []
+    items = (consumed.append(item) or item for item in range(50))
+    results = map_batched(pow, items, 2, workers=2, chunksize=2)
+    assert next(results) == 0
+    assert len(consumed) == 16
+    assert list(results) == [item ** 2 for item in range(1, 50)]
+    assert batches == [16, 16, 16, 2]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_render_tiles(gpdata, workers):
+    """Test rendering tiles in process and with worker processes."""
+    _map = Map(256, 256, crs="epsg:3857")
+    _map.add_layer(GeoPandasLayer(name="test", data=gpdata))
+    tiles = {}
+
+    def _sink(z, x, y, data):  # pylint: disable=C0103
+        tiles[(z, x, y)] = data
+
+    count = _map.render_tiles(range(0, 2), _sink, workers=workers)
+    assert count == len(tiles) == 5
+    assert all(data[:4] == b"\x89PNG" for data in tiles.values())
+
+
+def test_render_tiles_to_directory(gpdata, tmp_path):
+    """Test writing tiles to a directory tree."""
+    _map = Map(256, 256, crs="epsg:3857")
+    _map.add_layer(GeoPandasLayer(name="test", data=gpdata))
+    _map.render_tiles([0], str(tmp_path), workers=1)
+    assert (tmp_path / "0" / "0" / "0.png").exists()
+
+
+def test_render_tiles_requires_web_mercator(gpdata, tmp_path):
+    """Test that tiles can only be rendered in web mercator."""
+    _map = Map(256, 256, crs="epsg:4326")
+    _map.add_layer(GeoPandasLayer(name="test", data=gpdata))
+    with pytest.raises(ValueError):
+        _map.render_tiles([0], str(tmp_path), workers=1)
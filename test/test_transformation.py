@@ -1,6 +1,8 @@
+import numpy as np
 from pytest import approx
 from cairo import Matrix
 from pymapper import ImageTransformation
+from pymapper.render import transform_coords
 
 
 def test_create_transformation(transformation):  # pylint: disable=R0914
@@ -64,3 +66,67 @@ def test_shapely_matrix(transformation):  # pylint: disable=R0914
     trans = ImageTransformation(bbox, width, height, marginx, marginy)
     actual = trans.get_shapely_matrix()
     assert actual == [xx, xy, yx, yy, approx(x0), approx(y0)]
+
+
+def test_bbox(transformation):
+    """Test the actual bbox including margins."""
+    _, extentx, extenty, bbox, width, height, marginx, marginy = transformation
+    trans = ImageTransformation(bbox, width, height, marginx, marginy)
+    minx, miny, maxx, maxy = trans.bbox
+    assert maxx - minx == approx(extentx)
+    assert maxy - miny == approx(extenty)
+    assert minx < bbox[0] and miny < bbox[1] and maxx > bbox[2] and maxy > bbox[3]
+
+
+def test_hash(transformation):
+    """Test that equal transformations have equal hashes and keys."""
+    _, _, _, bbox, width, height, marginx, marginy = transformation
+    trans = ImageTransformation(bbox, width, height, marginx, marginy)
+    trans2 = ImageTransformation(bbox, width, height, marginx, marginy)
+    trans3 = ImageTransformation(bbox, width, height, 0, 0)
+    assert hash(trans) == hash(trans2)
+    assert trans.key() == trans2.key()
+    assert trans.key() != trans3.key()
+    assert len({trans, trans2, trans3}) == 2
+
+
+def test_get_resolution():
+    """Test the size of a pixel in map units."""
+    trans = ImageTransformation((0, 0, 100, 50), 200, 100, 0, 0)
+    assert trans.get_resolution() == approx(0.5)
+
+
+def test_to_pixels(transformation):  # pylint: disable=R0914
+    """Test transforming coordinate arrays to pixels like the shapely matrix."""
+    _, _, _, bbox, width, height, marginx, marginy = transformation
+    trans = ImageTransformation(bbox, width, height, marginx, marginy)
+    xs, ys = np.random.default_rng(0).uniform(bbox[:2], bbox[2:], (100, 2)).T
+    px, py = trans.to_pixels(xs, ys)
+    expected = transform_coords(np.column_stack([xs, ys]),
+                                trans.get_shapely_matrix())
+    assert np.allclose(np.column_stack([px, py]), expected)
+    minx, miny, maxx, maxy = trans.bbox
+    assert trans.to_pixels(minx, maxy) == (approx(0), approx(0))
+    assert trans.to_pixels(maxx, miny) == (approx(width), approx(height))
+
+
+def test_to_world(transformation):
+    """Test that to_world and the inverse matrix undo to_pixels."""
+    _, _, _, bbox, width, height, marginx, marginy = transformation
+    trans = ImageTransformation(bbox, width, height, marginx, marginy)
+    px, py = np.random.default_rng(0).uniform((0, 0), (width, height), (100, 2)).T
+    xs, ys = trans.to_world(px, py)
+    assert np.allclose(trans.to_pixels(xs, ys), (px, py))
+    coords = transform_coords(np.column_stack([px, py]), trans.get_inverse_matrix())
+    assert np.allclose(coords, np.column_stack([xs, ys]))
+
+
+def test_window():
+    """Test that a window maps the world to the pixels of a rectangle."""
+    trans = ImageTransformation((0, 0, 10, 10), 100, 100, 0, 0)
+    window = trans.window(20, 30, 60, 50)
+    assert (window.width, window.height) == (40, 20)
+    assert window.bbox == approx((2, 5, 6, 7))
+    assert window.get_resolution() == approx(trans.get_resolution())
+    px, py = window.to_pixels([2, 6], [7, 5])
+    assert px == approx([0, 40]) and py == approx([0, 20])
@@ -0,0 +1,68 @@
+from urllib.parse import urlparse, parse_qs
+import pytest
+from cairo import ImageSurface, Context, FORMAT_ARGB32
+from pymapper import ImageTransformation
+from pymapper.layer import WMSLayer, WMTSLayer
+from pymapper.tiles import tile_bounds, tile_transformation
+
+
+def test_wms_get_map_url():
+    """Test the GetMap request parameters, including the 1.3.0 axis order."""
+    lyr = WMSLayer(name="test", url="http://localhost/wms?MAP=x", layers=["a", "b"],
+                   bbox=(-10, -10, 10, 10))
+    trans = ImageTransformation((0, 10, 20, 30), 200, 200, 0, 0)
+    params = parse_qs(urlparse(lyr.get_map_url(trans)).query)
+    assert params["MAP"] == ["x"]
+    assert params["LAYERS"] == ["a,b"]
+    assert params["CRS"] == ["EPSG:4326"]
+    assert params["BBOX"] == ["10.0,0.0,30.0,20.0"]
+    assert params["WIDTH"] == params["HEIGHT"] == ["200"]
+    lyr.set_crs("epsg:3857")
+    params = parse_qs(urlparse(lyr.get_map_url(trans)).query)
+    assert params["BBOX"] == ["0.0,10.0,20.0,30.0"]
+
+
+def test_wms_render(tile_server):
+    """Test that rendering fetches one image, and reuses the cached response."""
+    url, paths = tile_server
+    lyr = WMSLayer(name="test", url=f"{url}/wms", layers=["a"], bbox=(0, 0, 10, 10))
+    trans = ImageTransformation(lyr.bbox, 256, 256, 0, 0)
+    surface = ImageSurface(FORMAT_ARGB32, 256, 256)
+    lyr.render(Context(surface), trans)
+    lyr.render(Context(surface), trans)
+    lyr.close()
+    assert len(paths) == 1
+    assert paths[0].startswith("/wms?")
+
+
+def test_wmts_zoom():
+    """Test picking the zoom level matching the output resolution."""
+    lyr = WMTSLayer(name="test", url="http://localhost/{z}/{x}/{y}.png", max_zoom=5)
+    assert lyr.get_zoom(tile_transformation(3, 1, 1)) == 3
+    assert lyr.get_zoom(tile_transformation(3, 1, 1, tile_size=512)) == 4
+    assert lyr.get_zoom(tile_transformation(8, 1, 1)) == 5
+
+
+def test_wmts_render(tile_server):
+    """Test fetching, caching and prefetching tiles."""
+    url, paths = tile_server
+    lyr = WMTSLayer(name="test", url=url + "/{z}/{x}/{y}.png", prefetch=1)
+    minx, miny, _, _ = tile_bounds(2, 1, 1)
+    _, _, maxx, maxy = tile_bounds(2, 2, 2)
+    trans = ImageTransformation((minx, miny, maxx, maxy), 512, 512, 0, 0)
+    surface = ImageSurface(FORMAT_ARGB32, 512, 512)
+    lyr.render(Context(surface), trans)
+    lyr.close()
+    assert sorted(paths[:4]) == ["/2/1/1.png", "/2/1/2.png", "/2/2/1.png", "/2/2/2.png"]
+    assert len(paths) == 16
+    lyr.render(Context(surface), trans)
+    lyr.close()
+    assert len(paths) == 16
+
+
+def test_wmts_requires_web_mercator():
+    """Test that WMTS layers can't be reprojected."""
+    lyr = WMTSLayer(name="test", url="http://localhost/{z}/{x}/{y}.png")
+    lyr.set_crs("epsg:3857")
+    with pytest.raises(ValueError):
+        lyr.set_crs("epsg:4326")